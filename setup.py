@@ -9,7 +9,9 @@ setup(name='pybot_abelec',
       description='Support for AB Electronics Raspberry expansion boards',
       install_requires=['pybot_core'],
       extra_requires={
-          'RasPi': ['pybot_raspi']
+          'RasPi': ['pybot_raspi'],
+          'NumPy': ['numpy'],
+          'SMBus2': ['smbus2']
       },
       license='LGPL',
       author='Eric Pascual',
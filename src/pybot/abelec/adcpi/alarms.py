@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides the evaluation of threshold alarms on the ADC inputs.
+
+Three kinds of alarms are supported :
+
+    - ``high`` : raised when the input value goes above the threshold
+    - ``low`` : raised when the input value goes below the threshold
+    - ``rate`` : raised when the absolute rate of change of the input value (units per second)
+      goes above the threshold
+
+An alarm is raised only if its condition persists during its ``delay``, and is cleared when the
+value is back on the safe side of the threshold by more than its ``hysteresis``. A latching alarm
+stays raised until it is acknowledged, even if its condition disappeared in the meantime.
+
+The alarm definitions are compiled into arrays (input index, kind, threshold, hysteresis, delay),
+and the alarms states are kept in arrays too, so that all the alarms are evaluated by a fixed
+number of vectorized operations, whatever their count. Only the alarms changing state are then
+processed individually, for producing the events.
+
+This module requires NumPy.
+
+>>> engine = AlarmEngine(['current', 'vbat'], [
+>>>     AlarmDefinition('over_current', 'current', 'high', 5., hysteresis=0.2, delay=100, latching=True),
+>>>     AlarmDefinition('low_battery', 'vbat', 'low', 11.5, hysteresis=0.3),
+>>> ])
+>>> events = engine.evaluate([current, vbat])
+>>> events = engine.acknowledge('over_current')
+
+The :py:class:`pybot.abelec.adcpi.control.ADCPiController` evaluates the alarms defined in its
+configuration after each update of the inputs.
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['AlarmDefinition', 'AlarmEvent', 'AlarmEngine']
+
+from collections import namedtuple
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+KIND_HIGH, KIND_LOW, KIND_RATE = 0, 1, 2
+_kinds = {'high': KIND_HIGH, 'low': KIND_LOW, 'rate': KIND_RATE}
+
+
+class AlarmDefinition(namedtuple('AlarmDefinition', 'name input kind threshold hysteresis delay latching')):
+    """ The definition of an alarm.
+
+    ``threshold`` and ``hysteresis`` are expressed in the input units (volts, or engineering
+    units if the input is calibrated), per second for rate alarms. ``delay`` is expressed in ms.
+    """
+    __slots__ = ()
+
+    def __new__(cls, name, input, kind, threshold, hysteresis=0., delay=0, latching=False):
+        if not name:
+            raise ValueError('name is mandatory')
+        if kind not in _kinds:
+            raise ValueError('invalid alarm kind : %s' % kind)
+        if hysteresis < 0:
+            raise ValueError('invalid hysteresis : %s' % hysteresis)
+        if delay < 0:
+            raise ValueError('invalid delay : %s' % delay)
+        return super(AlarmDefinition, cls).__new__(
+            cls, name, input, kind, float(threshold), float(hysteresis), delay, bool(latching)
+        )
+
+    @classmethod
+    def from_dict(cls, d):
+        try:
+            return AlarmDefinition(**d)
+        except TypeError:
+            raise ValueError('invalid alarm definition : %s' % (d,))
+
+
+class AlarmEvent(namedtuple('AlarmEvent', 'name raised timestamp value')):
+    """ A change of an alarm state.
+
+    ``raised`` is True when the alarm is raised and False when it is cleared. ``value`` is the
+    value which triggered the change (None for a clear caused by an acknowledgement).
+    """
+    __slots__ = ()
+
+
+class AlarmEngine(object):
+    """ Evaluates a set of alarms defined on a set of inputs.
+
+    The engine can be used from several threads, alarms being for instance evaluated by an
+    acquisition thread while acknowledged by the application.
+    """
+    def __init__(self, input_names, definitions):
+        """
+        :param input_names: the names of the inputs, giving the order of the values passed to
+        :py:meth:`evaluate`
+        :param definitions: the alarm definitions (AlarmDefinition instances)
+        :raise: ValueError if a definition is not valid
+        """
+        if np is None:
+            raise ValueError('cannot continue since NumPy is not available')
+
+        self._input_names = list(input_names)
+        input_index = dict((name, i) for i, name in enumerate(self._input_names))
+        self._definitions = list(definitions)
+        if not self._definitions:
+            raise ValueError('no alarm defined')
+        self._names = [d.name for d in self._definitions]
+        if len(set(self._names)) != len(self._names):
+            raise ValueError('duplicate alarm names')
+        self._index = dict((name, i) for i, name in enumerate(self._names))
+        try:
+            self._inputs = np.array([input_index[d.input] for d in self._definitions], dtype=np.intp)
+        except KeyError as e:
+            raise ValueError('alarm defined on unknown input : %s' % e)
+
+        kinds = np.array([_kinds[d.kind] for d in self._definitions])
+        self._is_rate = kinds == KIND_RATE
+        # conditions are evaluated as "sign * (value - threshold) > 0"
+        self._signs = np.where(kinds == KIND_LOW, -1., 1.)
+        self._thresholds = np.array([d.threshold for d in self._definitions])
+        self._hystereses = np.array([d.hysteresis for d in self._definitions])
+        self._delays = np.array([d.delay / 1000. for d in self._definitions])
+        self._latching = np.array([d.latching for d in self._definitions], dtype=bool)
+        self._uses_rates = bool(self._is_rate.any())
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def input_names(self):
+        return self._input_names
+
+    @property
+    def names(self):
+        return self._names
+
+    def reset(self):
+        """ Clears all the alarms, without producing events. """
+        count = len(self._definitions)
+        inputs_count = len(self._input_names)
+        with self._lock:
+            self._conditions = np.zeros(count, dtype=bool)
+            self._since = np.zeros(count)
+            self._active = np.zeros(count, dtype=bool)
+            self._acknowledged = np.zeros(count, dtype=bool)
+
+            self._last_values = np.full(inputs_count, np.nan)
+            self._last_times = np.full(inputs_count, np.nan)
+
+    def evaluate(self, values, timestamp=None):
+        """ Evaluates all the alarms.
+
+        :param values: the values of the inputs, in the order of the ``input_names`` passed to the
+        constructor, NaN for the inputs which have not been read (their alarms keep their state)
+        :param float timestamp: the time of the values (defaults to the current time)
+        :return: the events produced by the alarms changing state
+        :rtype: list
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        values = np.asarray(values, dtype=np.float64)
+
+        with self._lock:
+            return self._evaluate(values, timestamp)
+
+    def _evaluate(self, values, timestamp):
+        measures = values[self._inputs]
+        if self._uses_rates:
+            # rates cannot be computed when the time did not advance since the previous value,
+            # and the alarms then keep their state as for inputs not read
+            elapsed = timestamp - self._last_times
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rates = np.where(elapsed > 0, np.abs(values - self._last_values) / elapsed, np.nan)
+            measures = np.where(self._is_rate, rates[self._inputs], measures)
+            read = ~np.isnan(values)
+            self._last_values[read] = values[read]
+            self._last_times[read] = timestamp
+
+        # active alarms keep their condition until the value goes back beyond the hysteresis band
+        with np.errstate(invalid='ignore'):
+            excess = self._signs * (measures - self._thresholds)
+            conditions = np.where(self._active, excess > -self._hystereses, excess > 0)
+        conditions = np.where(np.isnan(measures), self._conditions, conditions)
+
+        started = conditions & ~self._conditions
+        self._since[started] = timestamp
+        self._conditions = conditions
+
+        raised = conditions & ~self._active & (timestamp - self._since >= self._delays)
+        cleared = self._active & ~conditions & (~self._latching | self._acknowledged)
+        self._active |= raised
+        self._active &= ~cleared
+        self._acknowledged[raised] = False
+
+        events = []
+        for i in np.flatnonzero(raised | cleared):
+            events.append(AlarmEvent(self._names[i], bool(raised[i]), timestamp, float(measures[i])))
+        return events
+
+    def acknowledge(self, name):
+        """ Acknowledges an alarm.
+
+        A latching alarm which condition has disappeared is cleared.
+
+        :param str name: the alarm name
+        :return: the events produced by the acknowledgement
+        :rtype: list
+        :raise: ValueError if the alarm is not defined
+        """
+        try:
+            i = self._index[name]
+        except KeyError:
+            raise ValueError('unknown alarm : %s' % name)
+        with self._lock:
+            self._acknowledged[i] = True
+            if self._active[i] and not self._conditions[i]:
+                self._active[i] = False
+                return [AlarmEvent(name, False, time.time(), None)]
+        return []
+
+    def is_active(self, name):
+        with self._lock:
+            return bool(self._active[self._index[name]])
+
+    def get_active_alarms(self):
+        """ Returns the raised alarms.
+
+        :return: a list of tuples (name, acknowledged)
+        :rtype: list
+        """
+        with self._lock:
+            return [(self._names[i], bool(self._acknowledged[i])) for i in np.flatnonzero(self._active)]
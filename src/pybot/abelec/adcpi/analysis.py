@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides the analysis of AC signals, such as the ones of current clamps or
+vibration sensors, sampled in blocks by :py:meth:`AnalogInput.read_block`.
+
+The analysis gives the DC offset, the RMS values, the peak values and the frequency of the signal,
+the latter being measured by timing its rising crossings of the DC level. Crossing times are
+interpolated between the samples, using their actual timestamps, so that the result does not
+depend on the sampling jitter. The spectrum of the signal can also be computed, the samples being
+resampled on a regular time grid before the FFT.
+
+All computations are vectorized with NumPy, which is required by this module.
+
+>>> block = current.read_block(500)
+>>> result = analyze(block.volts, block.timestamps)
+>>> result.ac_rms, result.frequency
+>>> freqs, amplitudes = spectrum(block.volts, block.timestamps)
+
+For a continuous monitoring, a :py:class:`SlidingAnalyzer` gives the analysis of the last blocks,
+each block being processed only once, when it is added :
+
+>>> analyzer = SlidingAnalyzer(blocks=10)
+>>> while True:
+>>>     result = analyzer.update(current.read_block(100))
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['SignalAnalysis', 'analyze', 'spectrum', 'dominant_frequency', 'SlidingAnalyzer']
+
+from collections import deque, namedtuple
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class SignalAnalysis(namedtuple('SignalAnalysis', 'count duration dc rms ac_rms min max peak_to_peak frequency')):
+    """ The result of the analysis of a signal.
+
+    ``rms`` is the RMS value of the whole signal, and ``ac_rms`` the one of its AC component (i.e.
+    without the DC offset). ``frequency`` (Hz) is None if the signal has less than 2 rising
+    crossings of its DC level.
+    """
+    __slots__ = ()
+
+
+def _as_arrays(volts, timestamps):
+    if np is None:
+        raise ValueError('cannot continue since NumPy is not available')
+    volts = np.asarray(volts, dtype=np.float64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(volts) != len(timestamps):
+        raise ValueError('volts and timestamps sizes mismatch')
+    return volts, timestamps
+
+
+def _rising_crossings(volts, timestamps, level):
+    """ Returns the interpolated times at which a signal crosses a level upwards. """
+    x = volts - level
+    indexes = np.flatnonzero((x[:-1] < 0) & (x[1:] >= 0))
+    x0, x1 = x[indexes], x[indexes + 1]
+    t0, t1 = timestamps[indexes], timestamps[indexes + 1]
+    return t0 - x0 * (t1 - t0) / (x1 - x0)
+
+
+def _frequency(crossings_count, first_crossing, last_crossing):
+    if crossings_count < 2 or last_crossing <= first_crossing:
+        return None
+    return (crossings_count - 1) / (last_crossing - first_crossing)
+
+
+def analyze(volts, timestamps):
+    """ Analyzes a block of samples.
+
+    :param volts: the sample values
+    :param timestamps: the sample times (s)
+    :rtype: SignalAnalysis
+    :raise: ValueError if the block is empty
+    """
+    volts, timestamps = _as_arrays(volts, timestamps)
+    count = len(volts)
+    if not count:
+        raise ValueError('empty block')
+
+    dc = float(volts.mean())
+    rms = math.sqrt(float(np.dot(volts, volts)) / count)
+    v_min, v_max = float(volts.min()), float(volts.max())
+    crossings = _rising_crossings(volts, timestamps, dc)
+    frequency = _frequency(len(crossings), crossings[0], crossings[-1]) if len(crossings) else None
+
+    return SignalAnalysis(
+        count, float(timestamps[-1] - timestamps[0]), dc, rms, math.sqrt(max(rms * rms - dc * dc, 0.)),
+        v_min, v_max, v_max - v_min, frequency
+    )
+
+
+def spectrum(volts, timestamps, window=True):
+    """ Computes the amplitude spectrum of a block of samples.
+
+    The samples are first resampled on a regular time grid by linear interpolation, and the DC
+    component is removed.
+
+    :param volts: the sample values
+    :param timestamps: the sample times (s)
+    :param bool window: True for applying a Hann window, reducing the spectral leakage
+    :return: a tuple of arrays, containing the frequencies (Hz) and the corresponding amplitudes
+    :rtype: tuple
+    :raise: ValueError if the block contains less than 2 samples
+    """
+    volts, timestamps = _as_arrays(volts, timestamps)
+    count = len(volts)
+    if count < 2 or timestamps[-1] <= timestamps[0]:
+        raise ValueError('not enough samples')
+
+    grid = np.linspace(timestamps[0], timestamps[-1], count)
+    signal = np.interp(grid, timestamps, volts)
+    signal -= signal.mean()
+    if window:
+        weights = np.hanning(count)
+        signal *= weights
+        scale = 2. / weights.sum()
+    else:
+        scale = 2. / count
+
+    rate = (count - 1) / (timestamps[-1] - timestamps[0])
+    return np.fft.rfftfreq(count, 1. / rate), np.abs(np.fft.rfft(signal)) * scale
+
+
+def dominant_frequency(volts, timestamps):
+    """ Returns the frequency of the highest peak of the spectrum of a block of samples.
+
+    See :py:func:`spectrum` for parameters.
+
+    :return: the frequency (Hz)
+    :rtype: float
+    """
+    freqs, amplitudes = spectrum(volts, timestamps)
+    if len(freqs) < 2:
+        return None
+    return float(freqs[1 + np.argmax(amplitudes[1:])])
+
+
+class _BlockStats(namedtuple('_BlockStats',
+                             'count sum sum2 min max crossings first_crossing last_crossing start end')):
+    __slots__ = ()
+
+
+class SlidingAnalyzer(object):
+    """ Analysis of the last N blocks of a continuously sampled signal.
+
+    When a block is added, its partial results (sums, extrema, crossings of the DC level) are
+    computed once for all and kept with it. The analysis of the window is then obtained by
+    combining the partial results of its blocks, the sums being updated when blocks enter and
+    leave the window, so that the samples of the previous blocks are never processed again.
+
+    The crossings of a block are detected relatively to the DC level of the window at the time
+    the block is added, which gives accurate frequencies as long as the DC offset varies slowly.
+    """
+    def __init__(self, blocks):
+        """
+        :param int blocks: the number of blocks in the window
+        """
+        if np is None:
+            raise ValueError('cannot continue since NumPy is not available')
+        if blocks <= 0:
+            raise ValueError('invalid blocks count (%s)' % blocks)
+        self._size = blocks
+        self.reset()
+
+    @property
+    def blocks_count(self):
+        return len(self._blocks)
+
+    def reset(self):
+        self._blocks = deque()      # (stats, volts, timestamps)
+        self._count = 0
+        self._sum = 0.
+        self._sum2 = 0.
+        self._last_sample = None
+
+    def update(self, block, timestamps=None):
+        """ Adds a block to the window and returns the updated analysis.
+
+        :param block: a :py:class:`SampleBlock`, or the sample values if ``timestamps`` is provided
+        :param timestamps: the sample times (s), if ``block`` contains values only
+        :rtype: SignalAnalysis
+        """
+        if timestamps is None:
+            volts, timestamps = block.volts, block.timestamps
+        else:
+            volts = block
+        volts, timestamps = _as_arrays(volts, timestamps)
+        if not len(volts):
+            return self.result()
+
+        if len(self._blocks) == self._size:
+            stats, _, _ = self._blocks.popleft()
+            self._count -= stats.count
+            self._sum -= stats.sum
+            self._sum2 -= stats.sum2
+        count = len(volts)
+        block_sum, block_sum2 = float(volts.sum()), float(np.dot(volts, volts))
+        self._count += count
+        self._sum += block_sum
+        self._sum2 += block_sum2
+
+        # the last sample of the previous block is included, for not missing the crossing between them
+        if self._last_sample is not None:
+            last_v, last_t = self._last_sample
+            crossings = _rising_crossings(
+                np.concatenate(([last_v], volts)), np.concatenate(([last_t], timestamps)), self._sum / self._count
+            )
+        else:
+            crossings = _rising_crossings(volts, timestamps, self._sum / self._count)
+        self._last_sample = (volts[-1], timestamps[-1])
+
+        stats = _BlockStats(
+            count, block_sum, block_sum2, float(volts.min()), float(volts.max()),
+            len(crossings), crossings[0] if len(crossings) else None, crossings[-1] if len(crossings) else None,
+            float(timestamps[0]), float(timestamps[-1])
+        )
+        self._blocks.append((stats, volts, timestamps))
+        return self.result()
+
+    def result(self):
+        """ Returns the analysis of the current window.
+
+        :return: the analysis, None if the window is empty
+        :rtype: SignalAnalysis
+        """
+        if not self._count:
+            return None
+        blocks = [stats for stats, _, _ in self._blocks]
+        count = self._count
+        dc = self._sum / count
+        rms = math.sqrt(max(self._sum2 / count, 0.))
+        v_min = min(stats.min for stats in blocks)
+        v_max = max(stats.max for stats in blocks)
+
+        crossing_blocks = [stats for stats in blocks if stats.crossings]
+        if crossing_blocks:
+            frequency = _frequency(
+                sum(stats.crossings for stats in crossing_blocks),
+                crossing_blocks[0].first_crossing, crossing_blocks[-1].last_crossing
+            )
+        else:
+            frequency = None
+
+        return SignalAnalysis(
+            count, blocks[-1].end - blocks[0].start, dc, rms, math.sqrt(max(rms * rms - dc * dc, 0.)),
+            v_min, v_max, v_max - v_min, frequency
+        )
+
+    def samples(self):
+        """ Returns the samples of the current window.
+
+        :return: a tuple of arrays, containing the sample values and times
+        :rtype: tuple
+        """
+        if not self._blocks:
+            return np.empty(0), np.empty(0)
+        return (
+            np.concatenate([volts for _, volts, _ in self._blocks]),
+            np.concatenate([timestamps for _, _, timestamps in self._blocks])
+        )
+
+    def spectrum(self, window=True):
+        """ Computes the amplitude spectrum of the samples of the current window.
+
+        See :py:func:`spectrum`.
+        """
+        volts, timestamps = self.samples()
+        return spectrum(volts, timestamps, window)
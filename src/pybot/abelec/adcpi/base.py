@@ -42,7 +42,44 @@ __author__ = 'Eric PASCUAL for POBOT'
 __version__ = '2.0.0'
 __email__ = 'eric@pobot.org'
 
-__all__ = ['ADCPiBoard', 'Converter', 'AnalogInput']
+__all__ = [
+    'ADCPiBoard', 'Converter', 'AnalogInput', 'ScanScheduler', 'OneShotScheduler', 'DeadlineScheduler',
+    'TimestampedReading', 'SampleBlock', 'ConversionTimeoutError'
+]
+
+from array import array
+from collections import namedtuple
+import heapq
+from operator import itemgetter
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from smbus2 import i2c_msg
+except ImportError:
+    i2c_msg = None
+
+
+class ConversionTimeoutError(Exception):
+    """ Raised when a conversion result is not available in the expected time. """
+
+
+class TimestampedReading(namedtuple('TimestampedReading', 'value timestamp')):
+    """ A raw input value, with the time its conversion has been started. """
+    __slots__ = ()
+
+
+class SampleBlock(namedtuple('SampleBlock', 'raw volts timestamps')):
+    """ A block of samples of an input, as returned by :py:meth:`AnalogInput.read_block`.
+
+    Raw values, voltages and the times the samples have been read are NumPy arrays if NumPy is
+    available, lists otherwise.
+    """
+    __slots__ = ()
 
 
 class ADCPiBoard(object):
@@ -73,7 +110,7 @@ class ADCPiBoard(object):
     }
 
     CONV1_DEFAULT_ADDRESS = 0x68
-    CONV2_DEFAULT_ADDRESS = 0x68
+    CONV2_DEFAULT_ADDRESS = 0x69
 
     def __init__(self, bus, conv1_addr=CONV1_DEFAULT_ADDRESS , conv2_addr=CONV2_DEFAULT_ADDRESS):
         """ An instance of the I2C/SMBus class must be provided here. The calls used in the
@@ -90,8 +127,11 @@ class ADCPiBoard(object):
             Converter(bus, conv2_addr),
         )
         self._adcs = {}
+        self._watch_adcs = {}
+        self._scan_schedulers = {}
 
-    def get_analog_input(self, board_input_num, rate=RATE_12, gain=GAIN_x1):
+    def get_analog_input(self, board_input_num, rate=RATE_12, gain=GAIN_x1, timeout=None, single=False,
+                         auto_gain=False):
         """ Convenience factory method returning an instance of :py:class:`AnalogInput`
         representing an individual input.
 
@@ -101,6 +141,9 @@ class ADCPiBoard(object):
         :param int board_input_num: the input number (in [1-8])
         :param int rate: the sampling rate selector (ADCPiBoard.RATE_xx)
         :param int gain: the input amplifier gain selector (ADCPiBoard.GAIN_xn)
+        :param int timeout: the conversion timeout (ms), None for the default one
+        :param bool single: True for one-shot conversion mode (see :py:class:`OneShotScheduler`)
+        :param bool auto_gain: True for automatic gain ranging (see :py:class:`AnalogInput`)
         :return: an instance of AnalogInput
         :rtype: AnalogInput
         """
@@ -117,11 +160,88 @@ class ADCPiBoard(object):
             converter = self._converters[conv_num]
 
             # create the instance of the ADC class
-            adc = AnalogInput(converter, channel_num, rate, gain)
+            adc = AnalogInput(converter, channel_num, rate, gain, single=single, timeout=timeout, auto_gain=auto_gain)
             # cache the result
             self._adcs[board_input_num] = adc
         return adc
 
+    def get_watch_input(self, board_input_num, gain=GAIN_x1, single=False):
+        """ Returns a 12 bits input, sharing its channel with the one returned by :py:meth:`get_analog_input`.
+
+        Since 12 bits conversions are 64 times faster than 18 bits ones, such an input can be used
+        for detecting the changes of a high resolution input, which is then converted only when needed.
+
+        Returned instances are cached, as for :py:meth:`get_analog_input`.
+
+        :param int board_input_num: the input number (in [1-8])
+        :param int gain: the input amplifier gain selector (ADCPiBoard.GAIN_xn)
+        :param bool single: True for one-shot conversion mode
+        :return: an instance of AnalogInput
+        :rtype: AnalogInput
+        """
+        if not 1 <= board_input_num <= 8:
+            raise ValueError("invalid input num (%d)" % board_input_num)
+        try:
+            adc = self._watch_adcs[board_input_num]
+        except KeyError:
+            conv_num, channel_num = self._board_input_num_to_conv_channel(board_input_num)
+            adc = AnalogInput(self._converters[conv_num], channel_num, self.RATE_12, gain, single=single)
+            self._watch_adcs[board_input_num] = adc
+        return adc
+
+    def scan(self, board_input_nums=None):
+        """ Reads a set of inputs, overlapping the conversions of both converters.
+
+        Inputs must have been created before by :py:meth:`get_analog_input`. See
+        :py:class:`ScanScheduler` for details, and for scanning inputs of several boards.
+
+        :param board_input_nums: the input numbers (in [1-8]), all created inputs if not provided
+        :return: a tuple composed of a dictionary containing the raw values keyed by the input number,
+        and a dictionary containing the ConversionTimeoutError of the failed inputs, keyed the same way
+        :rtype: tuple
+        """
+        scheduler, nums = self._get_scan_scheduler(board_input_nums)
+        values, errors = scheduler.scan()
+        return (
+            dict((nums[adc], value) for adc, value in values.iteritems()),
+            dict((nums[adc], error) for adc, error in errors.iteritems())
+        )
+
+    def read_block(self, count, board_input_nums=None, signed=False):
+        """ Acquires a block of samples on a set of inputs, overlapping the conversions of both converters.
+
+        Inputs must have been created before by :py:meth:`get_analog_input`. See
+        :py:meth:`ScanScheduler.scan_block` for details.
+
+        :param int count: the number of samples per input
+        :param board_input_nums: the input numbers (in [1-8]), all created inputs if not provided
+        :param bool signed: True for keeping negative values (clamped to 0 otherwise)
+        :return: the samples blocks (as SampleBlock), keyed by input number
+        :rtype: dict
+        :raise: ConversionTimeoutError if a conversion times out
+        """
+        scheduler, nums = self._get_scan_scheduler(board_input_nums)
+        blocks = scheduler.scan_block(count, signed)
+        return dict((nums[adc], block) for adc, block in blocks.iteritems())
+
+    def _get_scan_scheduler(self, board_input_nums):
+        """ Returns the scheduler in charge of scanning a set of inputs, and the input numbers
+        keyed by the input instances.
+        """
+        if board_input_nums is None:
+            board_input_nums = sorted(self._adcs)
+        board_input_nums = tuple(board_input_nums)
+        try:
+            scheduler = self._scan_schedulers[board_input_nums]
+        except KeyError:
+            try:
+                inputs = [self._adcs[num] for num in board_input_nums]
+            except KeyError as e:
+                raise ValueError('input not created (%s)' % e)
+            scheduler = self._scan_schedulers[board_input_nums] = ScanScheduler(inputs)
+
+        return scheduler, dict((adc, num) for num, adc in zip(board_input_nums, scheduler.inputs))
+
     @staticmethod
     def _board_input_num_to_conv_channel(board_io_num):
         board_io_num -= 1
@@ -130,7 +250,18 @@ class ADCPiBoard(object):
 
 class Converter(object):
     """ Models the MCP3424 converter chip, and handles its low level operations.
+
+    The configuration currently active in the chip is tracked, so that it is written only when
+    it changes. Reads with an unchanged configuration are done with a plain read transaction if
+    the bus supports it (i.e. if it provides the ``i2c_rdwr`` method of the ``smbus2`` package),
+    which halves their cost and avoids restarting the conversion in progress.
     """
+    GENERAL_CALL_ADDRESS = 0x00
+    GENERAL_CALL_CONVERSION = 0x08
+
+    # the RDY bit, which is a trigger when written and not part of the configuration
+    RDY = 0x80
+
     def __init__(self, bus, i2c_addr):
         """
         :param bus: the I2C/SMBus instance
@@ -138,6 +269,55 @@ class Converter(object):
         """
         self._bus = bus
         self._addr = i2c_addr
+        self._active_config = None
+        self._i2c_rdwr = getattr(bus, 'i2c_rdwr', None) if i2c_msg else None
+
+        self._config_writes_count = 0
+        self._plain_reads_count = 0
+
+    @property
+    def address(self):
+        """ The I2C address of the chip. """
+        return self._addr
+
+    @property
+    def bus(self):
+        """ The I2C/SMBus instance the chip is connected to. """
+        return self._bus
+
+    @property
+    def active_config(self):
+        """ The configuration currently active in the chip, None if not known. """
+        return self._active_config
+
+    def write_config(self, config):
+        """ Writes the configuration register, which starts a new conversion.
+
+        :param int config: the configuration byte
+        """
+        self._bus.write_byte(self._addr, config)
+        self._active_config = config & ~self.RDY
+        self._config_writes_count += 1
+
+    def select(self, config):
+        """ Writes the configuration register only if it differs from the active one.
+
+        :param int config: the configuration byte
+        :return: True if the configuration has been written
+        :rtype: bool
+        """
+        if config == self._active_config:
+            return False
+        self.write_config(config)
+        return True
+
+    def invalidate_config(self):
+        """ Forgets the active configuration, so that it is written again by the next operation.
+
+        This must be used if the chip configuration has been changed by other means (reset,
+        other process,...).
+        """
+        self._active_config = None
 
     def read_raw(self, config, count=32):
         """ Performs a raw read
@@ -145,12 +325,49 @@ class Converter(object):
         We can request just the number of needed bytes, to avoid transferring
         the SMBus default 32 bytes chunk.
 
+        If the configuration is the active one and the bus supports it, a plain read is done.
+        Otherwise the configuration is written as the command byte of the read.
+
         :param int config: the configuration byte
         :param int count: number of requested bytes
         :return: the data bytes as returned by the chip
         :rtype: list
         """
-        return self._bus.read_i2c_block_data(self._addr, config, count)
+        if config == self._active_config and self._i2c_rdwr:
+            msg = i2c_msg.read(self._addr, count)
+            self._i2c_rdwr(msg)
+            self._plain_reads_count += 1
+            return list(msg)
+
+        raw = self._bus.read_i2c_block_data(self._addr, config, count)
+        self._active_config = config & ~self.RDY
+        self._config_writes_count += 1
+        return raw
+
+    def get_statistics(self):
+        """ Returns the converter statistics.
+
+        The returned dictionary contains the following items:
+
+            config_writes
+                (int) number of transactions which wrote the configuration register
+            plain_reads
+                (int) number of reads done without writing the configuration register
+
+        :rtype: dict
+        """
+        return {
+            'config_writes': self._config_writes_count,
+            'plain_reads': self._plain_reads_count,
+        }
+
+    def general_call_conversion(self):
+        """ Sends the general call conversion command on the bus of the chip.
+
+        All the MCP342x chips of the bus configured in one-shot mode start a conversion at the
+        same time, using their currently selected channel.
+        """
+        self._bus.write_byte(self.GENERAL_CALL_ADDRESS, self.GENERAL_CALL_CONVERSION)
 
 
 class AnalogInput(object):
@@ -160,7 +377,17 @@ class AnalogInput(object):
     :py:meth:`read_raw`.
 
     The input is configured (sampling rate and resolution, PGA gain) at instantiation time,
-    and cannot be changed after.
+    and cannot be changed after, except the gain in auto gain mode.
+
+    In auto gain mode, the gain is chosen after each reading, so that the next conversions are
+    done with the highest gain which does not saturate the converter. The gain is decreased as soon
+    as a reading comes close to the full scale, and increased only after several readings low
+    enough for not reaching the decreasing threshold with the next gain, which provides the
+    switching hysteresis. Raw values are then expressed in counts of the highest gain (x8), whatever
+    the gain used for the conversion, and have thus 3 more bits than the converter resolution
+    (see :py:attr:`raw_resolution`). Since the configuration bytes of all the gains are
+    precomputed, a gain change costs only the configuration write of the next conversion. A reading
+    saturating the gain in use is returned clipped, the following ones being done with a lower gain.
     """
 
     # configuration register masks
@@ -170,6 +397,18 @@ class AnalogInput(object):
     _gain_factors = (0.5, 1.0, 2.0, 4.0)
     _lsb_factors = (0.0005, 0.000125, 0.00003125, 0.0000078125)
 
+    # nominal conversion times (s) for each sampling rate (240, 60, 15 and 3.75 SPS)
+    _conversion_times = (1 / 240., 1 / 60., 1 / 15., 1 / 3.75)
+
+    # default timeout, as a multiple of the conversion time
+    DEFAULT_TIMEOUT_FACTOR = 4
+
+    # auto gain switching thresholds, as fractions of the full scale
+    AUTO_GAIN_HIGH = 0.9
+    AUTO_GAIN_LOW = 0.4
+    # the number of consecutive low readings needed for increasing the gain
+    AUTO_GAIN_SETTLE = 4
+
     def _decoder_12(self, raw):
         h, m = raw[:2]
         return 0 if h & 0x08 else ((h & 0x07) << 8) | m
@@ -194,13 +433,16 @@ class AnalogInput(object):
         ADCPiBoard.RATE_18: (_decoder_18, 4)
     }
 
-    def __init__(self, converter, channel_num, rate=ADCPiBoard.RATE_12, gain=ADCPiBoard.GAIN_x1, single=False):
+    def __init__(self, converter, channel_num, rate=ADCPiBoard.RATE_12, gain=ADCPiBoard.GAIN_x1, single=False,
+                 timeout=None, auto_gain=False):
         """
         :param Converter converter: the MCP chip this input belongs to
         :param int channel_num: ADC channel num ([0-3]
         :param bool single: True for single sample mode
         :param int rate: sample rate and resolution selector (RATE_nn)
-        :param int gain: PGA gain (GAIN_xn)
+        :param int gain: PGA gain (GAIN_xn), which is the initial one in auto gain mode
+        :param int timeout: the conversion timeout (ms), None for the default one (a few conversion times)
+        :param bool auto_gain: True for automatic gain ranging
         """
         if not converter:
             raise ValueError('converter parameter is mandatory')
@@ -213,15 +455,144 @@ class AnalogInput(object):
 
         self._converter = converter
         self._channel_num = channel_num
-        self._config = (
+        self._decoder, self._reply_len = self._decoding_specs[rate]
+        self._resolution = ADCPiBoard.RESOLUTIONS[rate]
+        self._single = single
+
+        # configuration bytes for each gain (in one-shot mode, a conversion is started by writing
+        # the configuration with the RDY bit set)
+        base_config = (
             (channel_num << 5) |
             (self.CONTINUOUS_CONVERSION if not single else 0) |
-            rate | gain
+            (rate << 2)
         ) & 0xff
-        self._decoder, self._reply_len = self._decoding_specs[rate]
+        self._gain_configs = tuple((base_config | g, base_config | g | self.NOT_READY) for g in xrange(4))
+
+        self._auto_gain = auto_gain
+        if auto_gain:
+            # raw values are expressed in counts of the highest gain
+            gain_ref = ADCPiBoard.GAIN_x8
+            full_scale = (1 << (self._resolution - 1)) - 1
+            self._auto_gain_high = int(full_scale * self.AUTO_GAIN_HIGH)
+            self._auto_gain_low = int(full_scale * self.AUTO_GAIN_LOW)
+            self._low_readings = 0
+        else:
+            gain_ref = gain
+        self._set_gain(gain)
+        self._gain_switches_count = 0
 
         # Note: the last factor of the formula hereafter has been found by experimental measurement
-        self._scale_factor = self._lsb_factors[rate] / self._gain_factors[gain] * 2.478439425
+        self._scale_factor = self._lsb_factors[rate] / self._gain_factors[gain_ref] * 2.478439425
+
+        self._conversion_time = self._conversion_times[rate]
+        self._timeout = (
+            timeout / 1000. if timeout is not None else self._conversion_time * self.DEFAULT_TIMEOUT_FACTOR
+        )
+
+        self._last_result_time = None
+
+        self._reads_count = 0
+        self._polls_count = 0
+        self._wasted_polls_count = 0
+        self._timeouts_count = 0
+
+    @property
+    def converter(self):
+        """ The converter chip this input belongs to. """
+        return self._converter
+
+    @property
+    def single(self):
+        """ True if the input works in one-shot conversion mode. """
+        return self._single
+
+    @property
+    def resolution(self):
+        """ The resolution (bits), including the sign. """
+        return self._resolution
+
+    @property
+    def raw_resolution(self):
+        """ The resolution of the raw values (bits), which exceeds the converter one in auto gain mode. """
+        return self._resolution + 3 if self._auto_gain else self._resolution
+
+    @property
+    def auto_gain(self):
+        return self._auto_gain
+
+    @property
+    def gain(self):
+        """ The current gain selector (GAIN_xn). """
+        return self._gain
+
+    def _set_gain(self, gain):
+        self._gain = gain
+        self._config, self._start_config = self._gain_configs[gain]
+        # the shift normalizing the raw values to the highest gain counts
+        self._gain_shift = ADCPiBoard.GAIN_x8 - gain if self._auto_gain else 0
+
+    def _auto_range(self, raw):
+        """ Selects the gain of the next conversions from the last reading.
+
+        :param int raw: the reading, as returned by the converter
+        """
+        gain = self._gain
+        magnitude = abs(raw)
+        if magnitude >= self._auto_gain_high:
+            if gain > ADCPiBoard.GAIN_x1:
+                # jump directly to the gain giving a reading below the threshold
+                while gain > ADCPiBoard.GAIN_x1 and magnitude >= self._auto_gain_high:
+                    gain -= 1
+                    magnitude >>= 1
+                self._set_gain(gain)
+                self._gain_switches_count += 1
+            self._low_readings = 0
+
+        elif magnitude < self._auto_gain_low and gain < ADCPiBoard.GAIN_x8:
+            self._low_readings += 1
+            if self._low_readings >= self.AUTO_GAIN_SETTLE:
+                self._set_gain(gain + 1)
+                self._gain_switches_count += 1
+                self._low_readings = 0
+
+        else:
+            self._low_readings = 0
+
+    @property
+    def conversion_time(self):
+        """ The nominal conversion time (s) for the configured sample rate. """
+        return self._conversion_time
+
+    @property
+    def timeout(self):
+        """ The conversion timeout (s). """
+        return self._timeout
+
+    def get_statistics(self):
+        """ Returns the input statistics.
+
+        The returned dictionary contains the following items:
+
+            reads
+                (int) number of successful reads
+            polls
+                (int) number of result register reads
+            wasted_polls
+                (int) number of result register reads which returned a not ready result
+            timeouts
+                (int) number of reads which timed out
+            gain_switches
+                (int) number of gain changes done in auto gain mode
+
+        :rtype: dict
+        """
+        return {
+            'reads': self._reads_count,
+            'polls': self._polls_count,
+            'wasted_polls': self._wasted_polls_count,
+            'timeouts': self._timeouts_count,
+            'gain_switches': self._gain_switches_count,
+        }
 
     def read_voltage(self):
         """ Samples the input and converts the raw reading to corresponding voltage.
@@ -239,14 +610,632 @@ class AnalogInput(object):
 
         Proper decoding is applied, based on configured gain and sample rate.
 
+        Instead of polling the converter until the result is ready, the conversion is started,
+        and the result is read after the conversion time. If not yet available, it is polled again
+        with increasing delays, until the configured timeout. In continuous mode, if the input
+        is already the one selected on the converter, the result of the conversions in progress
+        is read without waiting first.
+
         :return: the input raw value
         :rtype: int
+        :raise: ConversionTimeoutError if the result is not available before the timeout
+        """
+        start = time.time()
+        deadline = start + self._timeout
+        delay = self.start_conversion() - start
+        if delay > 0:
+            time.sleep(delay)
+
+        # retry delays start small, since the conversion is supposed to be almost done
+        retry_delay = self._conversion_time / 16
+        while True:
+            raw = self.poll_result()
+            if raw is not None:
+                return raw
+
+            now = time.time()
+            if now >= deadline:
+                raise self._conversion_timeout(now - start)
+            time.sleep(min(retry_delay, deadline - now))
+            retry_delay = min(retry_delay * 2, self._conversion_time / 2)
+
+    def start_conversion(self):
+        """ Starts a conversion, without waiting for its result.
+
+        The result must then be collected with :py:meth:`poll_result`. This is intended for
+        overlapping conversions on several converters, such as done by :py:class:`ScanScheduler`.
+
+        In continuous mode, the configuration is not written if the input is already the one
+        selected on the converter, since conversions are already running. The next result is then
+        expected one conversion time after the previous one.
+
+        :return: the time the result is expected to be available
+        :rtype: float
+        """
+        if self._single:
+            self._converter.write_config(self._start_config)
+        elif not self._converter.select(self._config):
+            if self._last_result_time is None:
+                return time.time()
+            return self._last_result_time + self._conversion_time
+        return time.time() + self._conversion_time
+
+    def select(self):
+        """ Selects the input on its converter, without starting a conversion in one-shot mode.
+
+        This is used for preparing a general call triggered conversion.
+        """
+        self._converter.select(self._config)
+
+    def poll_result(self):
+        """ Reads the result of the conversion started by :py:meth:`start_conversion`.
+
+        :return: the input raw value, or None if the conversion is not complete yet
+        :rtype: int
+        """
+        reply = self.poll_reply()
+        if reply is None:
+            return None
+        raw = self._decoder(self, reply)
+        if self._auto_gain:
+            # the reply configuration byte tells the gain used for the conversion
+            shift = ADCPiBoard.GAIN_x8 - (reply[-1] & 0x03)
+            self._auto_range(raw)
+            return raw << shift
+        return raw
+
+    def poll_reply(self):
+        """ Same as :py:meth:`poll_result`, but returns the undecoded reply of the converter.
+
+        :return: the reply bytes (data bytes followed by the configuration byte), or None if the
+        conversion is not complete yet
+        :rtype: list
+        """
+        reply = self._converter.read_raw(self._config, self._reply_len)
+        self._polls_count += 1
+        if reply[-1] & self.NOT_READY:
+            self._wasted_polls_count += 1
+            return None
+
+        self._reads_count += 1
+        self._last_result_time = time.time()
+        return reply
+
+    def read_block(self, count, signed=False):
+        """ Acquires a block of samples.
+
+        The input is left in continuous conversion mode during the acquisition, so that each
+        conversion result is read as soon as available. The replies are stored undecoded, and are
+        decoded all at once at the end of the acquisition (see :py:meth:`decode_block`).
+
+        In auto gain mode, the gain is not changed during the acquisition.
+
+        :param int count: the number of samples
+        :param bool signed: True for keeping negative values (clamped to 0 otherwise)
+        :rtype: SampleBlock
+        :raise: ConversionTimeoutError if a conversion times out
+        """
+        return ScanScheduler((self,)).scan_block(count, signed)[self]
+
+    def decode_block(self, data, timestamps, signed=False):
+        """ Decodes a block of replies.
+
+        If NumPy is available, the decoding is done with vectorized operations. Negative values
+        are sign extended from the resolution of the input.
+
+        :param bytearray data: the data bytes of the replies, without their configuration byte
+        :param timestamps: the times the replies have been read
+        :param bool signed: True for keeping negative values (clamped to 0 otherwise)
+        :rtype: SampleBlock
+        """
+        data_len = self._reply_len - 1
+        count = len(data) / data_len
+        value_mask = (1 << self._resolution) - 1
+        sign_bit = 1 << (self._resolution - 1)
+
+        if np is not None:
+            replies = np.frombuffer(data, dtype=np.uint8).reshape(count, data_len).astype(np.int32)
+            raw = replies[:, 0]
+            for i in xrange(1, data_len):
+                raw = (raw << 8) | replies[:, i]
+            # branch-less sign extension
+            raw = ((raw & value_mask) ^ sign_bit) - sign_bit
+            if not signed:
+                np.maximum(raw, 0, out=raw)
+            if self._gain_shift:
+                raw <<= self._gain_shift
+            return SampleBlock(raw, raw * self._scale_factor, np.frombuffer(timestamps, dtype=np.float64))
+
+        raw = []
+        for i in xrange(0, count * data_len, data_len):
+            value = reduce(lambda v, b: (v << 8) | b, data[i:i + data_len], 0)
+            value = ((value & value_mask) ^ sign_bit) - sign_bit
+            raw.append((value if signed or value > 0 else 0) << self._gain_shift)
+        return SampleBlock(raw, [value * self._scale_factor for value in raw], list(timestamps))
+
+    def _conversion_timeout(self, elapsed):
+        """ Accounts for a timed out conversion, and returns the error to be raised.
+
+        :param float elapsed: the time elapsed since the conversion start (s)
+        :rtype: ConversionTimeoutError
+        """
+        self._timeouts_count += 1
+        return ConversionTimeoutError(
+            'conversion not ready after %.1fms (converter=0x%x)' % (elapsed * 1000, self._converter.address)
+        )
+
+
+class ScanScheduler(object):
+    """ Reads a set of inputs, overlapping the conversions of the involved converters.
+
+    Inputs are grouped by converter. A conversion is started on each converter, and the results
+    are collected in their expected completion order, the next input of a converter being started
+    as soon as the result of the previous one has been read. Since the converters of a board work
+    independently, the time needed for scanning all its inputs is roughly divided by two. The inputs
+    can belong to several boards, each added converter working in parallel with the others.
+
+    Inputs of the same converter are read in the order they are provided.
+
+    >>> board = ADCPiBoard(i2c_bus)
+    >>> inputs = [board.get_analog_input(num) for num in range(1, 9)]
+    >>> scheduler = ScanScheduler(inputs)
+    >>> values, errors = scheduler.scan()
+    """
+    def __init__(self, inputs):
+        """
+        :param inputs: the inputs to be scanned (AnalogInput instances)
+        """
+        self._inputs = tuple(inputs)
+        if len(set(self._inputs)) != len(self._inputs):
+            raise ValueError('duplicate inputs')
+
+        self._queues = []
+        by_converter = {}
+        for adc_input in self._inputs:
+            converter = adc_input.converter
+            try:
+                by_converter[converter].append(adc_input)
+            except KeyError:
+                queue = by_converter[converter] = [adc_input]
+                self._queues.append(queue)
+
+        self._scans_count = 0
+        self._last_scan_time = None
+        self._total_scan_time = 0.
+
+    @property
+    def inputs(self):
+        return self._inputs
+
+    @property
+    def converters_count(self):
+        return len(self._queues)
+
+    def scan(self, inputs=None):
+        """ Reads all the inputs, or a subset of them.
+
+        Timed out conversions do not stop the scan. The involved inputs are reported in the returned
+        errors dictionary, and the next inputs of the same converter are processed normally.
+
+        :param inputs: the inputs to be read, among the ones of the scheduler (all of them if not provided)
+        :return: a tuple composed of a dictionary containing the raw values keyed by the input,
+        and a dictionary containing the ConversionTimeoutError of the failed inputs, keyed the same way
+        :rtype: tuple
+        """
+        values, errors = {}, {}
+        start = time.time()
+
+        def store(adc_input, raw, _):
+            values[adc_input] = raw
+
+        if inputs is None:
+            queues = self._queues
+        else:
+            inputs = set(inputs)
+            queues = [queue for queue in ([i for i in q if i in inputs] for q in self._queues) if queue]
+        self._scan(queues, lambda adc_input: adc_input.poll_result(), store, errors.__setitem__)
+
+        self._scans_count += 1
+        self._last_scan_time = time.time() - start
+        self._total_scan_time += self._last_scan_time
+        return values, errors
+
+    def scan_block(self, count, signed=False):
+        """ Acquires a block of samples on all the inputs.
+
+        Inputs are scanned ``count`` times. The converters replies are stored undecoded in
+        preallocated buffers, and each input block is decoded at once at the end of the
+        acquisition (see :py:meth:`AnalogInput.decode_block`).
+
+        When a converter is in charge of a single input, it is left in continuous conversion mode,
+        and each result is read as soon as available.
+
+        :param int count: the number of samples per input
+        :param bool signed: True for keeping negative values (clamped to 0 otherwise)
+        :return: the samples blocks (as SampleBlock), keyed by input
+        :rtype: dict
+        :raise: ConversionTimeoutError if a conversion times out
+        """
+        if count <= 0:
+            raise ValueError('invalid samples count (%s)' % count)
+
+        buffers = {}
+        for adc_input in self._inputs:
+            data_len = adc_input._reply_len - 1
+            buffers[adc_input] = [bytearray(count * data_len), array('d', [0.]) * count, data_len]
+
+        def store(adc_input, reply, now):
+            data, timestamps, data_len = buffers[adc_input]
+            offset = i * data_len
+            data[offset:offset + data_len] = reply[:data_len]
+            timestamps[i] = now
+
+        def abort(_, error):
+            raise error
+
+        for i in xrange(count):
+            self._scan(self._queues, lambda adc_input: adc_input.poll_reply(), store, abort)
+
+        return dict(
+            (adc_input, adc_input.decode_block(data, timestamps, signed))
+            for adc_input, (data, timestamps, _) in buffers.iteritems()
+        )
+
+    def _scan(self, queues, poll, on_result, on_error):
+        """ Runs a scan of the inputs.
+
+        :param queues: the inputs to be read, grouped by converter
+        :param poll: the polling function, returning the result for the input passed as argument,
+        or None if not yet available
+        :param on_result: the function processing a result, receiving the input, the result and
+        the time it has been read
+        :param on_error: the function processing a timeout, receiving the input and the error
+        """
+        # the conversions in progress, one per converter :
+        #   [due time, input, start time, retry delay, remaining inputs iterator]
+        pending = []
+        start = time.time()
+        for queue in queues:
+            remaining = iter(queue)
+            conversion = [None, None, None, None, remaining]
+            self._start_next(conversion, start)
+            pending.append(conversion)
+
+        while pending:
+            conversion = min(pending, key=itemgetter(0))
+            due, adc_input, started, retry_delay, remaining = conversion
+            now = time.time()
+            if due > now:
+                time.sleep(due - now)
+                now = time.time()
+
+            result = poll(adc_input)
+            if result is None:
+                if now - started < adc_input.timeout:
+                    # retry with increasing delays, without exceeding the timeout
+                    conversion[0] = min(now + retry_delay, started + adc_input.timeout)
+                    conversion[3] = min(retry_delay * 2, adc_input.conversion_time / 2)
+                    continue
+                on_error(adc_input, adc_input._conversion_timeout(now - started))
+            else:
+                on_result(adc_input, result, now)
+
+            if not self._start_next(conversion, now):
+                pending.remove(conversion)
+
+    @staticmethod
+    def _start_next(conversion, now):
+        """ Starts the conversion of the next input of a converter, if any.
+
+        :param list conversion: the converter conversion state
+        :param float now: the current time
+        :return: True if a conversion has been started
+        :rtype: bool
         """
         try:
-            while True:
-                raw = self._converter.read_raw(self._config, self._reply_len)
-                cfg = raw[-1]
-                if not(cfg & self.NOT_READY):
-                    return self._decoder(self, raw)
-        except KeyboardInterrupt:
-            return 0
+            adc_input = next(conversion[4])
+        except StopIteration:
+            return False
+
+        due = adc_input.start_conversion()
+        conversion[:4] = [due, adc_input, now, adc_input.conversion_time / 16]
+        return True
+
+    def get_statistics(self):
+        """ Returns the scheduler statistics.
+
+        The returned dictionary contains the following items:
+
+            scans
+                (int) number of scans done
+            converters
+                (int) number of converters working in parallel
+            last_scan_time
+                (float) duration of the last scan (ms), None if no scan has been done yet
+            average_scan_time
+                (float) average duration of the scans (ms), None if no scan has been done yet
+
+        :rtype: dict
+        """
+        return {
+            'scans': self._scans_count,
+            'converters': len(self._queues),
+            'last_scan_time': self._last_scan_time * 1000 if self._scans_count else None,
+            'average_scan_time': self._total_scan_time * 1000 / self._scans_count if self._scans_count else None,
+        }
+
+
+class OneShotScheduler(object):
+    """ Reads a set of inputs working in one-shot mode, triggering the conversions of all the
+    involved converters together.
+
+    Inputs are read by rounds, each round involving at most one input per converter. The
+    conversions of a round are triggered together, and their results are then collected as
+    they become ready. The readings of a round are thus taken as close to simultaneously as the
+    hardware allows, which matters for multi-channel measurements (such as voltage and current
+    for computing a power).
+
+    Conversions are triggered either by writing each converter configuration with the RDY bit set
+    (one write per converter), or by the general call conversion command, which starts them
+    all at the very same time. In this case, the channels are selected beforehand, and be aware
+    that all the MCP342x chips of the bus configured in one-shot mode will start a conversion.
+
+    >>> board = ADCPiBoard(i2c_bus)
+    >>> voltage = board.get_analog_input(1, single=True)
+    >>> current = board.get_analog_input(5, single=True)
+    >>> scheduler = OneShotScheduler([voltage, current], general_call=True)
+    >>> readings, errors = scheduler.acquire()
+    >>> v, timestamp = readings[voltage]
+    """
+    def __init__(self, inputs, general_call=False):
+        """
+        :param inputs: the inputs to be read (AnalogInput instances, in one-shot mode)
+        :param bool general_call: True for triggering the conversions with the general call command
+        """
+        self._inputs = tuple(inputs)
+        if len(set(self._inputs)) != len(self._inputs):
+            raise ValueError('duplicate inputs')
+        if not all(adc_input.single for adc_input in self._inputs):
+            raise ValueError('inputs must be configured in one-shot mode')
+        self._general_call = general_call
+
+        self._rounds = self._make_rounds(self._inputs)
+
+        self._acquisitions_count = 0
+        self._max_skew = 0.
+
+    @property
+    def inputs(self):
+        return self._inputs
+
+    @property
+    def rounds_count(self):
+        return len(self._rounds)
+
+    @staticmethod
+    def _make_rounds(inputs):
+        """ Groups inputs in rounds, the k-th round being made of the k-th input of each converter. """
+        rounds = []
+        ranks = {}
+        for adc_input in inputs:
+            rank = ranks.get(adc_input.converter, 0)
+            ranks[adc_input.converter] = rank + 1
+            if rank == len(rounds):
+                rounds.append([])
+            rounds[rank].append(adc_input)
+        return rounds
+
+    def acquire(self, inputs=None):
+        """ Reads all the inputs, or a subset of them.
+
+        The timestamp of a reading is the time the conversion has been triggered. Timed out
+        conversions do not stop the acquisition, and are reported in the returned errors dictionary.
+
+        :param inputs: the inputs to be read, among the ones of the scheduler (all of them if not provided)
+        :return: a tuple composed of a dictionary containing the readings (as TimestampedReading)
+        keyed by the input, and a dictionary containing the ConversionTimeoutError of the failed inputs,
+        keyed the same way
+        :rtype: tuple
+        """
+        if inputs is None:
+            rounds = self._rounds
+        else:
+            inputs = set(inputs)
+            rounds = self._make_rounds([adc_input for adc_input in self._inputs if adc_input in inputs])
+
+        readings, errors = {}, {}
+        for round_inputs in rounds:
+            started = self._trigger(round_inputs)
+
+            # [due time, input, retry delay]
+            pending = [
+                [started + adc_input.conversion_time, adc_input, adc_input.conversion_time / 16]
+                for adc_input in round_inputs
+            ]
+            while pending:
+                conversion = min(pending, key=itemgetter(0))
+                due, adc_input, retry_delay = conversion
+                now = time.time()
+                if due > now:
+                    time.sleep(due - now)
+                    now = time.time()
+
+                raw = adc_input.poll_result()
+                if raw is None:
+                    if now - started < adc_input.timeout:
+                        conversion[0] = min(now + retry_delay, started + adc_input.timeout)
+                        conversion[2] = min(retry_delay * 2, adc_input.conversion_time / 2)
+                        continue
+                    errors[adc_input] = adc_input._conversion_timeout(now - started)
+                else:
+                    readings[adc_input] = TimestampedReading(raw, started)
+                pending.remove(conversion)
+
+        self._acquisitions_count += 1
+        return readings, errors
+
+    def _trigger(self, round_inputs):
+        """ Starts the conversions of a round.
+
+        :return: the trigger time
+        :rtype: float
+        """
+        if self._general_call:
+            buses = {}
+            for adc_input in round_inputs:
+                adc_input.select()
+                buses.setdefault(adc_input.converter.bus, adc_input.converter)
+            started = time.time()
+            for converter in buses.itervalues():
+                converter.general_call_conversion()
+        else:
+            started = time.time()
+            for adc_input in round_inputs:
+                adc_input.start_conversion()
+            # keep track of the time needed for triggering all the conversions
+            self._max_skew = max(self._max_skew, time.time() - started)
+        return started
+
+    def get_statistics(self):
+        """ Returns the scheduler statistics.
+
+        The returned dictionary contains the following items:
+
+            acquisitions
+                (int) number of acquisitions done
+            rounds
+                (int) number of conversion rounds per acquisition
+            max_skew
+                (float) maximum time elapsed between the first and the last trigger of a round (ms),
+                0 when using the general call
+
+        :rtype: dict
+        """
+        return {
+            'acquisitions': self._acquisitions_count,
+            'rounds': len(self._rounds),
+            'max_skew': self._max_skew * 1000,
+        }
+
+
+class DeadlineScheduler(object):
+    """ Decides which inputs are due for being read, each input having its own sampling period.
+
+    Inputs are kept in a heap ordered by their next deadline (earliest deadline first). Each
+    invocation of :py:meth:`get_due_inputs` returns the inputs which deadline has been reached,
+    in deadline order, and schedules their next reading one period later. The returned inputs are
+    then read by a :py:class:`ScanScheduler` or a :py:class:`OneShotScheduler`, which overlap the
+    conversions of both converters.
+
+    When a reading is so late that its next deadline has already been missed, the input is
+    rescheduled from the current time, and the miss is counted as an overrun. This happens when the
+    scheduler is invoked less often than the input period, or when the converter is overloaded,
+    which is given by its utilization : the sum of the conversion times of its inputs divided
+    by their periods. A converter with an utilization above 1 cannot read its inputs at their
+    requested rates.
+
+    >>> temperature = board.get_analog_input(1, rate=ADCPiBoard.RATE_18)
+    >>> current = board.get_analog_input(5)
+    >>> scheduler = DeadlineScheduler({temperature: 2., current: 0.01})
+    >>> due = scheduler.get_due_inputs()
+    >>> values, errors = ScanScheduler(due).scan()
+    """
+    def __init__(self, periods):
+        """
+        :param dict periods: the sampling periods (s) of the inputs, keyed by the inputs
+        """
+        if not periods:
+            raise ValueError('no input provided')
+        if any(period <= 0 for period in periods.itervalues()):
+            raise ValueError('invalid periods (%s)' % periods.values())
+        self._periods = dict(periods)
+
+        # [deadline, rank, input], the rank ensuring a stable ordering of inputs having the same deadline
+        self._heap = [[0., rank, adc_input] for rank, adc_input in enumerate(self._periods)]
+
+        loads = {}
+        for adc_input, period in self._periods.iteritems():
+            converter = adc_input.converter
+            loads[converter] = loads.get(converter, 0.) + adc_input.conversion_time / period
+        self._utilizations = loads
+
+        self._overruns = dict((adc_input, 0) for adc_input in self._periods)
+        self._max_lateness = 0.
+        self._readings_count = 0
+
+    @property
+    def periods(self):
+        return self._periods
+
+    @property
+    def utilization(self):
+        """ The utilization of the most loaded converter. """
+        return max(self._utilizations.itervalues())
+
+    @property
+    def next_deadline(self):
+        """ The time at which the next input is due. """
+        return self._heap[0][0]
+
+    def get_due_inputs(self, now=None):
+        """ Returns the inputs which are due, and schedules their next reading.
+
+        All the inputs are due at the first invocation.
+
+        :param float now: the current time (defaults to the actual one)
+        :return: the due inputs, by increasing deadlines
+        :rtype: list
+        """
+        if now is None:
+            now = time.time()
+        heap = self._heap
+        due = []
+        while heap[0][0] <= now:
+            entry = heap[0]
+            deadline, _, adc_input = entry
+            period = self._periods[adc_input]
+            if deadline:
+                self._max_lateness = max(self._max_lateness, now - deadline)
+                next_deadline = deadline + period
+                if next_deadline <= now:
+                    self._overruns[adc_input] += 1
+                    next_deadline = now + period
+            else:
+                next_deadline = now + period
+            entry[0] = next_deadline
+            heapq.heapreplace(heap, entry)
+            due.append(adc_input)
+
+        self._readings_count += len(due)
+        return due
+
+    def get_statistics(self):
+        """ Returns the scheduler statistics.
+
+        The returned dictionary contains the following items:
+
+            readings
+                (int) number of input readings scheduled
+            overruns
+                (int) total number of missed deadlines
+            max_lateness
+                (float) maximum delay between the deadline of an input and the time it was found due (ms)
+            utilization
+                (float) utilization of the most loaded converter
+
+        :rtype: dict
+        """
+        return {
+            'readings': self._readings_count,
+            'overruns': sum(self._overruns.itervalues()),
+            'max_lateness': self._max_lateness * 1000,
+            'utilization': self.utilization,
+        }
+
+    def get_overruns(self, adc_input):
+        """ Returns the number of missed deadlines of an input.
+
+        :param AnalogInput adc_input: the input
+        :rtype: int
+        """
+        return self._overruns[adc_input]
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides the conversion of the ADC readings into engineering units, using
+calibration curves.
+
+Curves are functions of the input voltage, as returned by :py:meth:`AnalogInput.convert_raw`, and
+can be :
+
+    - linear (:py:class:`LinearCurve`), for offset and gain corrections
+    - polynomial (:py:class:`PolynomialCurve`), for sensors with a smooth non linear response
+    - piecewise linear (:py:class:`PiecewiseLinearCurve`), for sensors characterized by a table of
+      points, such as thermistors
+
+For the sake of performances, the curve of an input is not evaluated for each reading when this can
+be avoided. At 12 and 14 bits resolutions, the conversion result of all the possible raw values is
+precomputed in a lookup table. At 16 and 18 bits, where such tables would be too large, arrays
+of readings are converted with vectorized operations (NumPy is required for this).
+
+Calibrations are persisted in JSON files, containing the curves specifications keyed by the input
+names, which can be loaded by the :py:class:`pybot.abelec.adcpi.control.ADCPiController` at startup
+(``calibrations`` configuration parameter) :
+
+    {
+        "temperature": {"type": "piecewise", "points": [[0.5, -10], [1.2, 25], [2.8, 80]], "unit": "degC"},
+        "pressure": {"type": "polynomial", "coefficients": [-0.1, 2.5, 0.02], "unit": "bar"},
+        "vbat": {"type": "linear", "gain": 4.03, "offset": -0.012, "unit": "V"}
+    }
+
+>>> temperature = InputCalibration(adc_input, PiecewiseLinearCurve([(0.5, -10), (1.2, 25), (2.8, 80)]))
+>>> t = temperature.convert(adc_input.read_raw())
+>>> temperatures = temperature.convert_array(adc_input.read_block(1000).raw)
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = [
+    'LinearCurve', 'PolynomialCurve', 'PiecewiseLinearCurve', 'InputCalibration',
+    'curve_from_dict', 'load_calibrations', 'save_calibrations'
+]
+
+import bisect
+import json
+import numbers
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class LinearCurve(object):
+    """ ``y = gain * v + offset`` """
+    def __init__(self, gain=1., offset=0., unit=None):
+        """
+        :param float gain: the gain
+        :param float offset: the offset
+        :param str unit: the engineering unit
+        """
+        self.gain = float(gain)
+        self.offset = float(offset)
+        self.unit = unit
+
+    def evaluate(self, v):
+        return self.gain * v + self.offset
+
+    def evaluate_array(self, v):
+        return self.gain * v + self.offset
+
+    def to_dict(self):
+        return {'type': 'linear', 'gain': self.gain, 'offset': self.offset, 'unit': self.unit}
+
+
+class PolynomialCurve(object):
+    """ ``y = c0 + c1 * v + c2 * v^2 + ...`` """
+    def __init__(self, coefficients, unit=None):
+        """
+        :param coefficients: the coefficients, by increasing degree
+        :param str unit: the engineering unit
+        """
+        if not coefficients:
+            raise ValueError('no coefficient provided')
+        self.coefficients = tuple(float(c) for c in coefficients)
+        self.unit = unit
+        self._reversed = self.coefficients[::-1]
+
+    def evaluate(self, v):
+        # Horner scheme
+        y = 0.
+        for c in self._reversed:
+            y = y * v + c
+        return y
+
+    def evaluate_array(self, v):
+        return np.polyval(self._reversed, v)
+
+    def to_dict(self):
+        return {'type': 'polynomial', 'coefficients': list(self.coefficients), 'unit': self.unit}
+
+
+class PiecewiseLinearCurve(object):
+    """ Linear interpolation between points.
+
+    Out of range voltages give the value of the nearest end point.
+    """
+    def __init__(self, points, unit=None):
+        """
+        :param points: the (voltage, value) points
+        :param str unit: the engineering unit
+        """
+        points = sorted((float(v), float(y)) for v, y in points)
+        if len(points) < 2:
+            raise ValueError('at least 2 points are required')
+        self.points = points
+        self.unit = unit
+        self._xs = [v for v, _ in points]
+        self._ys = [y for _, y in points]
+        if len(set(self._xs)) != len(self._xs):
+            raise ValueError('duplicate points voltages')
+
+    def evaluate(self, v):
+        xs, ys = self._xs, self._ys
+        if v <= xs[0]:
+            return ys[0]
+        if v >= xs[-1]:
+            return ys[-1]
+        i = bisect.bisect_right(xs, v)
+        x0, x1, y0, y1 = xs[i - 1], xs[i], ys[i - 1], ys[i]
+        return y0 + (y1 - y0) * (v - x0) / (x1 - x0)
+
+    def evaluate_array(self, v):
+        return np.interp(v, self._xs, self._ys)
+
+    def to_dict(self):
+        return {'type': 'piecewise', 'points': [list(p) for p in self.points], 'unit': self.unit}
+
+
+_curve_types = {
+    'linear': lambda d: LinearCurve(d.get('gain', 1.), d.get('offset', 0.), d.get('unit')),
+    'polynomial': lambda d: PolynomialCurve(d['coefficients'], d.get('unit')),
+    'piecewise': lambda d: PiecewiseLinearCurve(d['points'], d.get('unit')),
+}
+
+
+def curve_from_dict(d):
+    """ Creates a curve from its specifications, as produced by its ``to_dict`` method.
+
+    :param dict d: the curve specifications
+    :raise: ValueError if the specifications are not valid
+    """
+    try:
+        return _curve_types[d['type']](d)
+    except (KeyError, TypeError):
+        raise ValueError('invalid curve specifications : %s' % (d,))
+
+
+def load_calibrations(path):
+    """ Loads the calibration curves stored in a file.
+
+    :param str path: the file path
+    :return: the curves, keyed by input name
+    :rtype: dict
+    :raise: ValueError if the file content is not valid
+    """
+    with open(path) as fp:
+        try:
+            content = json.load(fp)
+        except ValueError as e:
+            raise ValueError('invalid calibrations file %s (%s)' % (path, e))
+    return dict((name, curve_from_dict(d)) for name, d in content.iteritems())
+
+
+def save_calibrations(path, curves):
+    """ Stores calibration curves in a file.
+
+    :param str path: the file path
+    :param dict curves: the curves, keyed by input name
+    """
+    with open(path, 'w') as fp:
+        json.dump(
+            dict((name, curve.to_dict()) for name, curve in curves.iteritems()),
+            fp, indent=4, sort_keys=True
+        )
+
+
+class InputCalibration(object):
+    """ The conversion of the readings of an input into engineering units.
+
+    Integer raw values are converted with a lookup table if the input resolution allows it, and
+    other ones (such as filtered values) by evaluating the curve.
+    """
+    # the maximum resolution for which a lookup table is built
+    LUT_MAX_RESOLUTION = 14
+
+    def __init__(self, adc_input, curve):
+        """
+        :param AnalogInput adc_input: the input
+        :param curve: the calibration curve
+        """
+        self._curve = curve
+        self._scale_factor = adc_input.convert_raw(1.)
+
+        if adc_input.raw_resolution <= self.LUT_MAX_RESOLUTION:
+            # the table covers the signed raw values range
+            self._lut_offset = 1 << (adc_input.raw_resolution - 1)
+            if np is not None:
+                self._lut = curve.evaluate_array(np.arange(-self._lut_offset, self._lut_offset) * self._scale_factor)
+                self._lut_list = self._lut.tolist()
+            else:
+                self._lut = None
+                self._lut_list = [
+                    curve.evaluate(raw * self._scale_factor) for raw in xrange(-self._lut_offset, self._lut_offset)
+                ]
+        else:
+            self._lut_offset = None
+            self._lut = self._lut_list = None
+
+    @property
+    def curve(self):
+        return self._curve
+
+    @property
+    def unit(self):
+        return self._curve.unit
+
+    def convert(self, raw):
+        """ Converts a raw value.
+
+        :param raw: the raw value
+        :rtype: float
+        """
+        if self._lut_list is not None and isinstance(raw, numbers.Integral):
+            return self._lut_list[raw + self._lut_offset]
+        return self._curve.evaluate(raw * self._scale_factor)
+
+    def convert_array(self, raw):
+        """ Converts an array of raw values, such as the raw values of a
+        :py:class:`pybot.abelec.adcpi.base.SampleBlock`.
+
+        :param raw: the raw values
+        :return: the converted values, as a NumPy array
+        :raise: ValueError if NumPy is not available
+        """
+        if np is None:
+            raise ValueError('cannot continue since NumPy is not available')
+        raw = np.asarray(raw)
+        if self._lut is not None and raw.dtype.kind in 'iu':
+            return self._lut[raw + self._lut_offset]
+        return self._curve.evaluate_array(raw * self._scale_factor)
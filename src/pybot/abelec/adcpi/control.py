@@ -3,9 +3,16 @@
 __author__ = 'Eric Pascual'
 
 from collections import namedtuple
+import threading
 import time
 
 from .base import *
+from .recorder import Recorder
+from .filters import create_filter
+from .calibration import InputCalibration, load_calibrations
+from .stats import create_aggregator
+from .alarms import AlarmDefinition, AlarmEngine
+from ..buses import BusWorker, collect_all
 
 try:
     from pybot.raspi import i2c_bus
@@ -17,12 +24,22 @@ except ImportError:
 class ADCPiController(object):
     """ The board controller.
 
-    Is provides high level operations and interfaces with the board for polling inputs periodically.
+    Is provides high level operations and interfaces with the board(s) for polling inputs periodically.
+
+    Several boards can be managed by the same controller, possibly spread over several I2C buses.
+    Their inputs share a single namespace. The conversions of all the converters of a bus are
+    overlapped, and when boards are connected to more than one bus, each bus is read by its own
+    worker thread, so that all buses are read in parallel.
 
     Inputs changes are monitored and appropriate signals are sent on D-Bus.
     """
-    _board = None
-    _i2c_address = None
+    MAX_BOARDS_PER_BUS = 4
+    MIN_I2C_ADDRESS = 0x68
+    MAX_I2C_ADDRESS = 0x6F
+    DEFAULT_BUS_ID = 1
+
+    _boards = None
+    _workers = None
     _inputs = None
     _inputs_value = None
     _logger = None
@@ -31,24 +48,62 @@ class ADCPiController(object):
 
     _verbose = False
 
-    def __init__(self, cfg, logger, verbose=False, debug=False):
-        """
+    def __init__(self, cfg, logger, verbose=False, debug=False, bus=None):
+        """ The boards are described by the ``boards`` configuration entry, as a list of dictionaries
+        containing the keys:
+
+            i2c_address
+                (int) I2C address of the board first converter
+            conv2_address
+                (int) I2C address of the board second converter (optional, defaults to ``i2c_address + 1``)
+            bus
+                the identifier of the bus the board is connected to (optional, defaults to 1)
+
+        Boards are numbered from 1, following the sequence of this list, and inputs specifications refer
+        to them with their ``board_num`` field. For single board configurations, the ``boards``
+        entry can be omitted and replaced by an ``i2c_address`` one.
+
+        The bus(es) can be provided as an instance of the I2C/SMBus class, shared by all the boards,
+        or as a dictionary of such instances, keyed by the bus identifiers used in the boards
+        configuration. If not provided, the RaspberryPi default bus is used.
+
         :param dict cfg: configuration dictionary (see :py:class:`ADCPiNode` for details)
         :param logger: logger as set by our owner
         :param bool verbose: verbose logs
         :param bool debug: debug mode
+        :param bus: the I2C/SMBus instance, or a dictionary of them keyed by bus identifiers
         """
         self._verbose = verbose
         self._debug = debug
 
         self._logger = logger
 
-        self._i2c_address = cfg.get('i2c_address', ADCPiBoard.CONV1_DEFAULT_ADDRESS)
-        self._logger.info("i2c_address = 0x%x", self._i2c_address)
+        self._boards_specs = boards_specs = self._parse_boards_specs(cfg)
+        self._logger.info('boards configuration:')
+        for num, specs in enumerate(boards_specs, 1):
+            self._logger.info("- #%d %s", num, specs)
+        self._check_boards(boards_specs)
 
         self._polling_period = cfg.get('polling_period', self._polling_period)
         self._logger.info("polling_period = %dms", self._polling_period)
 
+        # one-shot mode triggers the conversions of both converters together, possibly
+        # with the general call command
+        self._one_shot = cfg.get('one_shot', False)
+        self._general_call = cfg.get('general_call', False)
+        self._logger.info("one_shot = %s (general_call = %s)", self._one_shot, self._general_call)
+
+        # coalesced notifications are queued, keeping the last one only for each input
+        self._coalesce = cfg.get('coalesce', False)
+        self._logger.info("coalesce = %s", self._coalesce)
+        self._pending_notifications = {}
+        self._notifications_count = 0
+        self._coalesced_count = 0
+        self._summaries = []
+        # protects the queues above, which can be filled by the background acquisition, and the
+        # alarms evaluation producing the events
+        self._queues_lock = threading.Lock()
+
         try:
             input_specs = [
                 InputSpecifications.from_dict(name, parms)
@@ -65,25 +120,221 @@ class ADCPiController(object):
         # don't go further if no input is defined
         if not input_specs:
             raise ValueError('no input defined')
+        for specs in input_specs:
+            if not 1 <= specs.board_num <= len(boards_specs):
+                raise ValueError("invalid board num for input '%s' : %s" % (specs.name, specs.board_num))
 
+        if bus is None:
+            bus = i2c_bus
         # don't go further if we are not running on the real hardware
-        if not i2c_bus:
+        if not bus:
             raise ValueError('cannot continue since not running on a real RaspberryPi')
 
-        # suppose I2C addresses are configured in sequence
-        self._board = board = ADCPiBoard(i2c_bus, conv1_addr=self._i2c_address, conv2_addr=self._i2c_address+1)
-
-        # create input instances for those requested and index them by their name
-        self._inputs = dict((
-            (specs.name, _InputsDirectoryEntry(
-                board.get_analog_input(specs.channel, rate=specs.rate_x, gain=specs.gain_x),
-                int(2**specs.resolution * specs.drel_min)
+        self._boards = boards = [
+            ADCPiBoard(self._get_bus(bus, specs.bus), conv1_addr=specs.i2c_address, conv2_addr=specs.conv2_address)
+            for specs in boards_specs
+        ]
+
+        # create input instances for those requested and index them by their name, keeping track
+        # of the bus they are read through
+        self._inputs = {}
+        self._input_buses = {}
+        for specs in input_specs:
+            board = boards[specs.board_num - 1]
+            bus_id = boards_specs[specs.board_num - 1].bus
+            adc_input = board.get_analog_input(
+                specs.channel, rate=specs.rate_x, gain=specs.gain_x, timeout=specs.timeout, single=self._one_shot,
+                auto_gain=specs.auto_gain
+            )
+            entry = self._inputs[specs.name] = _InputsDirectoryEntry(
+                adc_input,
+                int(2**adc_input.raw_resolution * specs.drel_min),
+                create_filter(specs.filter) if specs.filter else None
+            )
+            self._input_buses[adc_input] = bus_id
+            if specs.watch:
+                entry.watch_input = board.get_watch_input(specs.channel, gain=specs.gain_x, single=self._one_shot)
+                self._input_buses[entry.watch_input] = bus_id
+            entry.hysteresis = int(2**adc_input.raw_resolution * specs.hysteresis)
+            entry.min_interval = specs.min_interval / 1000. if specs.min_interval else None
+            entry.max_interval = specs.max_interval / 1000. if specs.max_interval else None
+            if specs.stats:
+                entry.aggregator = create_aggregator(specs.stats)
+
+        # inputs with notification intervals must be checked even when not read
+        self._timed_entries = [
+            (name, entry) for name, entry in self._inputs.iteritems() if entry.min_interval or entry.max_interval
+        ]
+
+        # inputs are read with overlapped conversions on all the converters of a bus, watched
+        # ones being read at low resolution, and at full resolution only when needed
+        self._primary_inputs = [entry.watch_input or entry.adc_input for entry in self._inputs.itervalues()]
+        buses = {}
+        for entry in self._inputs.itervalues():
+            for adc_input in (entry.watch_input, entry.adc_input):
+                if adc_input:
+                    buses.setdefault(self._input_buses[adc_input], []).append(adc_input)
+        self._schedulers = dict(
+            (bus_id, OneShotScheduler(bus_inputs, general_call=self._general_call) if self._one_shot
+             else ScanScheduler(bus_inputs))
+            for bus_id, bus_inputs in buses.iteritems()
+        )
+        self._precise_conversions_count = 0
+
+        # inputs with their own sampling period are read only when due, the other ones being
+        # read at each polling
+        if any(specs.period for specs in input_specs):
+            self._deadline_scheduler = DeadlineScheduler(dict(
+                (self._inputs[specs.name].watch_input or self._inputs[specs.name].adc_input,
+                 (specs.period or self._polling_period) / 1000.)
+                for specs in input_specs
             ))
-            for specs in input_specs
-        ))
+            for specs in input_specs:
+                if specs.period and specs.period < self._polling_period:
+                    self._logger.warning(
+                        "input '%s' period (%dms) is shorter than the polling period", specs.name, specs.period
+                    )
+            utilization = self._deadline_scheduler.utilization
+            self._logger.info("converters utilization = %.2f", utilization)
+            if utilization > 1:
+                self._logger.warning("converters overloaded, inputs periods will not be met")
+        else:
+            self._deadline_scheduler = None
+        self._input_names = dict((entry.adc_input, name) for name, entry in self._inputs.iteritems())
+        self._input_names.update(
+            (entry.watch_input, name) for name, entry in self._inputs.iteritems() if entry.watch_input
+        )
+
+        # optional calibration curves, converting the readings in engineering units
+        calibrations_path = cfg.get('calibrations')
+        if calibrations_path:
+            self._logger.info("loading calibrations from %s", calibrations_path)
+            for name, curve in load_calibrations(calibrations_path).iteritems():
+                try:
+                    entry = self._inputs[name]
+                except KeyError:
+                    self._logger.warning("calibration ignored for unknown input '%s'", name)
+                else:
+                    entry.calibration = InputCalibration(entry.adc_input, curve)
+
+        # optional recording of all the readings in a ring file
+        try:
+            recorder_cfg = cfg['recorder']
+        except KeyError:
+            self._recorder = None
+        else:
+            self._recorder = Recorder(
+                recorder_cfg['path'],
+                capacity=recorder_cfg.get('capacity', Recorder.DEFAULT_CAPACITY),
+                with_volts=recorder_cfg.get('volts', True)
+            )
+            self._logger.info("recording readings in %s", recorder_cfg['path'])
+
+        # optional alarms, evaluated after each update of the inputs
+        alarms_cfg = cfg.get('alarms')
+        if alarms_cfg:
+            definitions = [AlarmDefinition.from_dict(d) for d in alarms_cfg]
+            input_names = sorted(set(d.input for d in definitions))
+            for name in input_names:
+                if name not in self._inputs:
+                    raise ValueError("alarm defined on unknown input '%s'" % name)
+            self._alarms = AlarmEngine(input_names, definitions)
+            for i, name in enumerate(input_names):
+                self._inputs[name].alarm_index = i
+            self._alarm_values = [float('nan')] * len(input_names)
+            self._logger.info("%d alarms defined", len(definitions))
+        else:
+            self._alarms = None
+        self._alarm_events = []
+
+        self._acquisition_thread = None
+        self._acquisition_stop_requested = False
+        self._acquisition_cycles = 0
+        self._acquisition_overruns = 0
+
+        # each bus is read by its own worker when several buses are involved (started only once
+        # the configuration has been fully checked, so that no thread is left behind on errors)
+        if len(self._schedulers) > 1:
+            self._workers = dict((bus_id, BusWorker(bus_id, 'adcpi-bus')) for bus_id in self._schedulers)
+            for worker in self._workers.itervalues():
+                worker.start()
+        else:
+            self._workers = {}
 
         self._active = True
 
+    @staticmethod
+    def _parse_boards_specs(cfg):
+        boards_cfg = cfg.get('boards') or [
+            {'i2c_address': cfg.get('i2c_address', ADCPiBoard.CONV1_DEFAULT_ADDRESS)}
+        ]
+        return [BoardSpecifications.from_dict(d) for d in boards_cfg]
+
+    @classmethod
+    def _check_boards(cls, boards_specs):
+        if not boards_specs:
+            raise ValueError('at least one board must be defined')
+
+        addresses = {}
+        boards_count = {}
+        for specs in boards_specs:
+            boards_count[specs.bus] = boards_count.get(specs.bus, 0) + 1
+            if boards_count[specs.bus] > cls.MAX_BOARDS_PER_BUS:
+                raise ValueError('too many boards on bus %s (max=%d)' % (specs.bus, cls.MAX_BOARDS_PER_BUS))
+            bus_addresses = addresses.setdefault(specs.bus, set())
+            for addr in (specs.i2c_address, specs.conv2_address):
+                if not cls.MIN_I2C_ADDRESS <= addr <= cls.MAX_I2C_ADDRESS:
+                    raise ValueError('invalid I2C address (0x%x)' % addr)
+                if addr in bus_addresses:
+                    raise ValueError('I2C address 0x%x used more than once on bus %s' % (addr, specs.bus))
+                bus_addresses.add(addr)
+
+    @staticmethod
+    def _get_bus(bus, bus_id):
+        if isinstance(bus, dict):
+            try:
+                return bus[bus_id]
+            except KeyError:
+                raise ValueError('bus not provided : %s' % bus_id)
+        return bus
+
+    @property
+    def boards(self):
+        """ The boards managed by the controller, in configuration order. """
+        return tuple(self._boards)
+
+    def _read_inputs(self, inputs):
+        """ Reads a set of inputs, using the scheduler of the bus they belong to.
+
+        When several buses are involved, they are read in parallel by their respective workers.
+
+        :return: a tuple composed of a dictionary containing the raw values keyed by the input,
+        and a dictionary containing the errors of the failed inputs
+        """
+        buses = {}
+        for adc_input in inputs:
+            buses.setdefault(self._input_buses[adc_input], []).append(adc_input)
+        if len(buses) == 1:
+            bus_id, bus_inputs = buses.popitem()
+            return self._run_scheduler(self._schedulers[bus_id], bus_inputs)
+
+        workers = []
+        for bus_id, bus_inputs in buses.iteritems():
+            worker = self._workers[bus_id]
+            worker.trigger(self._run_scheduler, self._schedulers[bus_id], bus_inputs)
+            workers.append(worker)
+        values, errors = {}, {}
+        for bus_values, bus_errors in collect_all(workers):
+            values.update(bus_values)
+            errors.update(bus_errors)
+        return values, errors
+
+    def _run_scheduler(self, scheduler, inputs):
+        if self._one_shot:
+            readings, errors = scheduler.acquire(inputs)
+            return dict((adc_input, reading.value) for adc_input, reading in readings.iteritems()), errors
+        return scheduler.scan(inputs)
+
     @property
     def polling_period(self):
         return self._polling_period
@@ -92,15 +343,67 @@ class ADCPiController(object):
     def input_names(self):
         return self._inputs.keys()
 
+    def get_statistics(self):
+        """ Returns the controller statistics.
+
+        The returned dictionary contains the totals of the inputs statistics (see
+        :py:meth:`AnalogInput.get_statistics`), an ``inputs`` item containing
+        the statistics of each input, keyed by the input names, a ``scan`` item containing
+        the scheduler statistics (see :py:meth:`ScanScheduler.get_statistics` and
+        :py:meth:`OneShotScheduler.get_statistics`), keyed by the bus identifiers if several buses
+        are involved, a ``precise_conversions`` item counting
+        the high resolution conversions of the watched inputs, a ``notifications`` item counting
+        the changes notifications and a ``coalesced`` one counting the queued notifications
+        replaced by a more recent one before being retrieved, and an ``acquisition`` item
+        with the state of the background acquisition (see :py:meth:`start_acquisition`),
+        its cycles count and the number of cycles which lasted longer than the polling period.
+        If inputs have their own sampling
+        period, a ``deadlines`` item contains the statistics of their scheduling (see
+        :py:meth:`DeadlineScheduler.get_statistics`).
+
+        :rtype: dict
+        """
+        inputs_stats = dict(
+            (name, entry.adc_input.get_statistics()) for name, entry in self._inputs.iteritems()
+        )
+        stats = {'inputs': inputs_stats}
+        for input_stats in inputs_stats.itervalues():
+            for k, v in input_stats.iteritems():
+                stats[k] = stats.get(k, 0) + v
+        if len(self._schedulers) == 1:
+            stats['scan'] = self._schedulers.values()[0].get_statistics()
+        else:
+            stats['scan'] = dict(
+                (bus_id, scheduler.get_statistics()) for bus_id, scheduler in self._schedulers.iteritems()
+            )
+        stats['precise_conversions'] = self._precise_conversions_count
+        stats['notifications'] = self._notifications_count
+        stats['coalesced'] = self._coalesced_count
+        stats['acquisition'] = {
+            'running': self.acquisition_running,
+            'cycles': self._acquisition_cycles,
+            'overruns': self._acquisition_overruns,
+        }
+        if self._deadline_scheduler:
+            stats['deadlines'] = self._deadline_scheduler.get_statistics()
+        return stats
+
     def shutdown(self):
         """ Deactivates running tasks as part of the node shutdown sequence.
         """
         self._active = False
+        self.stop_acquisition()
+        for worker in self._workers.itervalues():
+            worker.terminate()
 
         # ensure we have a chance to end what is running
         time.sleep(2 * self._polling_period / 1000.)
 
-    def update_inputs(self, notification_callback):
+        if self._recorder:
+            self._recorder.close()
+            self._recorder = None
+
+    def update_inputs(self, notification_callback=None):
         """ This method must be invoked periodically by the application to read the inputs and monitor their
         value.
 
@@ -115,28 +418,320 @@ class ADCPiController(object):
                 (string) the name of the IO which state has changed
 
             new_value
-                (int) its new raw value
+                (int) its new raw value, or the filtered one (float) if a filter is configured
+                for the input
 
             voltage
-                (float) the raw value converted to a voltage
+                (float) the raw value converted to a voltage, or to engineering units if a calibration
+                curve is defined for the input
+
+        Inputs configured with the ``watch`` option are read at 12 bits resolution, and converted at
+        their configured resolution only when the low resolution reading differs from the last full
+        resolution one by at least ``drel_min``, or when requested by :py:meth:`request_precise_readings`.
+        Notified values are always full resolution ones.
+
+        Inputs configured with a ``period`` are read only when this period has elapsed since their
+        previous reading, the other ones being read at each invocation.
+
+        A change is notified when the value differs from the last notified one by at least ``drel_min``,
+        this threshold being increased by ``hysteresis`` when the change reverses the direction of
+        the previous one. Inputs configured with a ``min_interval`` are not notified more often than
+        this, the last value being notified when the interval is over if it still differs from the
+        notified one. Inputs configured with a ``max_interval`` are notified at least that often,
+        even if their value did not change.
+
+        If the controller is configured with the ``coalesce`` option, notifications are not passed
+        to the callback, but queued for being retrieved by :py:meth:`pop_notifications`, only the
+        last one being kept for each input.
+
+        :param notification_callback: the callback for inputs changes notification (not used if
+        notifications are coalesced)
+        """
+        if self._deadline_scheduler:
+            due_inputs = self._deadline_scheduler.get_due_inputs()
+        else:
+            due_inputs = self._primary_inputs
+        values, errors = self._read_inputs(due_inputs) if due_inputs else ({}, {})
+        for adc_input, e in errors.iteritems():
+            self._logger.error("input '%s' read failed : %s", self._input_names[adc_input], e)
+
+        # watched inputs are converted at their full resolution only if they changed significantly,
+        # or on request
+        precise_inputs = []
+        for adc_input, new_value in values.iteritems():
+            input_name = self._input_names[adc_input]
+            entry = self._inputs[input_name]
+            if adc_input is entry.watch_input:
+                if entry.precise_requested or self._watch_changed(entry, new_value):
+                    precise_inputs.append(entry.adc_input)
+                    entry.precise_requested = False
+            else:
+                self._process_reading(input_name, entry, new_value, notification_callback)
+
+        if precise_inputs:
+            values, errors = self._read_inputs(precise_inputs)
+            self._precise_conversions_count += len(values)
+            for adc_input, e in errors.iteritems():
+                self._logger.error("input '%s' read failed : %s", self._input_names[adc_input], e)
+            for adc_input, new_value in values.iteritems():
+                input_name = self._input_names[adc_input]
+                self._process_reading(input_name, self._inputs[input_name], new_value, notification_callback)
+
+        # held changes and heartbeats
+        if self._timed_entries:
+            now = time.time()
+            for input_name, entry in self._timed_entries:
+                if entry.sample is not None:
+                    self._check_notification(input_name, entry, now, notification_callback)
+
+        if self._alarms:
+            alarm_values = self._alarm_values
+            # events are queued in the same critical section as the evaluation, so that they
+            # stay ordered with the ones of acknowledgements made by other threads
+            with self._queues_lock:
+                events = self._alarms.evaluate(alarm_values)
+                self._alarm_events.extend(events)
+            for event in events:
+                self._logger.warning(
+                    "alarm '%s' %s (value=%s)", event.name, 'raised' if event.raised else 'cleared', event.value
+                )
+            # inputs not read by the next update must not be evaluated again
+            for i in xrange(len(alarm_values)):
+                alarm_values[i] = float('nan')
+
+        return self._active
+
+    @staticmethod
+    def _watch_changed(entry, watch_value):
+        """ Tells if the low resolution reading of a watched input differs significantly from
+        its last full resolution reading.
+        """
+        last_value = entry.last_precise_value
+        if last_value is None:
+            return True
+        watch_voltage = entry.watch_input.convert_raw(watch_value)
+        adc_input = entry.adc_input
+        return abs(watch_voltage - adc_input.convert_raw(last_value)) >= adc_input.convert_raw(entry.delta_min)
+
+    def _process_reading(self, input_name, entry, new_value, notification_callback):
+        """ Records, filters and notifies a new reading of an input. """
+        adc_input = entry.adc_input
+        entry.last_precise_value = new_value
+        if self._recorder:
+            self._recorder.record(input_name, new_value, adc_input.convert_raw(new_value))
+
+        if entry.aggregator:
+            if entry.calibration:
+                summary = entry.aggregator.update(entry.calibration.convert(new_value))
+            else:
+                summary = entry.aggregator.update(adc_input.convert_raw(new_value))
+            if summary:
+                with self._queues_lock:
+                    self._summaries.append((input_name, summary))
+
+        # changes are detected on the filtered value
+        if entry.filter:
+            new_value = entry.filter.update(new_value)
+            if new_value is None:
+                return
+
+        now = time.time()
+        if entry.calibration:
+            voltage = entry.calibration.convert(new_value)
+        else:
+            voltage = adc_input.convert_raw(new_value)
+        # published as a single immutable object, so that readers never see a partial update
+        entry.sample = InputSample(new_value, voltage, now)
+        if entry.alarm_index is not None:
+            self._alarm_values[entry.alarm_index] = voltage
 
-        :param notification_callback: the callback for inputs changes notification
+        self._check_notification(input_name, entry, now, notification_callback)
+
+    def _check_notification(self, input_name, entry, now, notification_callback):
+        """ Notifies the current value of an input if it changed significantly since the last
+        notification, according to its notification options.
         """
-        for input_name, entry in self._inputs.iteritems():
-            adc_input = entry.adc_input
-            new_value = adc_input.read_raw()
+        new_value, voltage, _ = entry.sample
+        value, _ = entry.last_reading
 
-            value, _ = entry.last_reading
+        if value is None:
+            changed = True
+        else:
+            delta = new_value - value
+            threshold = entry.delta_min
+            if delta * entry.direction < 0:
+                threshold += entry.hysteresis
+            changed = abs(delta) >= threshold
+
+        elapsed = now - entry.notified_at
+        if changed:
+            if entry.min_interval and elapsed < entry.min_interval:
+                # will be notified when the interval is over, if still relevant
+                return
+        elif not (entry.max_interval and elapsed >= entry.max_interval):
+            return
+
+        if self._verbose:
+            self._logger.info("input '%s' changed to %f (raw=%s)", input_name, voltage, new_value)
+
+        if self._coalesce:
+            with self._queues_lock:
+                if input_name in self._pending_notifications:
+                    self._coalesced_count += 1
+                self._pending_notifications[input_name] = (new_value, voltage)
+        else:
+            notification_callback(input_name, new_value, voltage)
+        self._notifications_count += 1
 
-            if value is None or abs(new_value - value) >= entry.delta_min:
-                voltage = adc_input.convert_raw(new_value)
-                if self._verbose:
-                    self._logger.info("input '%s' changed to %f V (raw=%d)", input_name, voltage, new_value)
-                notification_callback(input_name, new_value, voltage)
+        if changed and value is not None and new_value != value:
+            entry.direction = 1 if new_value > value else -1
+        entry.last_reading = (new_value, voltage)
+        entry.notified_at = now
 
-                entry.last_reading = (new_value, voltage)
+    def pop_summaries(self):
+        """ Returns the windows summaries produced since the previous call by the inputs configured
+        with a ``stats`` aggregator.
 
-        return self._active
+        Summaries are computed on the unfiltered readings, converted to voltages, or to engineering
+        units if a calibration curve is defined for the input.
+
+        :return: the list of the summaries, as tuples (name, summary), ``summary`` being a
+        :py:class:`pybot.abelec.adcpi.stats.WindowSummary`
+        :rtype: list
+        """
+        with self._queues_lock:
+            summaries, self._summaries = self._summaries, []
+        return summaries
+
+    def pop_alarm_events(self):
+        """ Returns the alarm events produced since the previous call.
+
+        Alarms are defined by the ``alarms`` configuration parameter, as a list of dictionaries
+        accepted by :py:meth:`pybot.abelec.adcpi.alarms.AlarmDefinition.from_dict`, their thresholds
+        applying to the values notified for the inputs (voltages, or engineering units if the input
+        is calibrated).
+
+        :return: the list of events, as :py:class:`pybot.abelec.adcpi.alarms.AlarmEvent` instances
+        :rtype: list
+        """
+        with self._queues_lock:
+            events, self._alarm_events = self._alarm_events, []
+        return events
+
+    def acknowledge_alarm(self, name):
+        """ Acknowledges an alarm, clearing it if it is latched and its condition has disappeared.
+
+        :param str name: the alarm name
+        """
+        if not self._alarms:
+            raise ValueError('no alarm defined')
+        with self._queues_lock:
+            self._alarm_events.extend(self._alarms.acknowledge(name))
+
+    def get_active_alarms(self):
+        """ Returns the raised alarms.
+
+        :return: a list of tuples (name, acknowledged)
+        :rtype: list
+        """
+        return self._alarms.get_active_alarms() if self._alarms else []
+
+    def pop_notifications(self):
+        """ Returns the notifications queued since the previous call, when notifications are coalesced.
+
+        :return: the list of the notifications, as tuples (name, new_value, voltage) (see
+        :py:meth:`update_inputs`)
+        :rtype: list
+        """
+        with self._queues_lock:
+            pending, self._pending_notifications = self._pending_notifications, {}
+        return [(name, new_value, voltage) for name, (new_value, voltage) in pending.iteritems()]
+
+    def request_precise_readings(self, names=None):
+        """ Requests a full resolution conversion of watched inputs, which will be done by the next
+        invocation of :py:meth:`update_inputs`, whatever their changes.
+
+        :param names: the names of the inputs, all the watched ones if not provided
+        """
+        for name in (names or self._inputs.keys()):
+            entry = self._inputs[name]
+            if entry.watch_input:
+                entry.precise_requested = True
+
+    def start_acquisition(self, notification_callback=None):
+        """ Starts the background acquisition of the inputs.
+
+        A worker thread invokes :py:meth:`update_inputs` at the polling period, so that the latest
+        samples of the inputs are always available with :py:meth:`get_samples`, without waiting
+        for a conversion. The application must not invoke :py:meth:`update_inputs` while the
+        acquisition is running.
+
+        :param notification_callback: the callback for inputs changes notification, invoked from
+        the worker thread (see :py:meth:`update_inputs`)
+        """
+        if self.acquisition_running:
+            raise ValueError('acquisition already running')
+        self._acquisition_stop_requested = False
+        self._acquisition_thread = threading.Thread(
+            target=self._acquire, args=(notification_callback,), name='adcpi-acquisition'
+        )
+        self._acquisition_thread.daemon = True
+        self._acquisition_thread.start()
+
+    def stop_acquisition(self, timeout=None):
+        """ Stops the background acquisition, if running, and waits for the worker termination.
+
+        :param float timeout: the maximum waiting time (s), None for waiting forever
+        """
+        thread = self._acquisition_thread
+        if thread:
+            self._acquisition_stop_requested = True
+            thread.join(timeout)
+            self._acquisition_thread = None
+
+    @property
+    def acquisition_running(self):
+        thread = self._acquisition_thread
+        return bool(thread and thread.is_alive())
+
+    def _acquire(self, notification_callback):
+        period = self._polling_period / 1000.
+        next_cycle = time.time()
+        while not self._acquisition_stop_requested and self._active:
+            try:
+                self.update_inputs(notification_callback)
+            except Exception:
+                self._logger.exception('inputs update failed')
+            self._acquisition_cycles += 1
+
+            next_cycle += period
+            now = time.time()
+            if next_cycle > now:
+                time.sleep(next_cycle - now)
+            else:
+                self._acquisition_overruns += 1
+                next_cycle = now
+
+    def get_sample(self, name):
+        """ Returns the latest sample of an input, without accessing the bus.
+
+        The sample is the last reading of the input, whether it has been notified or not.
+        This method never blocks, and can be used concurrently by any number of threads.
+
+        :param str name: the input name
+        :return: the sample, None if the input has not been read yet
+        :rtype: InputSample
+        """
+        return self._inputs[name].sample
+
+    def get_samples(self, names=None):
+        """ Returns the latest samples of several inputs (see :py:meth:`get_sample`).
+
+        :param names: the list of input names (all of them if not provided)
+        :return: the list of samples, synchronized with the ``names`` parameter
+        """
+        inputs = self._inputs
+        return [inputs[name].sample for name in (names or inputs.keys())]
 
     def get_inputs_values(self, names):
         """ Returns the current raw value and converted voltage of the inputs, as updated in the last loop iteration
@@ -147,41 +742,134 @@ class ADCPiController(object):
         return [self._inputs[name].last_reading for name in names]
 
 
-class InputSpecifications(namedtuple('InputSpecifications', 'name channel resolution gain drel_min rate_x gain_x')):
+class InputSample(namedtuple('InputSample', 'value voltage timestamp')):
+    """ The latest reading of an input.
+
+    ``value`` is the raw value (or the filtered one if a filter is configured for the input),
+    and ``voltage`` its conversion to a voltage or to engineering units.
+    """
+    __slots__ = ()
+
+    @property
+    def age(self):
+        """ The time elapsed since the reading (s). """
+        return time.time() - self.timestamp
+
+
+class InputSpecifications(namedtuple('InputSpecifications',
+                                     'name channel resolution gain drel_min rate_x gain_x timeout filter '
+                                     'auto_gain watch period hysteresis min_interval max_interval stats '
+                                     'board_num')):
+    """ The specifications of an input.
+
+    ``channel`` is the input number on its board (in [1-8]), and ``board_num`` the number of this
+    board in the controller configuration (starting from 1).
+
+    ``gain`` can be set to ``'auto'`` for automatic gain ranging (see :py:class:`AnalogInput`).
+
+    ``filter`` contains the specifications of the filter applied to the readings, as accepted by
+    :py:func:`pybot.abelec.adcpi.filters.create_filter`.
+
+    ``watch`` set to True enables the detection of the changes at 12 bits resolution, for inputs
+    configured with a higher one (see :py:meth:`ADCPiController.update_inputs`).
+
+    ``period`` is the sampling period of the input (ms), the input being read at each polling
+    if not provided.
+
+    ``hysteresis`` (relative to the full scale, as ``drel_min``), ``min_interval`` and ``max_interval``
+    (ms) shape the changes notifications (see :py:meth:`ADCPiController.update_inputs`).
+
+    ``stats`` contains the specifications of the windowed statistics aggregator of the readings,
+    as accepted by :py:func:`pybot.abelec.adcpi.stats.create_aggregator` (see
+    :py:meth:`ADCPiController.pop_summaries`).
+    """
     __slots__ = ()
 
-    def __new__(cls, name, channel, resolution=None, gain=None, drel_min=0.005):
+    def __new__(cls, name, channel, resolution=None, gain=None, drel_min=0.005, timeout=None, filter=None,
+                watch=False, period=None, hysteresis=0, min_interval=None, max_interval=None,
+                stats=None, board_num=1):
         if not name:
             raise ValueError('name is mandatory')
+        if not 1 <= channel <= 8:
+            raise ValueError('invalid channel : %s' % channel)
         if resolution is None:
             resolution = 12
         rate_x = ADCPiBoard.resolution_to_rate_x[resolution]
         if gain is None:
             gain = 1
-        gain_x = ADCPiBoard.gain_factor_to_gain_x[gain]
+        auto_gain = gain == 'auto'
+        gain_x = ADCPiBoard.GAIN_x1 if auto_gain else ADCPiBoard.gain_factor_to_gain_x[gain]
         if not 0 <= drel_min <= 1.0:
             raise ValueError('invalid drel_min : %s' % drel_min)
-        return super(InputSpecifications, cls).__new__(cls, name, channel, resolution, gain, drel_min, rate_x, gain_x)
+        if watch and resolution == 12:
+            raise ValueError('watch mode requires a resolution higher than 12 bits')
+        if period is not None and period <= 0:
+            raise ValueError('invalid period : %s' % period)
+        if not 0 <= hysteresis <= 1.0:
+            raise ValueError('invalid hysteresis : %s' % hysteresis)
+        if min_interval and max_interval and min_interval > max_interval:
+            raise ValueError('min_interval (%s) greater than max_interval (%s)' % (min_interval, max_interval))
+        return super(InputSpecifications, cls).__new__(
+            cls, name, channel, resolution, gain, drel_min, rate_x, gain_x, timeout, filter, auto_gain, watch, period,
+            hysteresis, min_interval, max_interval, stats, board_num
+        )
 
     def __str__(self):
-        return "name:%s channel:%d resolution:%d gain:%d drel_min=%f" % (
-            self.name, self.channel, self.resolution, self.gain, self.drel_min
+        return "name:%s board:%d channel:%d resolution:%d gain:%s drel_min=%f" % (
+            self.name, self.board_num, self.channel, self.resolution, self.gain, self.drel_min
         )
 
     @classmethod
     def from_dict(cls, name, d):
         kwargs = dict([
-            (k, d[k]) for k in set(InputSpecifications._fields) - {'name', 'rate_x', 'gain_x'} if k in d
+            (k, d[k]) for k in set(InputSpecifications._fields) - {'name', 'rate_x', 'gain_x', 'auto_gain'} if k in d
         ])
         return InputSpecifications(name, **kwargs)
 
 
+class BoardSpecifications(namedtuple('BoardSpecifications', 'i2c_address conv2_address bus')):
+    __slots__ = ()
+
+    def __new__(cls, i2c_address=ADCPiBoard.CONV1_DEFAULT_ADDRESS, conv2_address=None,
+                bus=ADCPiController.DEFAULT_BUS_ID):
+        if conv2_address is None:
+            # suppose I2C addresses are configured in sequence
+            conv2_address = i2c_address + 1
+        return super(BoardSpecifications, cls).__new__(cls, i2c_address, conv2_address, bus)
+
+    @classmethod
+    def from_dict(cls, d):
+        return BoardSpecifications(
+            **dict([(fld, d[fld]) for fld in BoardSpecifications._fields if fld in d])
+        )
+
+    def __str__(self):
+        return "i2c_address:0x%x conv2_address:0x%x bus:%s" % (
+            self.i2c_address, self.conv2_address, self.bus
+        )
+
+
 class _InputsDirectoryEntry(object):
-        __slots__ = ('adc_input', 'delta_min', 'last_reading')
+        __slots__ = (
+            'adc_input', 'delta_min', 'filter', 'calibration', 'last_reading',
+            'watch_input', 'last_precise_value', 'precise_requested',
+            'hysteresis', 'min_interval', 'max_interval', 'direction', 'notified_at',
+            'aggregator', 'sample', 'alarm_index'
+        )
 
-        def __init__(self, adc_input, delta_min):
+        def __init__(self, adc_input, delta_min, filter=None):
             self.adc_input = adc_input
             self.delta_min = delta_min
+            self.filter = filter
+            self.calibration = None
+            self.watch_input = None
+            self.last_precise_value = None
+            self.precise_requested = False
+            self.hysteresis = 0
+            self.min_interval = self.max_interval = None
+            self.direction = 0
+            self.notified_at = 0.
+            self.aggregator = None
+            self.sample = None
+            self.alarm_index = None
             self.last_reading = (None, None)
-
-
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides digital filters for smoothing the readings of the ADC inputs.
+
+All the filters are computed incrementally, with a cost per sample which does not depend on the
+window size (or only logarithmically for the median), and their state is allocated once for all
+at creation time. They share the same interface : the method ``update``
+processes a new sample and returns the filtered value, or None if no value is available yet
+(this is the case of decimating filters, which output a value every N samples only).
+
+Filters can be chained, using a :py:class:`FilterChain`.
+
+>>> f = FilterChain([RunningMedian(5), ExponentialMovingAverage(0.2)])
+>>> for raw in samples:
+>>>     smoothed = f.update(raw)
+
+Filters are configured in the :py:class:`pybot.abelec.adcpi.control.ADCPiController` input
+specifications, as a dictionary containing the filter type and its parameters, or as a list of
+such dictionaries for a chain (see :py:func:`create_filter`).
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = [
+    'ExponentialMovingAverage', 'MovingAverage', 'RunningMedian', 'Oversampler', 'FilterChain', 'create_filter'
+]
+
+from array import array
+import heapq
+
+
+class ExponentialMovingAverage(object):
+    """ Exponential moving average, computed as ``y += alpha * (x - y)``.
+
+    The first sample initializes the average.
+    """
+    def __init__(self, alpha):
+        """
+        :param float alpha: the smoothing factor (in ]0, 1]), lower values giving a smoother output
+        """
+        if not 0 < alpha <= 1:
+            raise ValueError('invalid alpha (%s)' % alpha)
+        self._alpha = alpha
+        self._value = None
+
+    @property
+    def value(self):
+        return self._value
+
+    def reset(self):
+        self._value = None
+
+    def update(self, sample):
+        if self._value is None:
+            self._value = float(sample)
+        else:
+            self._value += self._alpha * (sample - self._value)
+        return self._value
+
+
+class MovingAverage(object):
+    """ Mean of the last N samples.
+
+    A running sum is maintained, so that the cost per sample does not depend on the window size.
+    It is recomputed from the samples each time the window is completely renewed, to avoid the
+    accumulation of rounding errors.
+    """
+    def __init__(self, window):
+        """
+        :param int window: the number of samples averaged
+        """
+        if window <= 0:
+            raise ValueError('invalid window (%s)' % window)
+        self._window = window
+        self._samples = array('d', [0.]) * window
+        self.reset()
+
+    @property
+    def value(self):
+        return self._sum / self._count if self._count else None
+
+    def reset(self):
+        self._sum = 0.
+        self._count = 0
+        self._index = 0
+
+    def update(self, sample):
+        samples, index = self._samples, self._index
+        if self._count == self._window:
+            self._sum -= samples[index]
+        else:
+            self._count += 1
+        samples[index] = sample
+        self._sum += sample
+
+        index += 1
+        if index == self._window:
+            index = 0
+            self._sum = sum(samples)
+        self._index = index
+        return self._sum / self._count
+
+
+class RunningMedian(object):
+    """ Median of the last N samples.
+
+    Samples are split between a max-heap containing the lower half of the window and a min-heap
+    containing the upper half, so that the median is found at their tops. Samples leaving the window
+    are not searched in the heaps, but recorded for being discarded when they reach the top of
+    their heap (lazy deletion), which gives a logarithmic cost per sample. Since such samples can
+    stay buried in the heaps, these are rebuilt from the window content when they become too large,
+    which keeps the amortized cost logarithmic.
+    """
+    def __init__(self, window):
+        """
+        :param int window: the number of samples the median is computed on
+        """
+        if window <= 0:
+            raise ValueError('invalid window (%s)' % window)
+        self._window = window
+        self._samples = array('d', [0.]) * window
+        self.reset()
+
+    @property
+    def value(self):
+        return self._median() if self._count else None
+
+    def reset(self):
+        self._low = []          # max-heap of the lower half (values are negated)
+        self._high = []         # min-heap of the upper half
+        self._low_size = 0      # sizes, not counting the samples waiting for deletion
+        self._high_size = 0
+        self._delayed = {}      # samples waiting for deletion, with their count
+        self._count = 0
+        self._index = 0
+
+    def update(self, sample):
+        sample = float(sample)
+        samples, index = self._samples, self._index
+        if self._count == self._window:
+            self._remove(samples[index])
+        else:
+            self._count += 1
+        samples[index] = sample
+        self._insert(sample)
+        self._index = (index + 1) % self._window
+
+        if len(self._low) + len(self._high) > 2 * self._window:
+            self._rebuild()
+        return self._median()
+
+    def _rebuild(self):
+        """ Rebuilds the heaps from the samples of the window, getting rid of the deleted ones. """
+        ordered = sorted(self._samples[:self._count])
+        self._high_size = self._count // 2
+        self._low_size = self._count - self._high_size
+        self._low = [-sample for sample in ordered[:self._low_size]]
+        heapq.heapify(self._low)
+        self._high = ordered[self._low_size:]
+        self._delayed = {}
+
+    def _median(self):
+        if self._low_size > self._high_size:
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2
+
+    def _insert(self, sample):
+        if not self._low or sample <= -self._low[0]:
+            heapq.heappush(self._low, -sample)
+            self._low_size += 1
+        else:
+            heapq.heappush(self._high, sample)
+            self._high_size += 1
+        self._balance()
+
+    def _remove(self, sample):
+        self._delayed[sample] = self._delayed.get(sample, 0) + 1
+        if sample <= -self._low[0]:
+            self._low_size -= 1
+            if sample == -self._low[0]:
+                self._prune(self._low, -1)
+        else:
+            self._high_size -= 1
+            if self._high and sample == self._high[0]:
+                self._prune(self._high, 1)
+        self._balance()
+
+    def _prune(self, heap, sign):
+        """ Discards the samples waiting for deletion from the top of a heap. """
+        delayed = self._delayed
+        while heap:
+            top = heap[0] * sign
+            count = delayed.get(top)
+            if not count:
+                break
+            if count == 1:
+                del delayed[top]
+            else:
+                delayed[top] = count - 1
+            heapq.heappop(heap)
+
+    def _balance(self):
+        """ Restores the heaps balance, the lower half being allowed one more sample. """
+        if self._low_size > self._high_size + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, -1)
+        elif self._low_size < self._high_size:
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._low_size += 1
+            self._high_size -= 1
+            self._prune(self._high, 1)
+
+
+class Oversampler(object):
+    """ Averages blocks of N samples, and outputs one value per block (decimation).
+
+    Averaging 4^n samples affected by noise gains n bits of resolution.
+    """
+    def __init__(self, factor):
+        """
+        :param int factor: the number of samples per output value
+        """
+        if factor <= 0:
+            raise ValueError('invalid factor (%s)' % factor)
+        self._factor = factor
+        self._value = None
+        self.reset()
+
+    @property
+    def value(self):
+        return self._value
+
+    def reset(self):
+        self._sum = 0
+        self._count = 0
+
+    def update(self, sample):
+        self._sum += sample
+        self._count += 1
+        if self._count < self._factor:
+            return None
+        self._value = self._sum / float(self._factor)
+        self.reset()
+        return self._value
+
+
+class FilterChain(object):
+    """ A sequence of filters, each one processing the output of the previous one. """
+    def __init__(self, filters):
+        """
+        :param filters: the filters, in processing order
+        """
+        if not filters:
+            raise ValueError('empty filter chain')
+        self._filters = tuple(filters)
+
+    @property
+    def value(self):
+        return self._filters[-1].value
+
+    def reset(self):
+        for f in self._filters:
+            f.reset()
+
+    def update(self, sample):
+        for f in self._filters:
+            sample = f.update(sample)
+            if sample is None:
+                return None
+        return sample
+
+
+_filter_types = {
+    'ema': (ExponentialMovingAverage, 'alpha'),
+    'average': (MovingAverage, 'window'),
+    'median': (RunningMedian, 'window'),
+    'oversampling': (Oversampler, 'factor'),
+}
+
+
+def create_filter(specs):
+    """ Creates a filter from its specifications.
+
+    Specifications are a dictionary containing the filter type and its parameter :
+
+        - ``{'type': 'ema', 'alpha': 0.2}``
+        - ``{'type': 'average', 'window': 8}``
+        - ``{'type': 'median', 'window': 5}``
+        - ``{'type': 'oversampling', 'factor': 4}``
+
+    or a list of such dictionaries, for creating a :py:class:`FilterChain`.
+
+    :param specs: the filter specifications
+    :raise: ValueError if the specifications are not valid
+    """
+    if isinstance(specs, (list, tuple)):
+        return FilterChain([create_filter(s) for s in specs])
+
+    try:
+        cls, parm = _filter_types[specs['type']]
+    except (KeyError, TypeError):
+        raise ValueError('invalid filter specifications : %s' % (specs,))
+    try:
+        return cls(specs[parm])
+    except KeyError:
+        raise ValueError('missing %s parameter for %s filter' % (parm, specs['type']))
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides the recording of ADC samples in a memory-mapped ring file.
+
+Samples are stored as fixed size records (timestamp, channel, raw value and optionally the voltage)
+in a file of configurable capacity, the oldest records being overwritten when it is full. Since the
+file is memory-mapped, recording a sample costs a memory write only, and the recorded samples
+survive a crash of the recording process.
+
+The file starts with a header, containing the ring geometry, the total count of records written
+so far and the channel names. Records are written before the count is updated, so that readers
+never see a partially written record, and other processes can thus read the file while it is
+being recorded, with zero-copy NumPy views.
+
+Records must be appended in chronological order, which allows locating time ranges by binary
+searches, without parsing the whole file. Samples older than the last recorded one are thus
+rejected, and the blocks of several channels covering the same time span must be recorded
+together with :py:meth:`Recorder.record_blocks`, which merges them.
+
+This module requires NumPy.
+
+>>> recorder = Recorder('/var/log/adc.ring', capacity=1000000)
+>>> # ADCPiController.update_inputs(recorder.notify) records the inputs changes
+>>> recorder.record('ldr', raw, volts)
+>>> blocks = board.read_block(100, (1, 2))
+>>> recorder.record_blocks({'ldr': blocks[1], 'ntc': blocks[2]})
+>>> ...
+>>> recording = Recording('/var/log/adc.ring')
+>>> records = recording.time_slice(start, end, channel='ldr')
+>>> records['timestamp'], records['raw'], records['volts']
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['Recorder', 'Recording']
+
+import json
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = 'ADCRING1'
+VERSION = 1
+HEADER_SIZE = 4096
+
+FLAG_VOLTS = 0x01
+
+if np is not None:
+    _header_dtype = np.dtype([
+        ('magic', 'S8'),
+        ('version', '<u4'),
+        ('flags', '<u4'),
+        ('capacity', '<u8'),
+        ('record_size', '<u4'),
+        ('meta_size', '<u4'),
+        ('count', '<u8'),
+    ])
+    _META_OFFSET = _header_dtype.itemsize
+else:
+    _header_dtype = None
+    _META_OFFSET = 0
+
+
+def _record_dtype(with_volts):
+    fields = [('timestamp', '<f8'), ('channel', '<u2'), ('raw', '<i4')]
+    if with_volts:
+        fields.append(('volts', '<f4'))
+    return np.dtype(fields)
+
+
+class _RingFile(object):
+    """ The ring file mapping, shared by the writer and the reader. """
+    def __init__(self, path, mode):
+        self._path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode=mode)
+        self._header = self._map[:_header_dtype.itemsize].view(_header_dtype)[0:1]
+
+        header = self._header[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError('not a recording file (%s)' % path)
+
+        self.flags = int(header['flags'])
+        self.capacity = int(header['capacity'])
+        self.record_dtype = _record_dtype(self.flags & FLAG_VOLTS)
+        if int(header['record_size']) != self.record_dtype.itemsize:
+            raise ValueError('invalid record size in file %s' % path)
+        if len(self._map) != HEADER_SIZE + self.capacity * self.record_dtype.itemsize:
+            raise ValueError('truncated recording file (%s)' % path)
+
+        self.records = self._map[HEADER_SIZE:].view(self.record_dtype)
+
+    @staticmethod
+    def create(path, capacity, with_volts):
+        record_dtype = _record_dtype(with_volts)
+        with open(path, 'wb') as fp:
+            fp.truncate(HEADER_SIZE + capacity * record_dtype.itemsize)
+        header = np.memmap(path, dtype=_header_dtype, mode='r+', shape=(1,))
+        header[0] = (MAGIC, VERSION, FLAG_VOLTS if with_volts else 0, capacity, record_dtype.itemsize, 0, 0)
+        header.flush()
+        del header
+
+    @property
+    def count(self):
+        """ The total number of records written since the file creation. """
+        return int(self._header['count'][0])
+
+    @count.setter
+    def count(self, count):
+        self._header['count'] = count
+
+    def read_channels(self):
+        size = int(self._header['meta_size'][0])
+        if not size:
+            return []
+        return json.loads(self._map[_META_OFFSET:_META_OFFSET + size].tostring())
+
+    def write_channels(self, channels):
+        meta = json.dumps(channels)
+        if _META_OFFSET + len(meta) > HEADER_SIZE:
+            raise ValueError('too many channels')
+        self._map[_META_OFFSET:_META_OFFSET + len(meta)] = np.frombuffer(meta, dtype=np.uint8)
+        self._header['meta_size'] = len(meta)
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map = self._header = self.records = None
+
+
+class Recorder(object):
+    """ The ring file writer.
+
+    Channels are identified by their names (such as the input names of the
+    :py:class:`pybot.abelec.adcpi.control.ADCPiController`), which are stored in the file header
+    and recorded as their index in it.
+
+    Only one recorder can write a given file at a time.
+    """
+    DEFAULT_CAPACITY = 100000
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, with_volts=True, reset=False):
+        """ If the file already exists with the same geometry, the recording continues after the
+        records it contains.
+
+        :param str path: the file path
+        :param int capacity: the maximum number of records kept in the file
+        :param bool with_volts: True if the voltages are recorded with the raw values
+        :param bool reset: True for discarding the existing file content, if any
+        :raise: ValueError if the existing file does not match the requested geometry
+        """
+        if np is None:
+            raise ValueError('cannot continue since NumPy is not available')
+        if capacity <= 0:
+            raise ValueError('invalid capacity (%s)' % capacity)
+
+        if reset or not os.path.exists(path):
+            _RingFile.create(path, capacity, with_volts)
+        self._file = _RingFile(path, 'r+')
+        if self._file.capacity != capacity or bool(self._file.flags & FLAG_VOLTS) != bool(with_volts):
+            raise ValueError('existing file %s does not match the requested geometry' % path)
+
+        self._with_volts = with_volts
+        self._capacity = capacity
+        self._records = self._file.records
+        self._count = self._file.count
+        self._channels = self._file.read_channels()
+        self._channel_ids = dict((name, i) for i, name in enumerate(self._channels))
+        if self._count:
+            self._last_timestamp = float(self._records['timestamp'][(self._count - 1) % capacity])
+        else:
+            self._last_timestamp = None
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def count(self):
+        """ The total number of records written since the file creation. """
+        return self._count
+
+    def _channel_id(self, channel):
+        try:
+            return self._channel_ids[channel]
+        except KeyError:
+            self._file.write_channels(self._channels + [channel])
+            self._channels.append(channel)
+            channel_id = self._channel_ids[channel] = len(self._channels) - 1
+            return channel_id
+
+    def _check_timestamp(self, timestamp):
+        if self._last_timestamp is not None and timestamp < self._last_timestamp:
+            raise ValueError('sample older than the last recorded one (%f < %f)' % (timestamp, self._last_timestamp))
+
+    def record(self, channel, raw, volts=None, timestamp=None):
+        """ Records a sample.
+
+        :param str channel: the channel name
+        :param int raw: the raw value
+        :param float volts: the voltage (ignored if the file does not record them)
+        :param float timestamp: the sample time (defaults to the current time)
+        :raise: ValueError if the sample is older than the last recorded one
+        """
+        if timestamp is None:
+            # never go back in time, even if the system clock does
+            timestamp = time.time()
+            if self._last_timestamp is not None and timestamp < self._last_timestamp:
+                timestamp = self._last_timestamp
+        else:
+            self._check_timestamp(timestamp)
+        index = self._count % self._capacity
+        record = self._records[index:index + 1]
+        record['timestamp'] = timestamp
+        record['channel'] = self._channel_id(channel)
+        record['raw'] = raw
+        if self._with_volts:
+            record['volts'] = volts if volts is not None else np.nan
+
+        self._count += 1
+        self._file.count = self._count
+        self._last_timestamp = timestamp
+
+    def notify(self, name, raw, volts):
+        """ Records a sample, with a signature compatible with the notification callback of
+        :py:meth:`pybot.abelec.adcpi.control.ADCPiController.update_inputs`.
+        """
+        self.record(name, raw, volts)
+
+    def record_block(self, channel, block):
+        """ Records a block of samples, such as returned by :py:meth:`AnalogInput.read_block`.
+
+        :param str channel: the channel name
+        :param SampleBlock block: the samples
+        :raise: ValueError if the block starts before the last recorded sample
+        """
+        count = len(block.raw)
+        if not count:
+            return
+        self._check_timestamp(block.timestamps[0])
+        self._write(self._channel_id(channel), block.timestamps, block.raw, block.volts)
+
+    def record_blocks(self, blocks):
+        """ Records the blocks of several channels acquired together, such as the ones returned by
+        :py:meth:`ADCPiBoard.read_block`.
+
+        The samples of all the blocks are merged in chronological order before being written.
+
+        :param dict blocks: the blocks (SampleBlock instances), keyed by channel name
+        :raise: ValueError if a sample is older than the last recorded one
+        """
+        blocks = [(self._channel_id(channel), block) for channel, block in blocks.iteritems() if len(block.raw)]
+        if not blocks:
+            return
+        timestamps = np.concatenate([np.asarray(block.timestamps, dtype=np.float64) for _, block in blocks])
+        order = np.argsort(timestamps, kind='mergesort')
+        timestamps = timestamps[order]
+        self._check_timestamp(timestamps[0])
+        channels = np.concatenate([np.full(len(block.raw), channel_id, dtype=np.uint16) for channel_id, block in blocks])
+        raw = np.concatenate([np.asarray(block.raw) for _, block in blocks])
+        volts = np.concatenate([np.asarray(block.volts) for _, block in blocks]) if self._with_volts else None
+        self._write(channels[order], timestamps, raw[order], volts[order] if volts is not None else None)
+
+    def _write(self, channels, timestamps, raw, volts):
+        """ Writes records, the fields being provided as arrays (or as a scalar for the channel). """
+        count = len(raw)
+        if count > self._capacity:
+            # only the most recent samples would survive
+            skip = count - self._capacity
+            self._count += skip
+            count = self._capacity
+        else:
+            skip = 0
+
+        start = self._count % self._capacity
+        done = 0
+        while done < count:
+            # fill the ring up to its end, and then restart from its beginning
+            chunk = min(count - done, self._capacity - start)
+            records = self._records[start:start + chunk]
+            src = slice(skip + done, skip + done + chunk)
+            records['timestamp'] = timestamps[src]
+            records['channel'] = channels if np.isscalar(channels) else channels[src]
+            records['raw'] = raw[src]
+            if self._with_volts:
+                records['volts'] = volts[src]
+            done += chunk
+            start = 0
+
+        self._count += count
+        self._file.count = self._count
+        self._last_timestamp = float(timestamps[-1])
+
+    def flush(self):
+        """ Forces the recorded data to be written on disk. """
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+        self._file = self._records = None
+
+
+class Recording(object):
+    """ The ring file reader.
+
+    It can be used while the file is being recorded by another process. The returned records are
+    NumPy structured arrays, with fields ``timestamp``, ``channel`` (the channel index, see
+    :py:attr:`channels`), ``raw`` and ``volts`` (if recorded). They are views on the file content
+    when possible (i.e. when they don't span the end of the ring), and copies otherwise.
+
+    Since the writer can overwrite the oldest records while they are read, records which must be
+    kept should be copied.
+    """
+    def __init__(self, path):
+        """
+        :param str path: the file path
+        """
+        if np is None:
+            raise ValueError('cannot continue since NumPy is not available')
+        self._file = _RingFile(path, 'r')
+        self._records = self._file.records
+        self._capacity = self._file.capacity
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def count(self):
+        """ The total number of records written since the file creation. """
+        return self._file.count
+
+    @property
+    def channels(self):
+        """ The channel names, indexed by the channel field of the records. """
+        return self._file.read_channels()
+
+    def has_volts(self):
+        return bool(self._file.flags & FLAG_VOLTS)
+
+    def __len__(self):
+        return min(self.count, self._capacity)
+
+    def _ranges(self, position, count):
+        """ Returns the ring index ranges of the records from a given position up to the end,
+        in chronological order.
+
+        The record at position ``p`` in the sequence of the written records is stored at index
+        ``p % capacity`` in the ring.
+        """
+        first = max(position, count - self._capacity, 0)
+        if first >= count:
+            return []
+        start = first % self._capacity
+        stop = start + count - first
+        if stop <= self._capacity:
+            return [(start, stop)]
+        return [(start, self._capacity), (0, stop - self._capacity)]
+
+    def _join(self, ranges):
+        parts = [self._records[start:stop] for start, stop in ranges]
+        if not parts:
+            return self._records[0:0]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def read_since(self, position):
+        """ Returns the records written since a given position, for tailing the file.
+
+        :param int position: the position returned by the previous call (0 for the first one)
+        :return: a tuple containing the records, and the position for the next call. Records
+        overwritten since the previous call are lost.
+        :rtype: tuple
+        """
+        count = self.count
+        return self._join(self._ranges(position, count)), count
+
+    def tail(self, count):
+        """ Returns the most recent records.
+
+        :param int count: the number of records
+        """
+        records, _ = self.read_since(self.count - count)
+        return records
+
+    def time_range(self):
+        """ Returns the timestamps of the oldest and the most recent records.
+
+        :return: a tuple (first, last), None if the file is empty
+        """
+        ranges = self._ranges(0, self.count)
+        if not ranges:
+            return None
+        timestamps = self._records['timestamp']
+        return float(timestamps[ranges[0][0]]), float(timestamps[ranges[-1][1] - 1])
+
+    def time_slice(self, start_time=None, end_time=None, channel=None):
+        """ Returns the records of a time range.
+
+        The range is located by binary searches on the timestamps.
+
+        :param float start_time: the range start (included), None for the oldest record
+        :param float end_time: the range end (excluded), None for the most recent record
+        :param channel: the name of the channel to select, None for all of them
+        """
+        parts = []
+        for start, stop in self._ranges(0, self.count):
+            timestamps = self._records['timestamp'][start:stop]
+            first = np.searchsorted(timestamps, start_time, 'left') if start_time is not None else 0
+            last = np.searchsorted(timestamps, end_time, 'left') if end_time is not None else len(timestamps)
+            if last > first:
+                parts.append((start + first, start + last))
+        records = self._join(parts)
+
+        if channel is not None:
+            try:
+                channel_id = self.channels.index(channel)
+            except ValueError:
+                return records[0:0]
+            records = records[records['channel'] == channel_id]
+        return records
+
+    def close(self):
+        self._file.close()
+        self._file = self._records = None
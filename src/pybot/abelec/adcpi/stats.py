@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides the aggregation of the ADC readings in time windows, for reducing
+the data forwarded to a telemetry backend.
+
+Aggregators compute the count, minimum, maximum, mean and standard deviation of the samples of
+each window, and output a compact summary when the window is complete. Statistics are updated
+incrementally, the mean and the variance being computed with Welford's algorithm, so that
+the samples do not need to be kept (except for sliding windows, which must forget them when
+they leave the window).
+
+Two kinds of windows are available :
+
+    - tumbling windows (:py:class:`TumblingAggregator`), which are contiguous and do not overlap
+    - sliding windows (:py:class:`SlidingAggregator`), which summarize the last samples at regular
+      intervals, shorter than the window duration
+
+>>> aggregator = TumblingAggregator(1.)
+>>> for value in readings:
+>>>     summary = aggregator.update(value)
+>>>     if summary:
+>>>         telemetry.send(summary)
+
+Aggregators are configured in the :py:class:`pybot.abelec.adcpi.control.ADCPiController` input
+specifications, as a dictionary containing the window type and its parameters
+(see :py:func:`create_aggregator`).
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['WindowSummary', 'TumblingAggregator', 'SlidingAggregator', 'create_aggregator']
+
+from collections import deque, namedtuple
+import math
+import time
+
+
+class WindowSummary(namedtuple('WindowSummary', 'start end count min max mean std')):
+    """ The statistics of the samples of a window.
+
+    ``start`` and ``end`` are the window limits (s), and ``std`` is the population standard deviation.
+    """
+    __slots__ = ()
+
+
+class _Welford(object):
+    """ Running count, mean and sum of squared deviations. """
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x):
+        self.count -= 1
+        if not self.count:
+            self.reset()
+            return
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (x - self.mean), 0.)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else None
+
+
+class TumblingAggregator(object):
+    """ Statistics of consecutive windows of a given duration.
+
+    Windows are aligned on multiples of their duration. A window is complete when a sample
+    beyond its end is received, so that a window without samples produces no summary.
+    """
+    def __init__(self, duration):
+        """
+        :param float duration: the windows duration (s)
+        """
+        if duration <= 0:
+            raise ValueError('invalid duration (%s)' % duration)
+        self._duration = duration
+        self._stats = _Welford()
+        self.reset()
+
+    @property
+    def duration(self):
+        return self._duration
+
+    def reset(self):
+        self._stats.reset()
+        self._min = self._max = None
+        self._start = None
+
+    def update(self, value, timestamp=None):
+        """ Processes a sample.
+
+        :param float value: the sample value
+        :param float timestamp: the sample time (defaults to the current time)
+        :return: the summary of the previous window if the sample completed it, None otherwise
+        :rtype: WindowSummary
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        summary = None
+        if self._start is None or timestamp >= self._start + self._duration:
+            summary = self.flush()
+            self._start = timestamp - timestamp % self._duration
+
+        self._stats.add(value)
+        if self._min is None:
+            self._min = self._max = value
+        elif value < self._min:
+            self._min = value
+        elif value > self._max:
+            self._max = value
+        return summary
+
+    def flush(self):
+        """ Returns the summary of the current window, and starts a new one.
+
+        :return: the summary, None if the window contains no sample
+        :rtype: WindowSummary
+        """
+        stats = self._stats
+        if not stats.count:
+            return None
+        summary = WindowSummary(
+            self._start, self._start + self._duration, stats.count, self._min, self._max, stats.mean, stats.std
+        )
+        self.reset()
+        return summary
+
+
+class SlidingAggregator(object):
+    """ Statistics of the samples of the last N seconds, output at a regular interval.
+
+    The samples of the window are kept, for being removed from the statistics when they leave it.
+    The minimum and the maximum are tracked with monotonic queues, and the Welford statistics
+    are recomputed from the samples each time the window has been completely renewed, to avoid
+    the accumulation of rounding errors. The cost per sample is thus constant (amortized).
+    """
+    def __init__(self, duration, step):
+        """
+        :param float duration: the window duration (s)
+        :param float step: the interval between the summaries (s)
+        """
+        if duration <= 0:
+            raise ValueError('invalid duration (%s)' % duration)
+        if not 0 < step <= duration:
+            raise ValueError('invalid step (%s)' % step)
+        self._duration = duration
+        self._step = step
+        self._stats = _Welford()
+        self.reset()
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @property
+    def step(self):
+        return self._step
+
+    def reset(self):
+        self._stats.reset()
+        self._samples = deque()     # (timestamp, value)
+        self._mins = deque()        # increasing values
+        self._maxs = deque()        # decreasing values
+        self._removed = 0
+        self._next_output = None
+
+    def update(self, value, timestamp=None):
+        """ Processes a sample.
+
+        :param float value: the sample value
+        :param float timestamp: the sample time (defaults to the current time)
+        :return: the summary of the window ending at the sample time if a step is over, None otherwise
+        :rtype: WindowSummary
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if self._next_output is None:
+            self._next_output = timestamp + self._step
+
+        self._expire(timestamp - self._duration)
+
+        self._samples.append((timestamp, value))
+        self._stats.add(value)
+        mins, maxs = self._mins, self._maxs
+        while mins and mins[-1][1] > value:
+            mins.pop()
+        mins.append((timestamp, value))
+        while maxs and maxs[-1][1] < value:
+            maxs.pop()
+        maxs.append((timestamp, value))
+
+        if timestamp < self._next_output:
+            return None
+        while self._next_output <= timestamp:
+            self._next_output += self._step
+        return self.summary(timestamp)
+
+    def _expire(self, limit):
+        """ Removes the samples older than a given time. """
+        samples, stats = self._samples, self._stats
+        while samples and samples[0][0] <= limit:
+            _, value = samples.popleft()
+            stats.remove(value)
+            self._removed += 1
+        for queue in (self._mins, self._maxs):
+            while queue and queue[0][0] <= limit:
+                queue.popleft()
+
+        if self._removed >= len(samples) and self._removed:
+            stats.reset()
+            for _, value in samples:
+                stats.add(value)
+            self._removed = 0
+
+    def summary(self, timestamp=None):
+        """ Returns the summary of the window ending at a given time.
+
+        :param float timestamp: the window end (defaults to the last sample time)
+        :return: the summary, None if the window contains no sample
+        :rtype: WindowSummary
+        """
+        if not self._samples:
+            return None
+        if timestamp is None:
+            timestamp = self._samples[-1][0]
+        stats = self._stats
+        return WindowSummary(
+            timestamp - self._duration, timestamp, stats.count,
+            self._mins[0][1], self._maxs[0][1], stats.mean, stats.std
+        )
+
+
+def create_aggregator(specs):
+    """ Creates an aggregator from its specifications.
+
+    Specifications are a dictionary containing the window type and its parameters, durations
+    being expressed in milliseconds :
+
+        - ``{'type': 'tumbling', 'window': 1000}``
+        - ``{'type': 'sliding', 'window': 10000, 'step': 1000}``
+
+    :param dict specs: the aggregator specifications
+    :raise: ValueError if the specifications are not valid
+    """
+    try:
+        window_type, window = specs['type'], specs['window'] / 1000.
+    except (KeyError, TypeError):
+        raise ValueError('invalid aggregator specifications : %s' % (specs,))
+    if window_type == 'tumbling':
+        return TumblingAggregator(window)
+    if window_type == 'sliding':
+        try:
+            return SlidingAggregator(window, specs['step'] / 1000.)
+        except KeyError:
+            raise ValueError('missing step parameter for sliding aggregator')
+    raise ValueError('invalid aggregator type : %s' % window_type)
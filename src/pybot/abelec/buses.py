@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides the support shared by the boards controllers for handling several I2C buses.
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['BusWorker', 'collect_all']
+
+import sys
+import threading
+
+if sys.version_info[0] < 3:
+    exec('def _reraise(exc_info):\n    raise exc_info[0], exc_info[1], exc_info[2]\n')
+else:
+    def _reraise(exc_info):
+        raise exc_info[1].with_traceback(exc_info[2])
+
+
+class BusWorker(threading.Thread):
+    """ A worker thread running the reads of the boards connected to a given bus.
+
+    When a controller manages boards connected to several buses, an instance is started for each
+    of them, so that buses are read in parallel, the global reading time being the one of the
+    slowest bus instead of the sum of all of them.
+
+    >>> workers = [BusWorker(bus_id) for bus_id in (1, 3)]
+    >>> for worker in workers:
+    >>>     worker.start()
+    >>> for worker, boards in zip(workers, buses_boards):
+    >>>     worker.trigger(read_boards, boards)
+    >>> results = collect_all(workers)
+    """
+    def __init__(self, bus_id, name_prefix='bus'):
+        """
+        :param bus_id: the identifier of the bus
+        :param str name_prefix: the prefix of the thread name, completed by the bus identifier
+        """
+        super(BusWorker, self).__init__(name='%s-%s' % (name_prefix, bus_id))
+        self.daemon = True
+        self.bus_id = bus_id
+        self._requested = threading.Event()
+        self._done = threading.Event()
+        self._terminated = False
+        self._job = None
+        self._result = None
+        self._exc_info = None
+
+    def trigger(self, read, *args):
+        """ Requests the worker to run a read.
+
+        :param read: the read function
+        :param args: its arguments
+        """
+        self._job = (read, args)
+        self._done.clear()
+        self._requested.set()
+
+    def collect(self):
+        """ Waits for the end of the read triggered by :py:meth:`trigger` and returns its result.
+
+        Each triggered read must be collected before triggering the next one, otherwise the end
+        of the previous read would be taken for the one of the new read. Use :py:func:`collect_all`
+        when several workers are involved.
+
+        :raise: the error which occurred during the read, if any, with the worker traceback
+        """
+        self._done.wait()
+        if self._exc_info:
+            _reraise(self._exc_info)
+        return self._result
+
+    def terminate(self):
+        """ Stops the worker. """
+        self._terminated = True
+        self._requested.set()
+
+    def run(self):
+        while True:
+            self._requested.wait()
+            self._requested.clear()
+            if self._terminated:
+                break
+
+            read, args = self._job
+            try:
+                self._result, self._exc_info = read(*args), None
+            except Exception:
+                self._result, self._exc_info = None, sys.exc_info()
+            self._done.set()
+
+
+def collect_all(workers):
+    """ Collects the results of the reads triggered on a set of workers.
+
+    All the reads are collected, even if some of them failed, so that no worker is left with a
+    pending read which would be taken for the result of the next one.
+
+    :param workers: the workers (BusWorker instances)
+    :return: the results of the reads, in the order of the workers
+    :rtype: list
+    :raise: the error of the first failed read, if any
+    """
+    results, exc_info = [], None
+    for worker in workers:
+        try:
+            results.append(worker.collect())
+        except Exception:
+            exc_info = exc_info or sys.exc_info()
+    if exc_info:
+        _reraise(exc_info)
+    return results
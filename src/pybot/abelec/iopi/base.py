@@ -61,6 +61,8 @@ __email__ = 'eric@pobot.org'
 
 __all__ = ['IOPiBoard', 'Expander', 'Port', 'DigitalInput', 'DigitalOutput']
 
+import threading
+
 
 class IOPiBoard(object):
     """ This class represents a whole IOPi expansion board.
@@ -99,50 +101,78 @@ class IOPiBoard(object):
         )
         self._ios = {}
 
-    def _get_io(self, expander_num, board_io_num, direction, pullup_enabled=False, default_state=0):
+    def _get_io(self, expander_num, board_io_num, direction, pullup_enabled=False, inverted=False, default_state=0,
+                configure=True):
         if expander_num not in (self.EXPANDER_1, self.EXPANDER_2):
             raise ValueError("invalid expander num (%d)" % expander_num)
         if not 1 <= board_io_num <= 16:
             raise ValueError("invalid IO num (%d)" % board_io_num)
 
         key = (expander_num << 8) + board_io_num
-        try:
-            # try first to get the object from the cache
-            io = self._ios[key]
-        except KeyError:
+        io_class = DigitalInput if direction == IO.DIR_INPUT else DigitalOutput
+        io = self._ios.get(key)
+        # try first to get the object from the cache, unless the IO direction has been changed since
+        if not isinstance(io, io_class):
             # not yet created => do it
             port_num, io_num = self._board_io_num_to_port_io(board_io_num)
             port = self.expanders[expander_num].ports[port_num]
 
             # create the instance of the appropriate class, depending on the IO type
             if direction == IO.DIR_INPUT:
-                io = DigitalInput(port, io_num, pullup_enabled=pullup_enabled)
+                io = DigitalInput(port, io_num, pullup_enabled=pullup_enabled, inverted=inverted, configure=configure)
             else:
-                io = DigitalOutput(port, io_num, default_state=default_state)
+                io = DigitalOutput(port, io_num, default_state=default_state, configure=configure)
             # cache the result
             self._ios[key] = io
         return io
 
-    def get_digital_input(self, expander_num, board_io_num, pullup_enabled=False):
+    def get_digital_input(self, expander_num, board_io_num, pullup_enabled=False, inverted=False, configure=True):
         """ Factory method returning a DigitalInput instance for a given IO, and configures
         it as requested.
         :param int expander_num: IOPiBoard.EXPANDER_1 or IOPiBoard.EXPANDER_2
         :param int board_io_num: the pin number of the IO on the expander header
         :param pullup_enabled: should the internal pull-up be enabled or not
+        :param bool inverted: should the input polarity be inverted or not
+        :param bool configure: if False, the port registers are supposed to be already
+        configured (see :py:meth:`Port.apply_settings`) and are left untouched
         :return: the IO object
         :rtype: DigitalInput
         """
-        return self._get_io(expander_num, board_io_num, direction=IO.DIR_INPUT, pullup_enabled=pullup_enabled)
+        return self._get_io(
+            expander_num, board_io_num, direction=IO.DIR_INPUT,
+            pullup_enabled=pullup_enabled, inverted=inverted, configure=configure
+        )
 
-    def get_digital_output(self, expander_num, board_io_num, default_state=0):
+    def get_digital_output(self, expander_num, board_io_num, default_state=0, configure=True):
         """ Factory method returning a DigitalOutput instance for a given IO.
         :param int expander_num: IOPiBoard.EXPANDER_1 or IOPiBoard.EXPANDER_2
         :param int board_io_num: the pin number of the IO on the expander header
         :param int default_state: the output default state
+        :param bool configure: if False, the port registers are supposed to be already
+        configured (see :py:meth:`Port.apply_settings`) and are left untouched
         :return: the IO object
         :rtype: DigitalOutput
         """
-        return self._get_io(expander_num, board_io_num, direction=IO.DIR_OUTPUT, default_state=default_state)
+        return self._get_io(
+            expander_num, board_io_num, direction=IO.DIR_OUTPUT,
+            default_state=default_state, configure=configure
+        )
+
+    def get_port(self, expander_num, board_io_num):
+        """ Returns the port and the IO num inside it of a given board IO.
+
+        :param int expander_num: IOPiBoard.EXPANDER_1 or IOPiBoard.EXPANDER_2
+        :param int board_io_num: the pin number of the IO on the expander header
+        :return: a tuple containing the port and the IO num ([0-7])
+        :rtype: tuple
+        """
+        if expander_num not in (self.EXPANDER_1, self.EXPANDER_2):
+            raise ValueError("invalid expander num (%d)" % expander_num)
+        if not 1 <= board_io_num <= 16:
+            raise ValueError("invalid IO num (%d)" % board_io_num)
+
+        port_num, io_num = self._board_io_num_to_port_io(board_io_num)
+        return self.expanders[expander_num].ports[port_num], io_num
 
     def read(self):
         """ Reads all ports of all expanders and returns their values as a single 32 bits integer.
@@ -221,6 +251,20 @@ class Expander(object):
         """
         return self._bus.read_byte_data(self._addr, addr) & 0xff
 
+    def read_registers(self, addr, count):
+        """ Reads a block of consecutive chip registers in a single transaction.
+
+        This relies on the chip sequential operation mode, which is active by default (IOCON.SEQOP
+        cleared). With the default register addressing scheme, reading 2 registers starting at
+        a port A register returns the content of this register for both ports.
+
+        :param int addr: first register address
+        :param int count: number of registers to read
+        :return: registers content
+        :rtype: list
+        """
+        return [b & 0xff for b in self._bus.read_i2c_block_data(self._addr, addr, count)]
+
     def write_register(self, reg, data):
         """ Writes a chip register.
 
@@ -239,10 +283,13 @@ class Expander(object):
     def read(self):
         """ Reads both expander ports and return their values as a 16 bits integer.
 
+        Both ports are read in a single block transaction.
+
         :return: 2 bytes integer with PORTB and PORTA values as respectively MSB and LSB
         :rtype: int
         """
-        return ((self.ports[Expander.PORT_B].read() << 8) | self.ports[Expander.PORT_A].read()) & 0xffff
+        port_a, port_b = self._bus.read_i2c_block_data(self._addr, Expander.GPIO, 2)
+        return ((port_b & 0xff) << 8) | (port_a & 0xff)
 
     def reset(self):
         """ Resets both ports
@@ -266,6 +313,7 @@ class Port(object):
     _GPINTEN_cache = None
     _INTCON_cache = None
     _DEFVAL_cache = None
+    _OLAT_cache = None
 
     def __init__(self, expander, port_num):
         """
@@ -276,9 +324,16 @@ class Port(object):
             raise ValueError("invalid port num (%d)" % port_num)
         self._expander = expander
         self._port_num = port_num
+        # serializes the read-modify-write operations on the output latches
+        self._lock = threading.Lock()
         # initializes the registers cache
         self.update_cache()
 
+    @property
+    def port_num(self):
+        """ The port num (Expander.PORT_A or Expander.PORT_B). """
+        return self._port_num
+
     def update_cache(self):
         """ Updates the registers cache. """
         self._IODIR_cache = self._expander.read_register(Expander.IODIR + self._port_num)
@@ -288,6 +343,7 @@ class Port(object):
         self._GPINTEN_cache = self._expander.read_register(Expander.GPINTEN + self._port_num)
         self._DEFVAL_cache = self._expander.read_register(Expander.DEFVAL + self._port_num)
         self._INTCON_cache = self._expander.read_register(Expander.INTCON + self._port_num)
+        self._OLAT_cache = self._expander.read_register(Expander.OLAT + self._port_num)
 
     @staticmethod
     def _change_bit(bit_num, value, byte):
@@ -329,7 +385,7 @@ class Port(object):
         :raise: ValueError if out of range io_num
         """
         self._check_io_num(io_num)
-        self.io_directions = self._change_bit(io_num, direction == IO.DIR_INPUT, self._GPPU_cache)
+        self.io_directions = self._change_bit(io_num, direction == IO.DIR_INPUT, self._IODIR_cache)
 
     @property
     def pullups_enabled(self):
@@ -367,7 +423,7 @@ class Port(object):
         :raise: ValueError if out of range io_num
         """
         self._check_io_num(io_num)
-        self.interrupts_enabled = self._change_bit(io_num, inverted, self._IPOL_cache)
+        self.inputs_inverted = self._change_bit(io_num, inverted, self._IPOL_cache)
 
     @property
     def interrupts_enabled(self):
@@ -434,13 +490,74 @@ class Port(object):
     def configuration(self, value):
         self._IOCON_cache = self._expander.write_register(self._IOCON_cache + self._port_num, value)
 
+    @property
+    def latches(self):
+        """ Returns the current content of the port output latches. """
+        return self._OLAT_cache
+
+    @latches.setter
+    def latches(self, value):
+        """ Sets the port output latches.
+
+        Contrary to :py:meth:`write`, this can be used to prepare the state of IOs which
+        are not yet configured as outputs.
+        """
+        self._OLAT_cache = self._expander.write_register(Expander.OLAT + self._port_num, value)
+
+    def apply_settings(self, io_directions=None, pullups_enabled=None, inputs_inverted=None, latches=None):
+        """ Changes several port settings at once, writing only the registers which content
+        is modified.
+
+        Registers are written in an order avoiding glitches on outputs: the latches are set
+        before IOs are turned into outputs, and pull-ups are enabled before IOs are turned into
+        inputs.
+
+        Omitted settings are left unchanged.
+
+        :param int io_directions: the IO directions byte
+        :param int pullups_enabled: the pullups settings byte
+        :param int inputs_inverted: the inputs polarity inversion byte
+        :param int latches: the output latches byte
+        :return: the number of written registers
+        :rtype: int
+        """
+        writes = 0
+        if latches is not None and latches & 0xff != self._OLAT_cache:
+            self.latches = latches
+            writes += 1
+        if pullups_enabled is not None and pullups_enabled & 0xff != self._GPPU_cache:
+            self.pullups_enabled = pullups_enabled
+            writes += 1
+        if inputs_inverted is not None and inputs_inverted & 0xff != self._IPOL_cache:
+            self.inputs_inverted = inputs_inverted
+            writes += 1
+        if io_directions is not None and io_directions & 0xff != self._IODIR_cache:
+            self.io_directions = io_directions
+            writes += 1
+        return writes
+
     def write(self, value):
         """ Write a value to the port
         :param int value: the value to be written
         :return: the clamped value (see :py:meth:`Expander.write_register`)
         :rtype: int
         """
-        return self._expander.write_register(Expander.GPIO + self._port_num, value)
+        self._OLAT_cache = value = self._expander.write_register(Expander.GPIO + self._port_num, value)
+        return value
+
+    def modify_latches(self, set_mask, clear_mask):
+        """ Changes a subset of the port outputs with a single write.
+
+        The new port value is computed from the output latches cache, so that no read is needed.
+        The operation is thread safe.
+
+        :param int set_mask: the mask of the outputs to be set
+        :param int clear_mask: the mask of the outputs to be cleared
+        :return: the written value
+        :rtype: int
+        """
+        with self._lock:
+            return self.write((self._OLAT_cache | set_mask) & ~clear_mask)
 
     def read(self):
         """ Reads the port.
@@ -469,17 +586,19 @@ class IO(object):
     INT_CHANGE = 0
     INT_COMPARE = 1
 
-    def __init__(self, port, num, is_input):
+    def __init__(self, port, num, is_input, configure=True):
         """
         :param Port port: the port the IO is attached to
         :param int num: IO num ([0-7])
         :param bool is_input: is an input or not ?
+        :param bool configure: should the port be configured accordingly ?
         """
         if not 0 <= num < 8:
             raise ValueError('invalid IO num (%d)' % num)
 
         self._port = port
-        port.set_io_direction(num, IO.DIR_INPUT if is_input else IO.DIR_OUTPUT)
+        if configure:
+            port.set_io_direction(num, IO.DIR_INPUT if is_input else IO.DIR_OUTPUT)
         self._mask = 1 << num
 
     @property
@@ -522,25 +641,31 @@ class _ReadableIOMixin(object):
 
 class DigitalInput(IO, _ReadableIOMixin):
     """ A specialized IO modeling an input."""
-    def __init__(self, port, num, pullup_enabled=False):
+    def __init__(self, port, num, pullup_enabled=False, inverted=False, configure=True):
         """
         :param Port port: the port this IO belongs to
         :param int num: the IO number ([0-7])
         :param bool pullup_enabled: should the pullup be enabled ?
+        :param bool inverted: should the input polarity be inverted ?
+        :param bool configure: should the port be configured accordingly ?
         """
-        super(DigitalInput, self).__init__(port, num, is_input=True)
-        self._port.enable_pullup(num, pullup_enabled)
+        super(DigitalInput, self).__init__(port, num, is_input=True, configure=configure)
+        if configure:
+            self._port.enable_pullup(num, pullup_enabled)
+            if inverted:
+                self._port.invert_input(num, True)
 
 
 class DigitalOutput(IO, _ReadableIOMixin):
     """ A specialized IO modeling an output."""
-    def __init__(self, port, num, default_state=0):
+    def __init__(self, port, num, default_state=0, configure=True):
         """
         :param Port port: the port this IO belongs to
         :param int num: the IO number ([0-7])
         :param int default_state: state of the output at initialization
+        :param bool configure: should the port be configured accordingly ?
         """
-        super(DigitalOutput, self).__init__(port, num, is_input=False)
+        super(DigitalOutput, self).__init__(port, num, is_input=False, configure=configure)
         self._default_state = default_state
 
         # create a reset method, which is an alias of set or clear depending
@@ -551,12 +676,18 @@ class DigitalOutput(IO, _ReadableIOMixin):
 
     def set(self):
         """ Turns the output high."""
-        self._port.write(self._port.read() | self._mask)
+        self._port.modify_latches(self._mask, 0)
 
     def clear(self):
         """ Turns the output low."""
-        self._port.write(self._port.read() & (~ self._mask))
+        self._port.modify_latches(0, self._mask)
 
     @property
     def default_state(self):
         return self._default_state
+
+    @default_state.setter
+    def default_state(self, default_state):
+        """ Changes the default state, without modifying the current state of the output. """
+        self._default_state = default_state
+        self.reset = self.set if default_state else self.clear
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides a logic analyzer like capture of the IOPi board IO states, intended for
+commissioning and troubleshooting.
+
+The acquisition runs in a tight loop in a worker thread, at the maximum rate allowed by the bus,
+reading each expander with a single block transaction. States and timestamps are stored in
+preallocated NumPy arrays, which are then analyzed with vectorized operations.
+
+States are stored as 32 bits integers, with the same layout as the result of :py:meth:`IOPiBoard.read`.
+Pins are identified by their rank in this integer (i.e. ``(expander_num * 16) + board_io_num - 1``).
+
+This module requires NumPy.
+
+>>> board = IOPiBoard(i2c_bus)
+>>> analyzer = LogicAnalyzer(board)
+>>> capture = analyzer.capture(duration=2.)
+>>> times, rising = capture.edges(pin=0)
+>>> stats = capture.pulse_statistics(pin=0)
+>>> capture.save('/tmp/capture.npz')
+>>> capture.save_vcd('/tmp/capture.vcd', pins=(0, 1, 2))
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['LogicAnalyzer', 'Capture']
+
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class LogicAnalyzer(object):
+    """ The capture engine.
+
+    Only one capture can be in progress at a time.
+    """
+    DEFAULT_MAX_SAMPLES = 100000
+
+    def __init__(self, board, expanders=None):
+        """
+        :param IOPiBoard board: the board
+        :param tuple expanders: the expanders to be captured (all of them by default). Limiting
+        the capture to one expander doubles the sampling rate.
+        """
+        if np is None:
+            raise ValueError('cannot continue since NumPy is not available')
+
+        if expanders is None:
+            expanders = (board.EXPANDER_1, board.EXPANDER_2)
+        if not expanders or any(num not in (board.EXPANDER_1, board.EXPANDER_2) for num in expanders):
+            raise ValueError('invalid expanders (%s)' % (expanders,))
+        self._expanders = [(board.expanders[num], num * 16) for num in expanders]
+
+        self._thread = None
+        self._stop_requested = False
+        self._capture = None
+
+    def start(self, samples=None, duration=None, max_samples=DEFAULT_MAX_SAMPLES):
+        """ Starts a capture in background.
+
+        The capture ends when the requested number of samples has been acquired, or when
+        the requested duration has elapsed, or when the buffers are full, whichever occurs first.
+
+        :param int samples: the number of samples to be acquired
+        :param float duration: the capture duration (s)
+        :param int max_samples: the buffers size, when the capture is limited by its duration only
+        """
+        if self._thread and self._thread.is_alive():
+            raise ValueError('capture already in progress')
+        if samples is None and duration is None:
+            raise ValueError('samples count or duration must be specified')
+
+        size = samples or max_samples
+        states = np.zeros(size, dtype=np.uint32)
+        timestamps = np.zeros(size, dtype=np.float64)
+
+        self._stop_requested = False
+        self._capture = None
+        self._thread = threading.Thread(
+            target=self._acquire, args=(states, timestamps, duration), name='iopi-capture'
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the capture in progress, keeping the samples acquired so far. """
+        self._stop_requested = True
+
+    def wait(self, timeout=None):
+        """ Waits for the end of the capture in progress.
+
+        If the capture has been interrupted by a read error, the samples acquired so far are
+        returned anyway, the error being available in the ``error`` attribute of the result.
+
+        :param float timeout: the maximum waiting time (s), None for waiting forever
+        :return: the capture result, or None if the capture is not yet complete
+        :rtype: Capture
+        """
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
+            if thread.is_alive():
+                return None
+            self._thread = None
+        return self._capture
+
+    def capture(self, samples=None, duration=None, max_samples=DEFAULT_MAX_SAMPLES):
+        """ Performs a capture and waits for its completion.
+
+        See :py:meth:`start` for parameters.
+
+        :rtype: Capture
+        """
+        self.start(samples, duration, max_samples)
+        return self.wait()
+
+    def _acquire(self, states, timestamps, duration):
+        size = len(states)
+        clock = time.time
+        readers = [(expander.read, shift) for expander, shift in self._expanders]
+        start = clock()
+        deadline = start + duration if duration is not None else None
+
+        count = 0
+        error = None
+        try:
+            if len(readers) == 2:
+                (read_1, shift_1), (read_2, shift_2) = readers
+                while count < size and not self._stop_requested:
+                    now = clock()
+                    if deadline and now >= deadline:
+                        break
+                    states[count] = (read_1() << shift_1) | (read_2() << shift_2)
+                    timestamps[count] = now
+                    count += 1
+            else:
+                (read_1, shift_1), = readers
+                while count < size and not self._stop_requested:
+                    now = clock()
+                    if deadline and now >= deadline:
+                        break
+                    states[count] = read_1() << shift_1
+                    timestamps[count] = now
+                    count += 1
+        except Exception as e:
+            error = e
+        finally:
+            # the samples acquired so far are kept whatever happened
+            timestamps -= start
+            self._capture = Capture(states[:count], timestamps[:count], start, error=error)
+
+
+class Capture(object):
+    """ The result of a capture.
+
+    Timestamps are relative to the capture start time (in seconds).
+
+    ``error`` contains the exception which interrupted the capture (a bus read error for instance),
+    the capture containing then the samples acquired before it, and is None if the capture
+    completed normally.
+    """
+    def __init__(self, states, timestamps, start_time, error=None):
+        """
+        :param states: the IO states array
+        :param timestamps: the samples timestamps array
+        :param float start_time: the capture start time
+        :param Exception error: the error which interrupted the capture, if any
+        """
+        self.states = states
+        self.timestamps = timestamps
+        self.start_time = start_time
+        self.error = error
+
+    def __len__(self):
+        return len(self.states)
+
+    @property
+    def duration(self):
+        return float(self.timestamps[-1]) if len(self.timestamps) else 0.
+
+    @property
+    def sample_rate(self):
+        """ The average sampling rate (Hz). """
+        duration = self.duration
+        return (len(self.states) - 1) / duration if duration else None
+
+    def pin_levels(self, pin):
+        """ Returns the levels of a pin along the capture.
+
+        :param int pin: the pin rank in the states
+        :return: an array of 0/1 values
+        """
+        return ((self.states >> pin) & 1).astype(np.int8)
+
+    def edges(self, pin):
+        """ Returns the edges of a pin signal.
+
+        :param int pin: the pin rank in the states
+        :return: a tuple of arrays, containing the edges timestamps and their direction (True for rising)
+        """
+        changes = np.diff(self.pin_levels(pin))
+        indexes = np.flatnonzero(changes)
+        return self.timestamps[indexes + 1], changes[indexes] > 0
+
+    def pulse_statistics(self, pin):
+        """ Returns statistics about the pulses of a pin signal.
+
+        Only complete pulses are considered. The returned dictionary contains the following items:
+
+            edges
+                (int) number of edges
+            high, low
+                (dict) statistics of the pulses durations (s) in each state, with keys
+                ``count``, ``min``, ``max``, ``mean`` and ``std`` (None if no complete pulse)
+            frequency
+                (float) average signal frequency (Hz), None if not enough edges
+            duty_cycle
+                (float) average ratio of the high state duration, None if not enough edges
+
+        :param int pin: the pin rank in the states
+        :rtype: dict
+        """
+        times, rising = self.edges(pin)
+        widths = np.diff(times)
+        # a pulse starting with a rising edge is a high one
+        high_widths = widths[rising[:-1]]
+        low_widths = widths[~rising[:-1]]
+
+        def stats(values):
+            if not len(values):
+                return None
+            return {
+                'count': len(values),
+                'min': float(values.min()),
+                'max': float(values.max()),
+                'mean': float(values.mean()),
+                'std': float(values.std()),
+            }
+
+        high_stats, low_stats = stats(high_widths), stats(low_widths)
+        if high_stats and low_stats:
+            period = high_stats['mean'] + low_stats['mean']
+            frequency, duty_cycle = 1. / period, high_stats['mean'] / period
+        else:
+            frequency = duty_cycle = None
+
+        return {
+            'edges': len(times),
+            'high': high_stats,
+            'low': low_stats,
+            'frequency': frequency,
+            'duty_cycle': duty_cycle,
+        }
+
+    def save(self, path):
+        """ Saves the capture in NumPy compressed format.
+
+        :param str path: the file path
+        """
+        np.savez_compressed(
+            path, states=self.states, timestamps=self.timestamps, start_time=np.float64(self.start_time)
+        )
+
+    @classmethod
+    def load(cls, path):
+        """ Loads a capture saved by :py:meth:`save`.
+
+        :param str path: the file path
+        :rtype: Capture
+        """
+        data = np.load(path)
+        return cls(data['states'], data['timestamps'], float(data['start_time']))
+
+    def save_vcd(self, path, pins=None, timescale_ns=1000):
+        """ Exports the capture in Value Change Dump format, for use in waveform viewers.
+
+        :param str path: the file path
+        :param tuple pins: the pins to be exported (all of them by default)
+        :param int timescale_ns: the VCD time unit (ns)
+        """
+        if pins is None:
+            pins = range(32)
+        pins = list(pins)
+        identifiers = [chr(33 + i) for i in xrange(len(pins))]
+        mask = reduce(lambda x, y: x | y, (1 << pin for pin in pins), 0)
+
+        masked = self.states & np.uint32(mask)
+        indexes = np.concatenate(([0], np.flatnonzero(np.diff(masked)) + 1)) if len(masked) else []
+        ticks = np.round(self.timestamps * 1e9 / timescale_ns).astype(np.int64)
+
+        with open(path, 'w') as fp:
+            fp.write("$timescale %dns $end\n" % timescale_ns)
+            fp.write("$scope module iopi $end\n")
+            for pin, identifier in zip(pins, identifiers):
+                fp.write("$var wire 1 %s io%d $end\n" % (identifier, pin))
+            fp.write("$upscope $end\n$enddefinitions $end\n")
+
+            previous = None
+            for i in indexes:
+                state = int(masked[i])
+                fp.write("#%d\n" % ticks[i])
+                for pin, identifier in zip(pins, identifiers):
+                    level = (state >> pin) & 1
+                    if previous is None or level != (previous >> pin) & 1:
+                        fp.write("%d%s\n" % (level, identifier))
+                previous = state
@@ -9,9 +9,13 @@ __author__ = 'Eric Pascual'
 __all__ = ['IOPiController']
 
 import time
+import threading
 from collections import namedtuple
 
 from .base import *
+from .scheduler import OutputScheduler
+from .encoder import QuadratureEncoderBank
+from ..buses import BusWorker, collect_all
 
 try:
     from pybot.raspi import i2c_bus
@@ -23,13 +27,25 @@ except ImportError:
 class IOPiController(object):
     """ The board controller.
 
-    Is provides high level operations and interfaces with the board for changing the outputs
+    Is provides high level operations and interfaces with the board(s) for changing the outputs
     as requested and polling inputs periodically.
 
+    Several boards can be managed by the same controller, possibly spread over several I2C buses.
+    Their IOs share a single namespace, and their states are packed in a wide bitset, each board
+    occupying a 32 bits slice (board 1 in bits 0-31, board 2 in bits 32-63,...). When boards are
+    connected to more than one bus, each bus is polled by its own worker thread, so that all
+    buses are read in parallel.
+
     Inputs changes are monitored and notifications are made using an application provided callback.
     """
-    _board = None
-    _i2c_address = None
+    MAX_BOARDS_PER_BUS = 4
+    MIN_I2C_ADDRESS = 0x20
+    MAX_I2C_ADDRESS = 0x27
+    DEFAULT_BUS_ID = 1
+
+    _boards = None
+    _buses = None
+    _workers = None
     _polling_period = 100
 
     _inputs = None
@@ -40,24 +56,154 @@ class IOPiController(object):
     _outputs_state = None
     _outputs_mask = None
 
+    _polling_policy = None
+    _polls_count = 0
+    _inputs_changes_count = 0
+    _outputs_changes_count = 0
+    _last_poll_time = None
+    _measured_polling_period = None
+
+    _scheduler = None
+    _scheduler_tick = OutputScheduler.DEFAULT_TICK
+
+    _encoders = None
+
     _logger = None
     _active = False
     _verbose = False
 
-    def __init__(self, cfg, logger, verbose=False):
-        """
+    def __init__(self, cfg, logger, verbose=False, bus=None):
+        """ The boards are described by the ``boards`` configuration entry, as a list of dictionaries
+        containing the keys:
+
+            i2c_address
+                (int) I2C address of the board first expander
+            exp2_address
+                (int) I2C address of the board second expander (optional, defaults to ``i2c_address + 1``)
+            bus
+                the identifier of the bus the board is connected to (optional, defaults to 1)
+
+        Boards are numbered from 1, following the sequence of this list, and IOs specifications refer
+        to them with their ``board_num`` field. For single board configurations, the ``boards``
+        entry can be omitted and replaced by an ``i2c_address`` one.
+
+        The bus(es) can be provided as an instance of the I2C/SMBus class, shared by all the boards,
+        or as a dictionary of such instances, keyed by the bus identifiers used in the boards
+        configuration. If not provided, the RaspberryPi default bus is used.
+
+        The polling period is fixed by default. An adaptive policy can be used instead by providing an
+        ``adaptive_polling`` configuration entry (see :py:class:`AdaptivePollingPolicy` for its content).
+        The effective period is then updated after each poll, and the application must read
+        :py:attr:`polling_period` again each time it schedules the next call to :py:meth:`update_io_states`.
+
+        Outputs timed patterns (pulses, blinking, PWM) are handled by an :py:class:`OutputScheduler`,
+        created the first time it is needed. Its resolution is set by the ``scheduler_tick``
+        configuration entry (in ms).
+
+        Quadrature encoders connected to inputs can be decoded by the controller, which updates them
+        at each poll. They are described by the ``encoders`` configuration entry, as a dictionary
+        keyed by the encoder names, and containing the names of the inputs connected to the ``a`` and
+        ``b`` channels. The speed measurement window can be set by the ``encoders_speed_window``
+        configuration entry (in ms).
+
         :param dict cfg: configuration dictionary (see :py:class:`IOPiNode` for details)
         :param logger: logger as set by our owner
+        :param bus: the I2C/SMBus instance, or a dictionary of them keyed by bus identifiers
         """
         self._verbose = verbose
         self._logger = logger
 
-        self._i2c_address = cfg.get('i2c_address', IOPiBoard.EXP1_DEFAULT_ADDRESS)
-        self._logger.info("i2c_address = 0x%x", self._i2c_address)
+        self._boards_specs = boards_specs = self._parse_boards_specs(cfg)
+        self._logger.info('boards configuration:')
+        for num, specs in enumerate(boards_specs, 1):
+            self._logger.info("- #%d %s", num, specs)
+        self._check_boards(boards_specs)
 
         self._polling_period = cfg.get('polling_period', self._polling_period)
         self._logger.info("polling_period = %dms", self._polling_period)
+        self._lock = threading.RLock()
+        self._forced_inputs_mask = self._forced_outputs_mask = 0
+        self._scheduler_tick = cfg.get('scheduler_tick', self._scheduler_tick)
+
+        input_specs, output_specs = self._parse_io_specs(cfg, len(boards_specs))
+
+        if bus is None:
+            bus = i2c_bus
+        # don't go further if we are not running on the real hardware
+        if not bus:
+            raise ValueError('cannot continue since not running on a real RaspberryPi')
+
+        self._boards = boards = [
+            IOPiBoard(self._get_bus(bus, specs.bus), exp1_addr=specs.i2c_address, exp2_addr=specs.exp2_address)
+            for specs in boards_specs
+        ]
+
+        # create input instances for those requested and index them by their name
+        self._inputs = dict((
+            (specs.name,
+             _IODirectoryEntry(
+                boards[specs.board_num - 1].get_digital_input(
+                    specs.expander_num - 1, specs.io_num, pullup_enabled=specs.pull_up, inverted=specs.inverted
+                ),
+                specs
+             )
+             )
+            for specs in input_specs
+        ))
+
+        # build the corresponding mask for bulk testing
+        self._inputs_mask = reduce(lambda x, y: x | y, {1 << entry.num for entry in self._inputs.values()}, 0)
+
+        # create output instances for those requested, as for inputs
+        # (no need to worry about setting the IO directions at chip level,
+        # the IO class constructor takes care of this)
+        self._outputs = dict((
+            (specs.name,
+             _IODirectoryEntry(
+                 boards[specs.board_num - 1].get_digital_output(
+                     specs.expander_num - 1, specs.io_num, specs.default_state
+                 ),
+                 specs
+             )
+             )
+            for specs in output_specs
+        ))
+
+        self._outputs_mask = reduce(lambda x, y: x | y, {1 << entry.num for entry in self._outputs.values()}, 0)
+
+        self._polling_policy = self._create_polling_policy(cfg)
+        if self._polling_policy:
+            self._polling_period = self._polling_policy.period
+
+        self._encoders = self._create_encoders(cfg)
+
+        # group the boards by bus, each bus being read by its own worker when several ones are involved
+        buses = {}
+        for board_index, (specs, board) in enumerate(zip(boards_specs, boards)):
+            buses.setdefault(specs.bus, []).append((board_index, board))
+        self._buses = sorted(buses.iteritems())
+        if len(self._buses) > 1:
+            self._workers = [BusWorker(bus_id, 'iopi-bus') for bus_id, _ in self._buses]
+            for worker in self._workers:
+                worker.start()
+        else:
+            self._workers = []
 
+        self._active = True
+
+    @staticmethod
+    def _parse_boards_specs(cfg):
+        boards_cfg = cfg.get('boards') or [
+            {'i2c_address': cfg.get('i2c_address', IOPiBoard.EXP1_DEFAULT_ADDRESS)}
+        ]
+        return [BoardSpecifications.from_dict(d) for d in boards_cfg]
+
+    def _parse_io_specs(self, cfg, boards_count):
+        """ Parses and checks the IOs configuration.
+
+        :return: the inputs and outputs specifications lists
+        :raise: ValueError if the configuration is not valid
+        """
         try:
             input_specs = [
                 InputSpecifications.from_dict(name, parms)
@@ -92,55 +238,280 @@ class IOPiController(object):
         if {io.name for io in input_specs} & {io.name for io in output_specs}:
             raise ValueError('same name used for an input and for an output')
 
-        input_io_nums = {io.expander_num * 100 + io.io_num for io in input_specs}
-        output_io_nums = {io.expander_num * 100 + io.io_num for io in output_specs}
+        if any(not 1 <= io.board_num <= boards_count for io in input_specs + output_specs):
+            raise ValueError('IO configured on an undefined board')
+
+        input_io_nums = {io.num for io in input_specs}
+        output_io_nums = {io.num for io in output_specs}
         if input_io_nums & output_io_nums:
             raise ValueError('same IO configured both as input and output')
 
-        # don't go further if we are not running on the real hardware
-        if not i2c_bus:
-            raise ValueError('cannot continue since not running on a real RaspberryPi')
+        return input_specs, output_specs
 
-        # suppose I2C addresses are configured in sequence
-        self._board = board = IOPiBoard(i2c_bus, exp1_addr=self._i2c_address, exp2_addr=self._i2c_address+1)
+    def _create_polling_policy(self, cfg):
+        """ Creates the adaptive polling policy if configured, the inputs directory being already built.
 
-        # create input instances for those requested and index them by their name
-        self._inputs = dict((
-            (specs.name,
-             _IODirectoryEntry(
-                board.get_digital_input(specs.expander_num - 1, specs.io_num, pullup_enabled=specs.pull_up),
-                specs.expander_num,
-                specs.io_num
-             )
-             )
-            for specs in input_specs
-        ))
+        :return: the policy, or None if the polling period is fixed
+        """
+        try:
+            adaptive_cfg = cfg['adaptive_polling']
+        except KeyError:
+            return None
 
-        # build the corresponding mask for bulk testing
-        self._inputs_mask = reduce(lambda x, y: x | y, {1 << entry.num_32 for entry in self._inputs.values()})
+        weights = adaptive_cfg.get('weights', {})
+        invalids = set(weights) - set(self._inputs)
+        if invalids:
+            raise ValueError('unknown weighted inputs : %s' % invalids)
+        parameters = dict((k, v) for k, v in adaptive_cfg.iteritems() if k != 'weights')
+        invalids = set(parameters) - set(AdaptivePollingPolicy.PARAMETERS)
+        if invalids:
+            raise ValueError('invalid adaptive polling parameters : %s' % invalids)
+        policy = AdaptivePollingPolicy(
+            weights=dict((1 << self._inputs[name].num, weight) for name, weight in weights.iteritems()),
+            **parameters
+        )
+        self._logger.info("adaptive polling: %s", policy)
+        return policy
 
-        # create output instances for those requested, as for inputs
-        # (no need to worry about setting the IO directions at chip level,
-        # the IO class constructor takes care of this)
-        self._outputs = dict((
-            (specs.name,
-             _IODirectoryEntry(
-                 board.get_digital_output(specs.expander_num - 1, specs.io_num, specs.default_state),
-                 specs.expander_num,
-                 specs.io_num
-             )
-             )
-            for specs in output_specs
-        ))
+    def _create_encoders(self, cfg):
+        """ Creates the encoders bank if configured, the inputs directory being already built.
 
-        self._outputs_mask = reduce(lambda x, y: x | y, {1 << entry.num_32 for entry in self._outputs.values()})
+        :return: the encoders bank, or None if no encoder is defined
+        """
+        encoders_cfg = cfg.get('encoders')
+        if not encoders_cfg:
+            return None
 
-        self._active = True
+        bank = QuadratureEncoderBank(
+            speed_window=cfg.get('encoders_speed_window', QuadratureEncoderBank.DEFAULT_SPEED_WINDOW)
+        )
+        self._logger.info('encoders configuration:')
+        for name, channels in sorted(encoders_cfg.iteritems()):
+            try:
+                bank.add_encoder(name, self._inputs[channels['a']].num, self._inputs[channels['b']].num)
+            except KeyError as e:
+                raise ValueError('invalid encoder %s channel : %s' % (name, e))
+            self._logger.info("- name:%s a:%s b:%s", name, channels['a'], channels['b'])
+        return bank
+
+    @staticmethod
+    def _encoders_definitions(bank):
+        return [(name, bank.get_channels(name)) for name in bank.names]
+
+    @classmethod
+    def _check_boards(cls, boards_specs):
+        if not boards_specs:
+            raise ValueError('at least one board must be defined')
+
+        addresses = {}
+        boards_count = {}
+        for specs in boards_specs:
+            boards_count[specs.bus] = boards_count.get(specs.bus, 0) + 1
+            if boards_count[specs.bus] > cls.MAX_BOARDS_PER_BUS:
+                raise ValueError('too many boards on bus %s (max=%d)' % (specs.bus, cls.MAX_BOARDS_PER_BUS))
+            bus_addresses = addresses.setdefault(specs.bus, set())
+            for addr in (specs.i2c_address, specs.exp2_address):
+                if not cls.MIN_I2C_ADDRESS <= addr <= cls.MAX_I2C_ADDRESS:
+                    raise ValueError('invalid I2C address (0x%x)' % addr)
+                if addr in bus_addresses:
+                    raise ValueError('I2C address 0x%x used more than once on bus %s' % (addr, specs.bus))
+                bus_addresses.add(addr)
+
+    @staticmethod
+    def _get_bus(bus, bus_id):
+        if isinstance(bus, dict):
+            try:
+                return bus[bus_id]
+            except KeyError:
+                raise ValueError('bus not provided : %s' % bus_id)
+        return bus
+
+    @property
+    def boards(self):
+        """ The boards managed by the controller, in configuration order. """
+        return tuple(self._boards)
+
+    def reconfigure(self, cfg):
+        """ Changes the IOs configuration on the fly.
+
+        The new configuration is compared to the current one, and only the register bits which
+        are actually modified are written, with at most one write per register and per port.
+        IOs keeping their direction are left untouched, which means that running outputs are not
+        glitched, and that already existing IO objects are reused. New outputs are set to their
+        default state before being turned into outputs, and IOs which are no more used are put
+        back in input mode, without pull-up.
+
+        The polling can go on concurrently, since the change is applied atomically regarding
+        :py:meth:`update_io_states`. Inputs and outputs added by the new configuration are
+        notified at the next poll.
+
+        The boards configuration cannot be changed this way.
+
+        :param dict cfg: the new configuration dictionary (same content as for the constructor)
+        :return: the number of registers written
+        :rtype: int
+        :raise: ValueError if the configuration is not valid, or tries to change the boards one
+        """
+        if self._parse_boards_specs(cfg) != self._boards_specs:
+            raise ValueError('boards configuration cannot be changed')
+        input_specs, output_specs = self._parse_io_specs(cfg, len(self._boards))
+
+        with self._lock:
+            old_inputs = dict((entry.num, entry) for entry in self._inputs.itervalues())
+            old_outputs = dict((entry.num, entry) for entry in self._outputs.itervalues())
+
+            # compute the new settings of the involved ports, starting from their current ones
+            settings = {}
+
+            def port_settings(num):
+                board_index, board_io_num = divmod(num, 32)
+                port, io_num = self._boards[board_index].get_port(board_io_num / 16, board_io_num % 16 + 1)
+                try:
+                    port_cfg = settings[port]
+                except KeyError:
+                    port_cfg = settings[port] = {
+                        'io_directions': port.io_directions,
+                        'pullups_enabled': port.pullups_enabled,
+                        'inputs_inverted': port.inputs_inverted,
+                        'latches': port.latches,
+                    }
+                return port_cfg, 1 << io_num
+
+            def change_bits(port_cfg, mask, **changes):
+                for reg, value in changes.iteritems():
+                    port_cfg[reg] = port_cfg[reg] | mask if value else port_cfg[reg] & ~mask
+
+            new_nums = {specs.num for specs in input_specs + output_specs}
+            for num in set(old_inputs.keys() + old_outputs.keys()) - new_nums:
+                port_cfg, mask = port_settings(num)
+                change_bits(port_cfg, mask, io_directions=True, pullups_enabled=False, inputs_inverted=False)
+
+            for specs in input_specs:
+                port_cfg, mask = port_settings(specs.num)
+                change_bits(
+                    port_cfg, mask, io_directions=True, pullups_enabled=specs.pull_up, inputs_inverted=specs.inverted
+                )
+
+            for specs in output_specs:
+                port_cfg, mask = port_settings(specs.num)
+                if specs.num not in old_outputs:
+                    change_bits(port_cfg, mask, latches=specs.default_state)
+                change_bits(port_cfg, mask, io_directions=False)
+
+            writes = sum(port.apply_settings(**port_cfg) for port, port_cfg in settings.iteritems())
+
+            # build the new directories, reusing the entries of the IOs which direction is unchanged
+            def directory_entry(specs, old_entries, get_io):
+                try:
+                    entry = old_entries[specs.num]
+                except KeyError:
+                    # IO objects are not allowed to touch the registers, since they are already set
+                    entry = _IODirectoryEntry(
+                        get_io(self._boards[specs.board_num - 1], specs.expander_num - 1, specs.io_num, specs),
+                        specs
+                    )
+                else:
+                    entry.specs = specs
+                return specs.name, entry
+
+            inputs = dict(
+                directory_entry(
+                    specs, old_inputs,
+                    lambda board, exp, io, sp: board.get_digital_input(
+                        exp, io, pullup_enabled=sp.pull_up, inverted=sp.inverted, configure=False
+                    )
+                )
+                for specs in input_specs
+            )
+            outputs = dict(
+                directory_entry(
+                    specs, old_outputs,
+                    lambda board, exp, io, sp: board.get_digital_output(
+                        exp, io, default_state=sp.default_state, configure=False
+                    )
+                )
+                for specs in output_specs
+            )
+            # reused outputs keep their current state, only their default one (used by later resets)
+            # being updated
+            for entry in outputs.itervalues():
+                if entry.io.default_state != entry.specs.default_state:
+                    entry.io.default_state = entry.specs.default_state
+            inputs_mask = reduce(lambda x, y: x | y, {1 << entry.num for entry in inputs.values()}, 0)
+            outputs_mask = reduce(lambda x, y: x | y, {1 << entry.num for entry in outputs.values()}, 0)
+
+            # make sure the new IOs will be notified at next poll, whatever is their state
+            self._forced_inputs_mask |= inputs_mask & ~self._inputs_mask
+            self._forced_outputs_mask |= outputs_mask & ~self._outputs_mask
+            if self._inputs_state is not None:
+                self._inputs_state &= inputs_mask
+            if self._outputs_state is not None:
+                self._outputs_state &= outputs_mask
+
+            if self._scheduler:
+                for num in set(old_outputs) - {entry.num for entry in outputs.itervalues()}:
+                    self._scheduler.stop(old_outputs[num].io)
+
+            self._inputs, self._inputs_mask = inputs, inputs_mask
+            self._outputs, self._outputs_mask = outputs, outputs_mask
+
+            self._polling_policy = self._create_polling_policy(cfg)
+            self._polling_period = (
+                self._polling_policy.period if self._polling_policy
+                else cfg.get('polling_period', self._polling_period)
+            )
+
+            # keep the encoders counts if their definitions are unchanged
+            encoders = self._create_encoders(cfg)
+            if not self._encoders or not encoders or self._encoders_definitions(encoders) != \
+                    self._encoders_definitions(self._encoders):
+                self._encoders = encoders
+
+        self._logger.info("reconfiguration done (%d registers written)", writes)
+        return writes
 
     @property
     def polling_period(self):
+        """ The current polling period (in ms).
+
+        It is constant unless an adaptive polling policy is configured.
+        """
         return self._polling_period
 
+    def get_statistics(self):
+        """ Returns the controller statistics.
+
+        The returned dictionary contains the following items:
+
+            polls
+                (int) number of polls done so far
+            inputs_changes
+                (int) number of polls which detected inputs changes
+            outputs_changes
+                (int) number of polls which detected outputs changes
+            polling_period
+                (int) current polling period (ms)
+            polling_rate
+                (float) polling rate corresponding to the current period (Hz)
+            measured_polling_rate
+                (float) polling rate measured from the effective polls timing (Hz),
+                None until at least 2 polls have been done
+            adaptive
+                (bool) True if the polling period is adaptive
+
+        :rtype: dict
+        """
+        measured_period = self._measured_polling_period
+        return {
+            'polls': self._polls_count,
+            'inputs_changes': self._inputs_changes_count,
+            'outputs_changes': self._outputs_changes_count,
+            'polling_period': self._polling_period,
+            'polling_rate': 1000. / self._polling_period,
+            'measured_polling_rate': 1. / measured_period if measured_period else None,
+            'adaptive': self._polling_policy is not None,
+        }
+
     @property
     def input_names(self):
         return self._inputs.keys()
@@ -157,9 +528,13 @@ class IOPiController(object):
     def shutdown(self):
         """ Deactivates running tasks as part of the node shutdown sequence.
         """
+        if self._scheduler:
+            self._scheduler.terminate()
         self.reset_outputs()
 
         self._active = False
+        for worker in self._workers:
+            worker.terminate()
         # ensure we have a chance to end what is running
         time.sleep(2 * self._polling_period / 1000.)
 
@@ -171,24 +546,24 @@ class IOPiController(object):
         """
         return bool(self._inputs)
 
-    def _process_ios(self, io_dict, io_mask, all_states, previous_states, notification_callback):
+    def _process_ios(self, io_dict, io_mask, all_states, previous_states, notification_callback, forced_mask=0):
         """
         :param io_dict: the dictionary of the processed IOs
         :param io_mask: the global mask for the processed IOs
         :param all_states: the global states read from the board (all inputs and outputs included)
         :param previous_states: previous known state of the processed IOs
         :param notification_callback: change notification callback
+        :param forced_mask: mask of the IOs to be notified even if unchanged
         :return: the new states of the processed IOs in case of change, None otherwise
         """
         new_states = all_states & io_mask
-        if new_states != previous_states:
+        if new_states != previous_states or forced_mask:
             if previous_states is None:
                 change_mask = io_mask
             else:
-                change_mask = new_states ^ previous_states
+                change_mask = (new_states ^ previous_states) | forced_mask
             for name, io in io_dict.iteritems():
-                num_32 = io.num_32
-                mask = 1 << num_32
+                mask = 1 << io.num
                 if change_mask & mask:
                     state = bool(new_states & mask)
                     io.state = state
@@ -224,19 +599,46 @@ class IOPiController(object):
 
         :param notification_callbacks: a tuple containing the callbacks for inputs and outputs changes notification
         """
-        all_states = self._board.read()
+        # protect against a concurrent reconfiguration
+        with self._lock:
+            self._poll(notification_callbacks)
+
+        # ask to keep on calling us while the node is active
+        return self._active
+
+    def _poll(self, notification_callbacks):
+        all_states = self._read_boards()
+        now = time.time()
         cb_input_changed, cb_output_changed = notification_callbacks
 
+        self._polls_count += 1
+        if self._last_poll_time is not None:
+            period = now - self._last_poll_time
+            if self._measured_polling_period is None:
+                self._measured_polling_period = period
+            else:
+                # smooth the measure, since individual periods are subject to the scheduling jitter
+                self._measured_polling_period += (period - self._measured_polling_period) * 0.1
+        self._last_poll_time = now
+
         # process the input states and detect changes to publish the corresponding events
+        previous_states = self._inputs_state
         new_states = self._process_ios(
             self._inputs, self._inputs_mask,
-            all_states, self._inputs_state,
-            cb_input_changed
+            all_states, previous_states,
+            cb_input_changed, self._forced_inputs_mask
         )
+        self._forced_inputs_mask = 0
         if new_states is not None:
             if self._verbose:
                 self._logger.info("input states changed to 0x%04x", new_states)
             self._inputs_state = new_states
+            self._inputs_changes_count += 1
+
+        if self._polling_policy:
+            # the initial read is not an activity
+            change_mask = new_states ^ previous_states if new_states is not None and previous_states is not None else 0
+            self._polling_period = self._polling_policy.update(change_mask, now)
 
         # process the output states the same way as above
 
@@ -247,15 +649,42 @@ class IOPiController(object):
         new_states = self._process_ios(
             self._outputs, self._outputs_mask,
             all_states, self._outputs_state,
-            cb_output_changed
+            cb_output_changed, self._forced_outputs_mask
         )
+        self._forced_outputs_mask = 0
         if new_states is not None:
             if self._verbose:
                 self._logger.info("output states changed to 0x%04x", new_states)
             self._outputs_state = new_states
+            self._outputs_changes_count += 1
 
-        # ask to keep on calling us while the node is active
-        return self._active
+        if self._encoders:
+            self._encoders.update(all_states, now)
+
+    def _read_boards(self):
+        """ Reads all the boards and returns their states packed in a single integer.
+
+        When several buses are involved, they are read in parallel by their respective
+        workers.
+        """
+        if not self._workers:
+            return self._read_bus_boards(self._buses[0][1])
+
+        for worker, (_, bus_boards) in zip(self._workers, self._buses):
+            worker.trigger(self._read_bus_boards, bus_boards)
+        return reduce(lambda x, y: x | y, collect_all(self._workers), 0)
+
+    @staticmethod
+    def _read_bus_boards(bus_boards):
+        """ Reads the boards connected to a bus and returns their states, shifted at their position
+        in the controller bitset.
+
+        :param bus_boards: a list of tuples (board index, board) of the boards connected to the bus
+        """
+        states = 0
+        for board_index, board in bus_boards:
+            states |= board.read() << (32 * board_index)
+        return states
 
     def get_inputs_state(self, names):
         """ Returns the current state of the inputs, as updated in the last loop iteration
@@ -271,21 +700,98 @@ class IOPiController(object):
         :param states: a list if tuples providing the name and the state
         :raises ValueError: if an unknown name is in the provided list
         """
-        # better check before to avoid leaving outputs in a inconsistent state
-        names = set([t[0] for t in states])
-        invalids = names - set(self._outputs.iterkeys())
-        if invalids:
-            raise ValueError('unknown outputs : %s' % invalids)
+        with self._lock:
+            # better check before to avoid leaving outputs in a inconsistent state
+            names = set([t[0] for t in states])
+            invalids = names - set(self._outputs.iterkeys())
+            if invalids:
+                raise ValueError('unknown outputs : %s' % invalids)
+
+            for name, state in states:
+                io = self._outputs[name]
+                state = bool(state)
+
+                if state != io.state:
+                    if state:
+                        io.io.set()
+                    else:
+                        io.io.clear()
+
+    @property
+    def encoders(self):
+        """ The quadrature encoders bank, or None if no encoder is configured. """
+        return self._encoders
 
-        for name, state in states:
-            io = self._outputs[name]
-            state = bool(state)
+    def get_encoders_readings(self, names):
+        """ Returns the current state of encoders, as updated in the last loop iteration
 
-            if state != io.state:
-                if state:
-                    self._outputs[name].io.set()
-                else:
-                    self._outputs[name].io.clear()
+        :param names: the list of encoder names which state is requested
+        :return: the list of :py:class:`EncoderReading`, synchronized with the `names` parameter
+        :raises ValueError: if no encoder is configured
+        """
+        if not self._encoders:
+            raise ValueError('no encoder configured')
+        return self._encoders.get_readings(names)
+
+    @property
+    def scheduler(self):
+        """ The outputs patterns scheduler, started the first time it is requested. """
+        with self._lock:
+            if not self._scheduler:
+                self._scheduler = OutputScheduler(tick=self._scheduler_tick)
+                self._scheduler.start()
+            return self._scheduler
+
+    def _get_output_io(self, name):
+        try:
+            return self._outputs[name].io
+        except KeyError:
+            raise ValueError('unknown output : %s' % name)
+
+    def pulse_output(self, name, duration, state=True):
+        """ Changes an output state during a given time, and restores it after (see
+        :py:meth:`OutputScheduler.pulse`).
+
+        :param str name: the output name
+        :param int duration: the pulse duration (ms)
+        :param bool state: the state of the output during the pulse
+        :raises ValueError: if the output name is unknown
+        """
+        self.scheduler.pulse(self._get_output_io(name), duration, state)
+
+    def blink_output(self, name, on_time, off_time, count=None):
+        """ Makes an output blink.
+
+        :param str name: the output name
+        :param int on_time: the duration of the high state (ms)
+        :param int off_time: the duration of the low state (ms)
+        :param int count: the number of blinks (None for blinking until stopped)
+        :raises ValueError: if the output name is unknown
+        """
+        self.scheduler.blink(self._get_output_io(name), on_time, off_time, count)
+
+    def pwm_output(self, name, period, duty):
+        """ Generates a slow PWM signal on an output.
+
+        :param str name: the output name
+        :param int period: the PWM period (ms)
+        :param float duty: the duty cycle (in [0, 1])
+        :raises ValueError: if the output name is unknown
+        """
+        self.scheduler.pwm(self._get_output_io(name), period, duty)
+
+    def stop_output_pattern(self, name, state=None):
+        """ Stops the timed pattern running on an output, if any.
+
+        :param str name: the output name
+        :param bool state: the state the output is set to (None to leave it as is)
+        :raises ValueError: if the output name is unknown
+        """
+        io = self._get_output_io(name)
+        if self._scheduler:
+            self._scheduler.stop(io, state)
+        elif state is not None:
+            self.set_outputs_state([(name, state)])
 
     def get_outputs_state(self, names):
         """ Returns the current state of the outputs
@@ -296,9 +802,116 @@ class IOPiController(object):
         return [self._outputs[name].state for name in names]
 
 
+class AdaptivePollingPolicy(object):
+    """ Adapts the polling period to the inputs activity.
+
+    Each time inputs changes are detected, the period is tightened toward its minimum value, by
+    multiplying it by ``tighten_factor`` raised to the power of the weight of the changes. This weight
+    is the sum of the weights of the changed inputs, which is 1 unless specified otherwise. Giving a
+    high weight to latency-critical inputs will thus make the period jump to its minimum as soon as
+    they change.
+
+    When no change occurred during the last ``quiet_delay`` ms, the period is relaxed toward its
+    maximum value, by multiplying it by ``relax_factor`` at each poll.
+
+    The configuration dictionary items match the constructor parameters, except for the weights,
+    which are keyed by the input names instead of their masks.
+    """
+    PARAMETERS = ('min_period', 'max_period', 'tighten_factor', 'relax_factor', 'quiet_delay')
+
+    def __init__(self, min_period=10, max_period=500, tighten_factor=0.5, relax_factor=1.25, quiet_delay=1000,
+                 weights=None):
+        """
+        :param int min_period: the polling period lower limit (ms)
+        :param int max_period: the polling period upper limit (ms)
+        :param float tighten_factor: the period multiplier applied on changes (in ]0, 1[)
+        :param float relax_factor: the period multiplier applied after a quiet period (> 1)
+        :param int quiet_delay: the duration without change triggering the period relaxing (ms)
+        :param dict weights: weights of the inputs, keyed by their mask in the controller bitset
+        """
+        if not 0 < min_period <= max_period:
+            raise ValueError('invalid polling period limits (%s, %s)' % (min_period, max_period))
+        if not 0 < tighten_factor < 1:
+            raise ValueError('invalid tighten factor (%s)' % tighten_factor)
+        if not relax_factor > 1:
+            raise ValueError('invalid relax factor (%s)' % relax_factor)
+
+        self.min_period = min_period
+        self.max_period = max_period
+        self.tighten_factor = tighten_factor
+        self.relax_factor = relax_factor
+        self.quiet_delay = quiet_delay / 1000.
+        self._weights = (weights or {}).items()
+        self._weighted_mask = reduce(lambda x, y: x | y, (mask for mask, _ in self._weights), 0)
+
+        # start relaxed, since nothing happened yet
+        self._period = float(max_period)
+        self._last_change_time = None
+
+    @property
+    def period(self):
+        """ The current polling period (ms). """
+        return int(round(self._period))
+
+    def changes_weight(self, change_mask):
+        """ Returns the weight of a set of changes.
+
+        :param int change_mask: the mask of the changed inputs
+        :rtype: float
+        """
+        weight = bin(change_mask & ~self._weighted_mask).count('1')
+        for mask, input_weight in self._weights:
+            if change_mask & mask:
+                weight += input_weight
+        return weight
+
+    def update(self, change_mask, now):
+        """ Updates the polling period based on the result of the last poll.
+
+        :param int change_mask: the mask of the inputs changed since the previous poll
+        :param float now: the poll timestamp
+        :return: the new polling period (ms)
+        :rtype: int
+        """
+        if change_mask:
+            self._last_change_time = now
+            self._period = max(self.min_period, self._period * self.tighten_factor ** self.changes_weight(change_mask))
+        elif self._last_change_time is None or now - self._last_change_time >= self.quiet_delay:
+            self._period = min(self.max_period, self._period * self.relax_factor)
+        return self.period
+
+    def __str__(self):
+        return "min_period:%d max_period:%d tighten_factor:%.2f relax_factor:%.2f quiet_delay:%d" % (
+            self.min_period, self.max_period, self.tighten_factor, self.relax_factor, self.quiet_delay * 1000
+        )
+
+
+class BoardSpecifications(namedtuple('BoardSpecifications', 'i2c_address exp2_address bus')):
+    __slots__ = ()
+
+    def __new__(cls, i2c_address=IOPiBoard.EXP1_DEFAULT_ADDRESS, exp2_address=None, bus=IOPiController.DEFAULT_BUS_ID):
+        if exp2_address is None:
+            # suppose I2C addresses are configured in sequence
+            exp2_address = i2c_address + 1
+        return super(BoardSpecifications, cls).__new__(cls, i2c_address, exp2_address, bus)
+
+    @classmethod
+    def from_dict(cls, d):
+        return BoardSpecifications(
+            **dict([(fld, d[fld]) for fld in BoardSpecifications._fields if fld in d])
+        )
+
+    def __str__(self):
+        return "i2c_address:0x%x exp2_address:0x%x bus:%s" % (
+            self.i2c_address, self.exp2_address, self.bus
+        )
+
+
 class _IOSpecifications(object):
+    __slots__ = ()
+
     @staticmethod
-    def _check(name, expander_num, io_num):
+    def _check(name, expander_num, io_num, board_num):
         if not name:
             raise ValueError('name is mandatory')
 
@@ -308,52 +921,61 @@ class _IOSpecifications(object):
         if not 1 <= io_num <= 16:
             raise ValueError('invalid IO num')
 
+        if board_num < 1:
+            raise ValueError('invalid board num')
 
-class InputSpecifications(namedtuple('InputSpecifications', 'name expander_num io_num pull_up'), _IOSpecifications):
+    @property
+    def num(self):
+        """ The position of the IO in the controller wide bitset. """
+        return (self.board_num - 1) * 32 + (self.expander_num - 1) * 16 + self.io_num - 1
+
+
+class InputSpecifications(namedtuple('InputSpecifications', 'name expander_num io_num pull_up board_num inverted'),
+                          _IOSpecifications):
     __slots__ = ()
 
-    def __new__(cls, name, expander_num, io_num, pull_up=True):
-        cls._check(name, expander_num, io_num)
-        return super(InputSpecifications, cls).__new__(cls, name, expander_num, io_num, pull_up)
+    def __new__(cls, name, expander_num, io_num, pull_up=True, board_num=1, inverted=False):
+        cls._check(name, expander_num, io_num, board_num)
+        return super(InputSpecifications, cls).__new__(cls, name, expander_num, io_num, pull_up, board_num, inverted)
 
     @classmethod
     def from_dict(cls, name, d):
         return InputSpecifications(
             name,
-            **dict([(fld, d[fld]) for fld in set(InputSpecifications._fields) - {'name'}])
+            **dict([(fld, d[fld]) for fld in set(InputSpecifications._fields) - {'name'} if fld in d])
         )
 
     def __str__(self):
-        return "name:%s expander:%d io:%d pull_up:%s" % (
-            self.name, self.expander_num, self.io_num, self.pull_up
+        return "name:%s board:%d expander:%d io:%d pull_up:%s inverted:%s" % (
+            self.name, self.board_num, self.expander_num, self.io_num, self.pull_up, self.inverted
         )
 
 
-class OutputSpecifications(namedtuple('OutputSpecifications', 'name expander_num io_num default_state'), _IOSpecifications):
+class OutputSpecifications(namedtuple('OutputSpecifications', 'name expander_num io_num default_state board_num'),
+                           _IOSpecifications):
     __slots__ = ()
 
-    def __new__(cls, name, expander_num, io_num, default_state=0):
-        cls._check(name, expander_num, io_num)
-        return super(OutputSpecifications, cls).__new__(cls, name, expander_num, io_num, default_state)
+    def __new__(cls, name, expander_num, io_num, default_state=0, board_num=1):
+        cls._check(name, expander_num, io_num, board_num)
+        return super(OutputSpecifications, cls).__new__(cls, name, expander_num, io_num, default_state, board_num)
 
     @classmethod
     def from_dict(cls, name, d):
         return OutputSpecifications(
             name,
-            **dict([(fld, d[fld]) for fld in set(OutputSpecifications._fields) - {'name'}])
+            **dict([(fld, d[fld]) for fld in set(OutputSpecifications._fields) - {'name'} if fld in d])
         )
 
     def __str__(self):
-        return "name:%s expander:%d io:%d default_state:%d" % (
-            self.name, self.expander_num, self.io_num, self.default_state
+        return "name:%s board:%d expander:%d io:%d default_state:%d" % (
+            self.name, self.board_num, self.expander_num, self.io_num, self.default_state
         )
 
 
 class _IODirectoryEntry(object):
-    def __init__(self, io, exp_board_num, io_board_num):
+    def __init__(self, io, specs):
         self.io = io
+        self.specs = specs
         self.state = None
-        self.num_32 = (exp_board_num - 1) * 16 + io_board_num - 1
+        self.num = specs.num
         self.pub = None
-
-
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides the decoding of quadrature encoders connected to IOPi inputs.
+
+The decoding works on the raw IO states as acquired by a bulk read of the board(s), such as
+returned by :py:meth:`IOPiBoard.read`, and updates all the encoders in a single pass. Each encoder
+is decoded with a 16 entries transition table, indexed by the previous and current states of its
+channels. Transitions skipping a state (both channels changed since the previous read) are illegal,
+and counted as errors, since they denote a polling too slow for the encoder speed.
+
+All the encoders data are stored in preallocated arrays, so that nothing is allocated by the updates.
+
+>>> board = IOPiBoard(i2c_bus)
+>>> bank = QuadratureEncoderBank()
+>>> # channels A and B on pins 1 and 2 of expander 1 header
+>>> bank.add_encoder('jog', 0, 1)
+>>> ...
+>>> bank.update(board.read())
+>>> count, direction, errors, speed = bank.get_reading('jog')
+
+The :py:class:`pybot.abelec.iopi.control.IOPiController` can manage a bank, updated with each poll.
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['QuadratureEncoderBank', 'EncoderReading']
+
+import time
+from array import array
+from collections import namedtuple
+
+
+class EncoderReading(namedtuple('EncoderReading', 'count direction errors speed')):
+    """ The state of an encoder.
+
+    The direction is the one of the last move (-1 or 1), or 0 if the encoder never moved.
+    The speed is expressed in counts per second.
+    """
+    __slots__ = ()
+
+
+class QuadratureEncoderBank(object):
+    """ A set of quadrature encoders, decoded together.
+
+    Channels are identified by their position in the IO states bitset (i.e. the board IO num, starting
+    from 0, possibly offset by 32 for each board preceding the one they belong to in a multi-boards
+    configuration).
+    """
+    MAX_ENCODERS = 16
+    DEFAULT_SPEED_WINDOW = 100
+
+    # count increments, indexed by (previous_AB << 2) | current_AB
+    _TRANSITIONS = (
+        0, 1, -1, 0,
+        -1, 0, 0, 1,
+        1, 0, 0, -1,
+        0, -1, 1, 0,
+    )
+    # illegal transition flags, with the same indexing
+    _ILLEGAL = (
+        0, 0, 0, 1,
+        0, 0, 1, 0,
+        0, 1, 0, 0,
+        1, 0, 0, 0,
+    )
+
+    def __init__(self, speed_window=DEFAULT_SPEED_WINDOW):
+        """
+        :param int speed_window: the duration of the speed measurement window (ms)
+        """
+        self._speed_window = speed_window / 1000.
+        self._names = []
+        self._index = {}
+
+        size = self.MAX_ENCODERS
+        self._bits_a = array('l', [0] * size)
+        self._bits_b = array('l', [0] * size)
+        self._states = array('l', [-1] * size)
+        self._counts = array('l', [0] * size)
+        self._directions = array('l', [0] * size)
+        self._errors = array('l', [0] * size)
+        self._speeds = array('d', [0.] * size)
+        self._window_counts = array('l', [0] * size)
+        self._window_start = None
+
+    @property
+    def names(self):
+        return tuple(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def add_encoder(self, name, bit_a, bit_b):
+        """ Declares an encoder.
+
+        :param str name: the encoder name
+        :param int bit_a: the position of the A channel in the IO states bitset
+        :param int bit_b: the position of the B channel in the IO states bitset
+        :raise: ValueError if the encoder cannot be added
+        """
+        if not name:
+            raise ValueError('name is mandatory')
+        if name in self._index:
+            raise ValueError('duplicate encoder name : %s' % name)
+        if len(self._names) == self.MAX_ENCODERS:
+            raise ValueError('too many encoders (max=%d)' % self.MAX_ENCODERS)
+        if bit_a < 0 or bit_b < 0 or bit_a == bit_b:
+            raise ValueError('invalid channels (%d, %d)' % (bit_a, bit_b))
+
+        i = len(self._names)
+        self._bits_a[i] = bit_a
+        self._bits_b[i] = bit_b
+        self._names.append(name)
+        self._index[name] = i
+        self.reset(name)
+
+    def get_channels(self, name):
+        """ Returns the positions of the channels of an encoder.
+
+        :param str name: the encoder name
+        :return: a tuple (bit_a, bit_b)
+        """
+        i = self._index[name]
+        return self._bits_a[i], self._bits_b[i]
+
+    def reset(self, name):
+        """ Resets the count and the errors of an encoder.
+
+        :param str name: the encoder name
+        """
+        i = self._index[name]
+        self._states[i] = -1
+        self._counts[i] = 0
+        self._directions[i] = 0
+        self._errors[i] = 0
+        self._speeds[i] = 0.
+        self._window_counts[i] = 0
+
+    def update(self, states, now=None):
+        """ Updates all the encoders from the IO states.
+
+        The first update of an encoder only initializes its state.
+
+        :param int states: the IO states bitset
+        :param float now: the time of the read (defaults to the current time)
+        """
+        if now is None:
+            now = time.time()
+        transitions, illegal = self._TRANSITIONS, self._ILLEGAL
+        bits_a, bits_b = self._bits_a, self._bits_b
+        prev_states, counts, directions, errors = self._states, self._counts, self._directions, self._errors
+
+        for i in xrange(len(self._names)):
+            state = ((states >> bits_a[i]) & 1) << 1 | ((states >> bits_b[i]) & 1)
+            previous = prev_states[i]
+            if state == previous:
+                continue
+            prev_states[i] = state
+            if previous < 0:
+                continue
+
+            index = previous << 2 | state
+            delta = transitions[index]
+            if delta:
+                counts[i] += delta
+                directions[i] = delta
+            else:
+                errors[i] += illegal[index]
+
+        # speeds are updated at the end of each measurement window
+        if self._window_start is None:
+            self._window_start = now
+        elif now - self._window_start >= self._speed_window:
+            elapsed = now - self._window_start
+            speeds, window_counts = self._speeds, self._window_counts
+            for i in xrange(len(self._names)):
+                speeds[i] = (counts[i] - window_counts[i]) / elapsed
+                window_counts[i] = counts[i]
+            self._window_start = now
+
+    def get_reading(self, name):
+        """ Returns the current state of an encoder.
+
+        :param str name: the encoder name
+        :rtype: EncoderReading
+        """
+        i = self._index[name]
+        return EncoderReading(self._counts[i], self._directions[i], self._errors[i], self._speeds[i])
+
+    def get_readings(self, names=None):
+        """ Returns the current state of several encoders.
+
+        :param names: the list of encoder names (all of them if not provided)
+        :return: the list of readings, synchronized with the ``names`` parameter
+        """
+        return [self.get_reading(name) for name in (names or self._names)]
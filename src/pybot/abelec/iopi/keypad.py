@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides a scanning engine for key matrices (such as 4x4 or 8x8 keypads) connected
+to the IOs of an expander.
+
+Rows must be connected to pins of the same port. They are driven one at a time, by turning the
+selected row into an output at low level while the other ones are left in high impedance (this
+avoids shorting the row drivers when several keys of the same column are pressed). Selecting a row
+thus costs a single port write. Columns are inputs with pull-ups enabled, and are read with a single
+port read, or a single block read of both ports when they are spread over them.
+
+Keys states are handled as a bitset, the key at row ``r`` and column ``c`` being the bit of rank
+``r * columns_count + c``. Debouncing is done in parallel for all keys with vertical counters, a
+change being validated after being seen in 4 consecutive scans.
+
+Without diodes in series with the keys, pressing 3 keys at the corners of a rectangle makes the
+4th corner appear pressed too ("ghosting"). Such ambiguous scans are detected, and ignored, unless
+the matrix is declared as equipped with diodes, in which case any number of simultaneous keys is
+supported (n-key rollover).
+
+>>> board = IOPiBoard(i2c_bus)
+>>> expander = board.expanders[board.EXPANDER_1]
+>>> keypad = KeypadScanner(
+>>>     expander, rows=(1, 2, 3, 4), columns=(5, 6, 7, 8),
+>>>     keys=('123A', '456B', '789C', '*0#D')
+>>> )
+>>> keypad.start(callback=lambda key, pressed: ..., period=10)
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['KeypadScanner']
+
+import threading
+import time
+
+from .base import Expander
+
+
+class KeypadScanner(object):
+    """ The key matrix scanner.
+
+    Pins are identified by their number on the expander header ([1-16]), as for
+    :py:meth:`IOPiBoard.get_digital_input`.
+    """
+    DEFAULT_PERIOD = 10
+
+    def __init__(self, expander, rows, columns, keys=None, diodes=False):
+        """
+        :param Expander expander: the expander the matrix is connected to
+        :param tuple rows: the pins connected to the rows
+        :param tuple columns: the pins connected to the columns
+        :param keys: the keys identifiers, as a sequence of sequences indexed by row and
+        column. If not provided, keys are identified by (row, column) tuples.
+        :param bool diodes: True if the keys are equipped with anti-ghosting diodes
+        """
+        pins = tuple(rows) + tuple(columns)
+        if not rows or not columns:
+            raise ValueError('at least one row and one column must be defined')
+        if len(set(pins)) != len(pins) or not all(1 <= pin <= 16 for pin in pins):
+            raise ValueError('invalid pins')
+        rows_port_num = (rows[0] - 1) / 8
+        if any((pin - 1) / 8 != rows_port_num for pin in rows):
+            raise ValueError('rows must be connected to the same port')
+
+        self._expander = expander
+        self._rows_count = len(rows)
+        self._columns_count = len(columns)
+        self._diodes = diodes
+        self._keys = [
+            [keys[r][c] if keys else (r, c) for c in xrange(self._columns_count)]
+            for r in xrange(self._rows_count)
+        ]
+
+        # the rows port and the rows masks inside it
+        self._rows_port = expander.ports[rows_port_num]
+        self._rows_masks = [1 << ((pin - 1) % 8) for pin in rows]
+        self._all_rows_mask = reduce(lambda x, y: x | y, self._rows_masks)
+
+        # the columns can be spread over both ports, in which case they are read in a single block
+        columns_ports = {(pin - 1) / 8 for pin in columns}
+        self._block_read = len(columns_ports) > 1
+        self._columns_port = None if self._block_read else expander.ports[columns_ports.pop()]
+
+        # lookup tables converting the columns ports bytes into a compact bitset of the active
+        # (i.e. low) columns
+        self._columns_tables = []
+        for port_num in (Expander.PORT_A, Expander.PORT_B):
+            port_columns = [
+                (c, 1 << ((pin - 1) % 8)) for c, pin in enumerate(columns) if (pin - 1) / 8 == port_num
+            ]
+            self._columns_tables.append(tuple(
+                reduce(lambda x, y: x | y, (1 << c for c, mask in port_columns if not byte & mask), 0)
+                for byte in xrange(256)
+            ))
+
+        self._columns_config = [
+            reduce(lambda x, y: x | y, (1 << ((pin - 1) % 8) for pin in columns if (pin - 1) / 8 == port_num), 0)
+            for port_num in (Expander.PORT_A, Expander.PORT_B)
+        ]
+        self._all_keys_mask = (1 << (self._rows_count * self._columns_count)) - 1
+
+        # debouncing vertical counters and debounced state
+        self._ct0 = self._ct1 = self._all_keys_mask
+        self._state = 0
+        self._raw = 0
+
+        self._row_directions = None
+        self._thread = None
+        self._running = False
+        self._callback = None
+        self._period = self.DEFAULT_PERIOD
+
+        self._scans_count = 0
+        self._ghosting_count = 0
+        self._first_scan_time = None
+        self._last_scan_time = None
+
+        self.configure()
+
+    @property
+    def rows_count(self):
+        return self._rows_count
+
+    @property
+    def columns_count(self):
+        return self._columns_count
+
+    def configure(self):
+        """ Configures the expander pins for the matrix.
+
+        This is done at instantiation, and needs to be done again only if the involved port
+        registers have been modified by some other means.
+        """
+        # columns are inputs with pull-ups
+        for port, columns_mask in zip(self._expander.ports, self._columns_config):
+            if columns_mask:
+                port.apply_settings(
+                    io_directions=port.io_directions | columns_mask,
+                    pullups_enabled=port.pullups_enabled | columns_mask,
+                    inputs_inverted=port.inputs_inverted & ~columns_mask,
+                )
+
+        # rows are in high impedance state with low latches, so that selecting a row is done
+        # by only changing its direction
+        port = self._rows_port
+        port.apply_settings(
+            latches=port.latches & ~self._all_rows_mask,
+            io_directions=port.io_directions | self._all_rows_mask
+        )
+        idle_directions = port.io_directions
+        self._row_directions = [idle_directions & ~mask for mask in self._rows_masks]
+
+    def _read_columns(self):
+        """ Returns the bitset of the active columns for the selected row. """
+        tables = self._columns_tables
+        if self._block_read:
+            value_a, value_b = self._expander.read_registers(Expander.GPIO, 2)
+            return tables[Expander.PORT_A][value_a] | tables[Expander.PORT_B][value_b]
+        else:
+            return tables[self._columns_port.port_num][self._columns_port.read()]
+
+    def scan(self):
+        """ Performs a full scan of the matrix and updates the debounced keys states.
+
+        :return: the list of key events, as (key, pressed) tuples
+        :rtype: list
+        """
+        raw = 0
+        shift = 0
+        rows_port = self._rows_port
+        for directions in self._row_directions:
+            rows_port.io_directions = directions
+            raw |= self._read_columns() << shift
+            shift += self._columns_count
+        # leave the rows in high impedance between scans
+        rows_port.io_directions = directions | self._all_rows_mask
+
+        now = time.time()
+        self._scans_count += 1
+        if self._first_scan_time is None:
+            self._first_scan_time = now
+        self._last_scan_time = now
+
+        if not self._diodes and self._is_ambiguous(raw):
+            # ignore the scan, keeping the last unambiguous one for debouncing
+            self._ghosting_count += 1
+            raw = self._raw
+        self._raw = raw
+
+        # vertical counters debouncing (changes validated after 4 identical samples)
+        full = self._all_keys_mask
+        changes = self._state ^ raw
+        self._ct0 = ~(self._ct0 & changes) & full
+        self._ct1 = (self._ct0 ^ (self._ct1 & changes)) & full
+        changes &= self._ct0 & self._ct1
+        if not changes:
+            return []
+
+        self._state ^= changes
+        events = []
+        columns_count = self._columns_count
+        bit = 0
+        while changes:
+            if changes & 1:
+                row, column = divmod(bit, columns_count)
+                events.append((self._keys[row][column], bool(self._state & (1 << bit))))
+            changes >>= 1
+            bit += 1
+        return events
+
+    def _is_ambiguous(self, raw):
+        """ Tells if a raw scan result can contain ghost keys, i.e. if two rows share at
+        least two active columns.
+        """
+        columns_count = self._columns_count
+        columns_mask = (1 << columns_count) - 1
+        rows = [(raw >> (r * columns_count)) & columns_mask for r in xrange(self._rows_count)]
+        rows = [cols for cols in rows if cols]
+        for i, cols in enumerate(rows):
+            for other in rows[i + 1:]:
+                if bin(cols & other).count('1') >= 2:
+                    return True
+        return False
+
+    def get_pressed_keys(self):
+        """ Returns the keys currently pressed (debounced state).
+
+        :rtype: list
+        """
+        state = self._state
+        return [
+            self._keys[r][c]
+            for r in xrange(self._rows_count) for c in xrange(self._columns_count)
+            if state & (1 << (r * self._columns_count + c))
+        ]
+
+    def start(self, callback, period=DEFAULT_PERIOD):
+        """ Starts scanning the matrix in a background thread.
+
+        :param callback: the events notification callback, receiving the key and its
+        state (True for pressed) as parameters
+        :param int period: the scan period (ms)
+        """
+        if self._thread:
+            raise ValueError('already started')
+        self._callback = callback
+        self._period = period
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='iopi-keypad')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def terminate(self):
+        """ Stops the background scanning. """
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        period = self._period / 1000.
+        next_time = time.time()
+        while self._running:
+            for key, pressed in self.scan():
+                self._callback(key, pressed)
+            next_time += period
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.time()
+
+    def get_statistics(self):
+        """ Returns the scanner statistics.
+
+        The returned dictionary contains the following items:
+
+            scans
+                (int) number of full scans done
+            scan_rate
+                (float) average scan rate (Hz), None until at least 2 scans have been done
+            transactions_per_scan
+                (int) number of bus transactions per full scan
+            ghosting
+                (int) number of scans ignored because of ghosting ambiguity
+
+        :rtype: dict
+        """
+        elapsed = (self._last_scan_time - self._first_scan_time) if self._scans_count > 1 else 0
+        return {
+            'scans': self._scans_count,
+            'scan_rate': (self._scans_count - 1) / elapsed if elapsed else None,
+            'transactions_per_scan': 2 * self._rows_count + 1,
+            'ghosting': self._ghosting_count,
+        }
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides a scheduler for timed patterns on digital outputs, such as pulses, blinking
+or slow software PWM.
+
+All the patterns are managed by a single thread, based on a hashed timer wheel, so that handling
+a lot of concurrent patterns costs almost nothing more than handling a single one. All the output
+edges falling due at the same tick are merged, and applied with a single write per port.
+
+Here is an example of its usage with the base layer:
+
+>>> board = IOPiBoard(i2c_bus)
+>>> valve = board.get_digital_output(board.EXPANDER_1, 3)
+>>> lamp = board.get_digital_output(board.EXPANDER_1, 4)
+>>> scheduler = OutputScheduler()
+>>> scheduler.start()
+>>> ...
+>>> # open the valve during 250ms
+>>> scheduler.pulse(valve, 250)
+>>> # make the lamp blink at 2Hz
+>>> scheduler.blink(lamp, 250, 250)
+
+The :py:class:`pybot.abelec.iopi.control.IOPiController` provides equivalent methods, working with
+the outputs symbolic names.
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['OutputScheduler']
+
+import threading
+import time
+
+
+class OutputScheduler(threading.Thread):
+    """ The output patterns scheduler.
+
+    Durations are expressed in milliseconds, and are rounded to the scheduler tick. Each output
+    can run only one pattern at a time, starting a new one replacing the current one if any.
+
+    The thread sleeps while no pattern is active.
+    """
+    DEFAULT_TICK = 10
+    DEFAULT_WHEEL_SIZE = 256
+
+    def __init__(self, tick=DEFAULT_TICK, wheel_size=DEFAULT_WHEEL_SIZE):
+        """
+        :param int tick: the scheduler resolution (ms)
+        :param int wheel_size: the number of slots of the timer wheel
+        """
+        if tick <= 0:
+            raise ValueError('invalid tick (%s)' % tick)
+        if wheel_size <= 0:
+            raise ValueError('invalid wheel size (%s)' % wheel_size)
+
+        super(OutputScheduler, self).__init__(name='iopi-scheduler')
+        self.daemon = True
+
+        self._tick = tick / 1000.
+        self._wheel = [[] for _ in xrange(wheel_size)]
+        self._condition = threading.Condition()
+        self._patterns = {}
+        self._pending_count = 0
+        self._origin = time.time()
+        self._next_tick = 0
+        self._running = True
+
+        self._ticks_count = 0
+        self._edges_count = 0
+        self._writes_count = 0
+
+    @property
+    def tick(self):
+        """ The scheduler resolution (ms). """
+        return self._tick * 1000
+
+    def pulse(self, output, duration, state=1):
+        """ Changes an output state during a given time, and restores it after.
+
+        The restored state is the one the output had when the pulse was requested, or the final
+        state of the pattern running on the output, if any.
+
+        :param DigitalOutput output: the output
+        :param int duration: the pulse duration (ms)
+        :param int state: the state of the output during the pulse
+        """
+        state = 1 if state else 0
+        self._start_pattern(output, ((state, duration),), repeat=1, final_state=None)
+
+    def blink(self, output, on_time, off_time, count=None):
+        """ Makes an output blink.
+
+        The output is left cleared at the end of the sequence.
+
+        :param DigitalOutput output: the output
+        :param int on_time: the duration of the high state (ms)
+        :param int off_time: the duration of the low state (ms)
+        :param int count: the number of blinks (None for blinking until stopped)
+        """
+        self._start_pattern(output, ((1, on_time), (0, off_time)), repeat=count, final_state=0)
+
+    def pwm(self, output, period, duty):
+        """ Generates a slow PWM signal on an output.
+
+        Extreme duty cycle values give a constant state.
+
+        :param DigitalOutput output: the output
+        :param int period: the PWM period (ms)
+        :param float duty: the duty cycle (in [0, 1])
+        """
+        if not 0 <= duty <= 1:
+            raise ValueError('invalid duty cycle (%s)' % duty)
+
+        on_time = int(round(period * duty / self.tick)) * self.tick
+        if on_time <= 0 or on_time >= period:
+            self._start_pattern(output, (), repeat=0, final_state=1 if on_time > 0 else 0)
+        else:
+            self._start_pattern(output, ((1, on_time), (0, period - on_time)), repeat=None, final_state=0)
+
+    def stop(self, output, state=None):
+        """ Stops the pattern running on an output, if any.
+
+        :param DigitalOutput output: the output
+        :param int state: the state the output is set to (None to leave it as is)
+        """
+        if state is None:
+            with self._condition:
+                pattern = self._patterns.pop(output, None)
+                if pattern:
+                    pattern.active = False
+        else:
+            self._start_pattern(output, (), repeat=0, final_state=1 if state else 0)
+
+    def is_active(self, output):
+        """ Tells if a pattern is running on an output.
+
+        :param DigitalOutput output: the output
+        :rtype: bool
+        """
+        return output in self._patterns
+
+    def terminate(self):
+        """ Stops the scheduler thread, leaving the outputs in their current state. """
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def get_statistics(self):
+        """ Returns the scheduler statistics.
+
+        The returned dictionary contains the following items:
+
+            active_patterns
+                (int) number of currently running patterns
+            ticks
+                (int) number of processed ticks having at least an edge
+            edges
+                (int) number of output edges generated
+            writes
+                (int) number of port writes done
+
+        :rtype: dict
+        """
+        return {
+            'active_patterns': len(self._patterns),
+            'ticks': self._ticks_count,
+            'edges': self._edges_count,
+            'writes': self._writes_count,
+        }
+
+    def _current_tick(self):
+        return int((time.time() - self._origin) / self._tick)
+
+    def _start_pattern(self, output, phases, repeat, final_state):
+        """ Starts a pattern on an output, replacing the one running on it, if any.
+
+        A final state set to None stands for the current state of the output.
+        """
+        with self._condition:
+            previous = self._patterns.get(output)
+            if final_state is None:
+                if previous and previous.active:
+                    final_state = previous.final_state
+                else:
+                    final_state = 1 if output.port.latches & output.mask else 0
+            pattern = _Pattern(output, phases, repeat, final_state)
+            if previous:
+                previous.active = False
+            self._patterns[output] = pattern
+            current_tick = self._current_tick()
+            if not self._pending_count:
+                # we were idle, so the wheel position must be brought up to date
+                self._next_tick = max(self._next_tick, current_tick)
+            # the first edge is due immediately
+            self._schedule(pattern, current_tick)
+            self._condition.notify()
+
+    def _schedule(self, pattern, tick):
+        # never schedule in a tick already processed
+        tick = max(tick, self._next_tick)
+        self._wheel[tick % len(self._wheel)].append((tick, pattern))
+        self._pending_count += 1
+
+    def _process_tick(self, tick, edges):
+        slot = self._wheel[tick % len(self._wheel)]
+        if not slot:
+            return
+
+        # events due at later wheel turns stay in the slot
+        self._wheel[tick % len(self._wheel)] = [event for event in slot if event[0] != tick]
+        for due_tick, pattern in slot:
+            if due_tick != tick:
+                continue
+            self._pending_count -= 1
+            if not pattern.active:
+                continue
+
+            state, duration = pattern.next_edge()
+            output = pattern.output
+            mask = output.mask
+            try:
+                port_edges = edges[output.port]
+            except KeyError:
+                port_edges = edges[output.port] = [0, 0]
+            if state:
+                port_edges[0] |= mask
+                port_edges[1] &= ~mask
+            else:
+                port_edges[0] &= ~mask
+                port_edges[1] |= mask
+            self._edges_count += 1
+
+            if duration is None:
+                pattern.active = False
+                del self._patterns[output]
+            else:
+                self._schedule(pattern, tick + max(1, int(round(duration / 1000. / self._tick))))
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending_count:
+                    self._condition.wait()
+                if not self._running:
+                    break
+
+                # process the ticks elapsed since the previous iteration
+                edges = {}
+                current_tick = self._current_tick()
+                while self._next_tick <= current_tick:
+                    self._process_tick(self._next_tick, edges)
+                    self._next_tick += 1
+
+            # apply the merged edges, with a single write per port
+            if edges:
+                self._ticks_count += 1
+                for port, (set_mask, clear_mask) in edges.iteritems():
+                    port.modify_latches(set_mask, clear_mask)
+                    self._writes_count += 1
+
+            with self._condition:
+                delay = self._origin + self._next_tick * self._tick - time.time()
+                if delay > 0 and self._running:
+                    self._condition.wait(delay)
+
+
+class _Pattern(object):
+    """ A timed sequence of output states.
+
+    The pattern is made of a sequence of phases, which are repeated a given number of times
+    (or forever), after what the output is set to the final state.
+    """
+    __slots__ = ('output', 'phases', 'repeat', 'final_state', 'active', '_phase', '_cycles')
+
+    def __init__(self, output, phases, repeat, final_state):
+        """
+        :param DigitalOutput output: the output
+        :param tuple phases: a sequence of (state, duration) tuples
+        :param int repeat: the number of cycles (None for repeating forever)
+        :param int final_state: the state of the output at the end of the sequence
+        """
+        self.output = output
+        self.phases = phases
+        self.repeat = repeat
+        self.final_state = final_state
+        self.active = True
+        self._phase = 0
+        self._cycles = 0
+
+    def next_edge(self):
+        """ Returns the next state of the output, and the time it must be kept.
+
+        :return: a tuple (state, duration), the duration being None for the final state
+        """
+        if not self.phases or self.repeat is not None and self._cycles >= self.repeat:
+            return self.final_state, None
+
+        state, duration = self.phases[self._phase]
+        self._phase += 1
+        if self._phase == len(self.phases):
+            self._phase = 0
+            self._cycles += 1
+        return state, duration
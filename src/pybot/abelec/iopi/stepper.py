@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+""" This module provides a driver for unipolar stepper motors, connected to IOPi outputs through
+power drivers such as the ULN2803.
+
+The 4 coils of a motor must be wired to pins of the same port. The stepping sequences are
+precomputed as tables of whole port values, so that a step is issued by a single port write.
+Several motors can be connected to the same port, in which case the steps of all the motors
+falling due at the same time are merged in the same write.
+
+Motors are managed by a :py:class:`StepperDriver`, which runs the moves in a background thread,
+so that move commands are not blocking. Speeds are expressed in steps per second, and
+accelerations in steps per second squared.
+
+>>> board = IOPiBoard(i2c_bus)
+>>> port, _ = board.get_port(board.EXPANDER_1, 1)
+>>> driver = StepperDriver()
+>>> driver.start()
+>>> # coils on pins 1 to 4 of expander 1 header
+>>> motor = driver.add_motor(port, (0, 1, 2, 3), mode=StepperMotor.HALF_STEP, max_speed=400, acceleration=800)
+>>> motor.move(2000)
+>>> ...
+>>> motor.wait()
+"""
+
+__author__ = 'Eric Pascual'
+
+__all__ = ['StepperDriver', 'StepperMotor']
+
+import math
+import threading
+import time
+
+
+class StepperMotor(object):
+    """ A unipolar stepper motor.
+
+    Instances are created by :py:meth:`StepperDriver.add_motor` and must not be created directly.
+    """
+    WAVE_DRIVE, FULL_STEP, HALF_STEP = range(3)
+
+    # the energized coils for each step of the sequences, coils being numbered in wiring order
+    _sequences = {
+        WAVE_DRIVE: ((0,), (1,), (2,), (3,)),
+        FULL_STEP: ((0, 1), (1, 2), (2, 3), (3, 0)),
+        HALF_STEP: ((0,), (0, 1), (1,), (1, 2), (2,), (2, 3), (3,), (3, 0)),
+    }
+
+    def __init__(self, driver, port, pins, mode=FULL_STEP, max_speed=100, acceleration=None):
+        """
+        :param StepperDriver driver: the driver in charge of the motor
+        :param Port port: the port the coils are connected to
+        :param tuple pins: the port IO nums ([0-7]) of the 4 coils, in sequence order
+        :param int mode: the stepping mode (WAVE_DRIVE, FULL_STEP or HALF_STEP)
+        :param float max_speed: the maximum speed (steps/s)
+        :param float acceleration: the acceleration (steps/s^2), None for starting and stopping at full speed
+        """
+        if len(pins) != 4 or len(set(pins)) != 4 or not all(0 <= pin < 8 for pin in pins):
+            raise ValueError('invalid coil pins (%s)' % (pins,))
+        if mode not in self._sequences:
+            raise ValueError('invalid mode (%s)' % mode)
+        if max_speed <= 0:
+            raise ValueError('invalid max speed (%s)' % max_speed)
+        if acceleration is not None and acceleration <= 0:
+            raise ValueError('invalid acceleration (%s)' % acceleration)
+
+        self._driver = driver
+        self._port = port
+        self._coils_mask = reduce(lambda x, y: x | y, (1 << pin for pin in pins))
+
+        # precompute the port values of the stepping sequence
+        self._table = tuple(
+            reduce(lambda x, y: x | y, (1 << pins[coil] for coil in coils))
+            for coils in self._sequences[mode]
+        )
+
+        # precompute the steps intervals of the acceleration ramp, up to the maximum speed
+        min_interval = 1. / max_speed
+        if acceleration:
+            ramp = []
+            n = 1
+            interval = 1. / math.sqrt(2. * acceleration)
+            while interval > min_interval:
+                ramp.append(interval)
+                n += 1
+                interval = 1. / math.sqrt(2. * acceleration * n)
+            ramp.append(min_interval)
+            self._ramp = tuple(ramp)
+        else:
+            self._ramp = (min_interval,)
+
+        self._phase = 0
+        self._position = 0
+        self._target = 0
+        self._direction = 0
+        self._ramp_index = 0
+        self._next_time = None
+        self._idle = threading.Event()
+        self._idle.set()
+
+    @property
+    def port(self):
+        """ The port the motor is connected to. """
+        return self._port
+
+    @property
+    def coils_mask(self):
+        """ The mask of the port pins used by the motor. """
+        return self._coils_mask
+
+    @property
+    def position(self):
+        """ The current position (steps). """
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        """ Redefines the current position, which must be done while the motor is stopped.
+        """
+        with self._driver.condition:
+            if self.is_moving():
+                raise ValueError('cannot change the position of a moving motor')
+            self._position = self._target = position
+
+    @property
+    def target(self):
+        """ The position the motor is moving to. """
+        return self._target
+
+    @property
+    def speed(self):
+        """ The current speed (steps/s, signed according to the direction). """
+        if not self.is_moving():
+            return 0.
+        return self._direction / self._ramp[self._ramp_index]
+
+    def is_moving(self):
+        return not self._idle.is_set()
+
+    def move(self, steps):
+        """ Moves the motor by a given number of steps, and returns immediately.
+
+        :param int steps: the relative move (steps), its sign giving the direction
+        """
+        self.move_to(self._target + steps)
+
+    def move_to(self, position):
+        """ Moves the motor to a given position, and returns immediately.
+
+        If the motor is already moving, its target is changed, the motor decelerating and
+        reversing its direction if needed.
+
+        :param int position: the target position (steps)
+        """
+        self._driver.set_target(self, position)
+
+    def stop(self):
+        """ Stops the motor as soon as possible, decelerating if an acceleration is defined. """
+        with self._driver.condition:
+            if self.is_moving():
+                self._target = self._position + self._direction * self._ramp_index
+                if self._target == self._position:
+                    self._halt()
+
+    def wait(self, timeout=None):
+        """ Waits for the motor to be stopped.
+
+        :param float timeout: the maximum waiting time (s), None for waiting forever
+        :return: True if the motor is stopped
+        :rtype: bool
+        """
+        return self._idle.wait(timeout)
+
+    def release(self):
+        """ De-energizes the coils, which must be done while the motor is stopped. """
+        with self._driver.condition:
+            if self.is_moving():
+                raise ValueError('cannot release a moving motor')
+            self._port.modify_latches(0, self._coils_mask)
+
+    def _start(self, now):
+        self._direction = 1 if self._target > self._position else -1
+        self._ramp_index = 0
+        self._next_time = now
+        self._idle.clear()
+
+    def _halt(self):
+        self._direction = 0
+        self._ramp_index = 0
+        self._next_time = None
+        self._idle.set()
+
+    def _step(self, now, edges):
+        """ Issues a step, and schedules the next one.
+
+        :param float now: the current time
+        :param dict edges: the per port (set_mask, clear_mask) pairs to be written
+        """
+        self._phase = (self._phase + self._direction) % len(self._table)
+        self._position += self._direction
+
+        value = self._table[self._phase]
+        coils_mask = self._coils_mask
+        try:
+            port_edges = edges[self._port]
+        except KeyError:
+            port_edges = edges[self._port] = [0, 0]
+        port_edges[0] = (port_edges[0] & ~coils_mask) | value
+        port_edges[1] = (port_edges[1] & ~coils_mask) | (coils_mask & ~value)
+
+        remaining = (self._target - self._position) * self._direction
+        if remaining == 0:
+            self._halt()
+            return
+
+        if remaining < 0 or remaining <= self._ramp_index:
+            # target passed because of a change, or time to slow down
+            if self._ramp_index:
+                self._ramp_index -= 1
+            else:
+                # we are slow enough to reverse
+                self._direction = -self._direction
+        elif self._ramp_index < len(self._ramp) - 1:
+            self._ramp_index += 1
+
+        # don't try to catch up the lost time if we are late
+        self._next_time = max(self._next_time + self._ramp[self._ramp_index], now)
+
+
+class StepperDriver(threading.Thread):
+    """ Runs the moves of a set of stepper motors.
+
+    All the steps falling due within the same time slot (defined by ``tolerance``) are
+    merged, so that a single write is done per port.
+    """
+    DEFAULT_TOLERANCE = 0.5
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE):
+        """
+        :param float tolerance: the time slot used for merging steps (ms)
+        """
+        super(StepperDriver, self).__init__(name='iopi-stepper')
+        self.daemon = True
+
+        self._tolerance = tolerance / 1000.
+        self._motors = []
+        self._condition = threading.Condition()
+        self._running = True
+
+        self._steps_count = 0
+        self._writes_count = 0
+
+    @property
+    def condition(self):
+        """ The condition protecting the motors state. """
+        return self._condition
+
+    @property
+    def motors(self):
+        return tuple(self._motors)
+
+    def add_motor(self, port, pins, mode=StepperMotor.FULL_STEP, max_speed=100, acceleration=None):
+        """ Declares a motor, and configures the involved port pins as outputs, with the coils
+        de-energized.
+
+        See :py:class:`StepperMotor` for parameters details.
+
+        :return: the motor
+        :rtype: StepperMotor
+        :raise: ValueError if the pins are already used by another motor
+        """
+        motor = StepperMotor(self, port, pins, mode, max_speed, acceleration)
+        with self._condition:
+            for other in self._motors:
+                if other.port is port and other.coils_mask & motor.coils_mask:
+                    raise ValueError('pins already used by another motor')
+            # coils are de-energized before being turned into outputs, whatever the latches contain
+            port.apply_settings(
+                io_directions=port.io_directions & ~motor.coils_mask, latches=port.latches & ~motor.coils_mask
+            )
+            self._motors.append(motor)
+        return motor
+
+    def set_target(self, motor, position):
+        with self._condition:
+            motor._target = position
+            if not motor.is_moving() and position != motor.position:
+                motor._start(time.time())
+                self._condition.notify()
+
+    def terminate(self):
+        """ Stops the driver thread. Running moves are abruptly stopped. """
+        with self._condition:
+            self._running = False
+            for motor in self._motors:
+                if motor.is_moving():
+                    motor._halt()
+            self._condition.notify()
+
+    def get_statistics(self):
+        """ Returns the driver statistics.
+
+        The returned dictionary contains the following items:
+
+            steps
+                (int) number of steps issued
+            writes
+                (int) number of port writes done
+
+        :rtype: dict
+        """
+        return {
+            'steps': self._steps_count,
+            'writes': self._writes_count,
+        }
+
+    def run(self):
+        while True:
+            edges = {}
+            with self._condition:
+                moving = [m for m in self._motors if m.is_moving()]
+                if not self._running:
+                    break
+                if not moving:
+                    self._condition.wait()
+                    continue
+
+                now = time.time()
+                next_time = min(m._next_time for m in moving)
+                if next_time > now + self._tolerance:
+                    self._condition.wait(next_time - now)
+                    continue
+
+                for motor in moving:
+                    if motor._next_time <= now + self._tolerance:
+                        motor._step(now, edges)
+                        self._steps_count += 1
+
+            for port, (set_mask, clear_mask) in edges.iteritems():
+                port.modify_latches(set_mask, clear_mask)
+                self._writes_count += 1